@@ -0,0 +1,130 @@
+import os
+import re
+import threading
+from collections import Counter, deque
+from PyQt5.QtCore import QObject, pyqtSignal
+from project_files import containing_project, project_files
+
+WARMUP_MODULES = 30  # most-imported modules preloaded when a project opens
+WARMUP_SCAN_FILES = 2000  # project files scanned for imports
+IMPORT_RE = re.compile(r'^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w., ]+))', re.M)
+
+services = {}  # project_dir (None outside any project): AnalysisService
+
+
+class AnalysisService(QObject):
+    # One per project directory, shared by every editor on a file under it.
+    # Holds the jedi.Project so sys.path and parsed modules carry across
+    # requests and files. A single background thread serves completions,
+    # newest request only (a queued one is replaced, results for superseded
+    # ones are dropped), and spends idle time preloading the modules the
+    # project imports most.
+    finished = pyqtSignal(object, object)  # request, result (None on failure)
+
+    def __init__(self, project_dir=None):
+        super().__init__()
+        self.project_dir = project_dir
+        self.project = None  # created with the first script, jedi is slow to import
+        self.pending = {}  # kind: newest request not yet started
+        self.latest = {}  # kind: newest request
+        self.jobs = deque()  # warm-up callables, run only when no request waits
+        self.warmed = threading.Event()  # set whenever the warm-up queue drains
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, request):
+        # request: {'kind', 'editor', 'key', 'text', 'path', 'line', 'column'}
+        # with a 0-based line and character column. kind names the method
+        # that answers it, 'complete' or 'help'; each kind keeps only its
+        # newest request.
+        with self.condition:
+            self.pending[request['kind']] = self.latest[request['kind']] = request
+            self.condition.notify()
+
+    def submit(self, job):
+        with self.condition:
+            self.warmed.clear()
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def script(self, text, path=None):
+        import jedi
+        if self.project is None and self.project_dir:
+            self.project = jedi.Project(self.project_dir)
+        return jedi.Script(text, path=path or None, project=self.project)
+
+    def complete(self, text, path, line, column):
+        script = self.script(text, path)
+        return sorted({c.name for c in script.complete(line + 1, column)})
+
+    def help(self, text, path, line, column):
+        script = self.script(text, path)
+        definitions = script.help(line + 1, column)
+        return definitions[0].docstring() if definitions else ''
+
+    def warm_up(self):
+        counts = Counter()
+        for scanned, path in enumerate(project_files(self.project_dir, '.py')):
+            if scanned >= WARMUP_SCAN_FILES:
+                break
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    source = f.read()
+            except OSError:
+                continue
+            for from_module, imported in IMPORT_RE.findall(source):
+                for module in [from_module] if from_module else imported.split(','):
+                    module = module.split(' as ')[0].strip()
+                    if module and not module.startswith('.'):
+                        counts[module] += 1
+        for module, _ in counts.most_common(WARMUP_MODULES):
+            self.submit(lambda module=module: self.preload(module))
+
+    def preload(self, module):
+        # Completing attributes of the module makes Jedi find, parse and
+        # cache it the same way a real request in this project would
+        source = f'import {module}\n{module}.'
+        self.script(source).complete(2, len(module) + 1)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.jobs:
+                    self.warmed.set()
+                    self.condition.wait()
+                request = self.pending.pop(next(iter(self.pending))) if self.pending else None
+                job = self.jobs.popleft() if request is None else None
+            if job is not None:
+                try:
+                    job()
+                except Exception:
+                    pass
+                continue
+            try:
+                result = getattr(self, request['kind'])(request['text'], request['path'], request['line'], request['column'])
+            except Exception:
+                result = None
+            if request is self.latest[request['kind']]:
+                self.finished.emit(request, result)
+
+
+def analysis_service(project_dir=None):
+    service = services.get(project_dir)
+    if service is None:
+        service = services[project_dir] = AnalysisService(project_dir)
+    return service
+
+
+def open_project(project_dir):
+    project_dir = os.path.abspath(project_dir)
+    service = services.get(project_dir)
+    if service is None:
+        service = analysis_service(project_dir)
+        service.submit(service.warm_up)
+    return service
+
+
+def service_for(file_path):
+    # The innermost open project containing file_path
+    return analysis_service(containing_project(services, file_path))
@@ -1,21 +1,137 @@
 import sys
 import os
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, QAction, QTabWidget, QWidget, QVBoxLayout, QMessageBox, QInputDialog, QLineEdit, QToolBar, QSplitter, QTreeView, QFileSystemModel, QMenu, QStackedWidget, QPushButton, QLabel, QListWidget, QHBoxLayout, QStatusBar)
-from PyQt5.QtGui import QIcon
-from PyQt5.Qsci import QsciScintilla, QsciLexerPython, QsciLexerCPP, QsciLexerJavaScript
-from PyQt5.QtCore import Qt, QModelIndex, pyqtSignal
-import jedi
-from pygments.lexers import HtmlLexer, CssLexer, JavascriptLexer
+from PyQt5.QtGui import QIcon, QColor
+from PyQt5.Qsci import QsciScintilla, QsciLexerPython, QsciLexerCPP, QsciLexerJavaScript, QsciAPIs
+from PyQt5.QtCore import Qt, QModelIndex, QObject, pyqtSignal
 from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QToolTip
 import uuid
+import hashlib
+import itertools
+import random
 import threading
-import websocket
+import queue
 import json
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QApplication
+import zlib
+from collections import OrderedDict
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QApplication, QDockWidget, QListWidgetItem
 from PyQt5.QtGui import QClipboard
+from collab_doc import ClientDocument, INSERT, DELETE, apply_ops, diff_range
+from collab_wire import FileTable, decode, encode
+from analysis import open_project, service_for
+from saving import SaveService
+from search_index import open_index, index_for
+from symbol_index import open_symbols, symbols_for
+
+COLLAB_URL = 'ws://localhost:8765'
+COLLAB_BATCH_MS = 30  # local edits within this window go out as one message
+COLLAB_RECONNECT_MIN = 0.5  # seconds before the first reconnect attempt, doubling per failure
+COLLAB_RECONNECT_MAX = 30
+COLLAB_PING_SECONDS = 20  # keepalive, so a dead network is noticed without local edits
+COLLAB_CURSOR_MS = 50  # our caret and selection go out at most this often
+SC_INDICFLAG_VALUEFORE = 1  # missing from QsciScintilla: draw an indicator in its range's value colour
+REMOTE_SELECTION_ALPHA = 60
+HOVER_CACHE_SIZE = 256  # Jedi docstrings kept per editor
+KEYWORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_keywords')  # <language>.txt, one keyword per line
+APIS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'devhub', 'apis')
+LARGE_FILE_BYTES = 16 * 1024 * 1024  # files this big load in the background as plain text
+LOAD_CHUNK_BYTES = 4 * 1024 * 1024
+LOAD_CHUNKS_AHEAD = 2  # chunks read but not yet appended to the editor
+AUTOSAVE_MS = 30000  # interval for File > Autosave, off by default
+
+HOVER_DOCS = {
+    'html': {'div': 'Defines a division or section.', 'span': 'Defines a section in a document.', 'a': 'Defines a hyperlink.'},
+    'css': {'color': 'Sets the color of text.', 'background': 'Sets all background style properties at once.'},
+    'js': {'function': 'Defines a function.', 'var': 'Declares a variable.'},
+}
+
+LEXERS = {'python': QsciLexerPython, 'cpp': QsciLexerCPP, 'js': QsciLexerJavaScript}  # anything else uses Python
+
+keyword_apis = {}  # language: (owning lexer, prepared QsciAPIs) or None
+
+
+def shared_keyword_apis(language):
+    # One prepared keyword table per language for the whole process. It is
+    # owned by a lexer kept here, so it outlives any editor, and attached to
+    # each editor's own lexer. The prepared form is cached on disk under a
+    # hash of the keyword file, so editing the file rebuilds it.
+    if language in keyword_apis:
+        return keyword_apis[language] and keyword_apis[language][1]
+    try:
+        with open(os.path.join(KEYWORDS_DIR, language + '.txt'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        keyword_apis[language] = None
+        return None
+    lexer = LEXERS.get(language, QsciLexerPython)()
+    apis = QsciAPIs(lexer)
+    cache_path = os.path.join(APIS_CACHE_DIR, f'{language}-{hashlib.sha1(data).hexdigest()[:16]}.prep')
+    if not apis.loadPrepared(cache_path):
+        for word in data.decode('utf-8').split():
+            apis.add(word)
+        apis.apiPreparationFinished.connect(lambda: save_prepared_apis(apis, cache_path))
+        apis.prepare()
+    keyword_apis[language] = (lexer, apis)
+    return apis
+
+
+def remote_cursor_value(user_id):
+    # A stable colour per user, as a Scintilla indicator value
+    color = QColor.fromHsv(zlib.crc32(user_id.encode('utf-8')) % 360, 200, 210)
+    return color.red() | color.green() << 8 | color.blue() << 16 | QsciScintilla.SC_INDICVALUEBIT
+
+
+def save_prepared_apis(apis, cache_path):
+    try:
+        os.makedirs(APIS_CACHE_DIR, exist_ok=True)
+    except OSError:
+        return
+    apis.savePrepared(cache_path)
+
+
+class FileLoader(QObject):
+    # Reads a file in chunks on a background thread. The reader stays at most
+    # LOAD_CHUNKS_AHEAD chunks ahead of the editor, so a fast disk can't pile
+    # the whole file up in the event queue.
+    chunk_ready = pyqtSignal(object)  # bytes, passed through without a copy
+    finished = pyqtSignal(object)  # None, or the OSError that stopped the load
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.slots = threading.Semaphore(LOAD_CHUNKS_AHEAD)
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def consumed(self):
+        self.slots.release()
+
+    def cancel(self):
+        self.cancelled = True
+        self.slots.release()
+
+    def run(self):
+        try:
+            with open(self.file_path, 'rb') as f:
+                while True:
+                    self.slots.acquire()
+                    chunk = f.read(LOAD_CHUNK_BYTES)
+                    if self.cancelled or not chunk:
+                        break
+                    self.chunk_ready.emit(chunk)
+        except OSError as e:
+            self.finished.emit(e)
+            return
+        self.finished.emit(None)
+
 
 class CodeEditor(QsciScintilla):
+    local_edit_signal = pyqtSignal()
+
     def __init__(self, parent=None, language='python'):
         super().__init__(parent)
         self.setUtf8(True)
@@ -29,6 +145,7 @@ class CodeEditor(QsciScintilla):
         self.setCaretLineVisible(True)
         self.setCaretLineBackgroundColor(Qt.lightGray)
         self.setFolding(QsciScintilla.BoxedTreeFoldStyle)
+        self.large_file = False  # plain text: no lexer, folding, brace matching or Jedi
         self.setLexerByLanguage(language)
         self.language = language
         self.setAutoCompletionSource(QsciScintilla.AcsAll)
@@ -41,76 +158,259 @@ class CodeEditor(QsciScintilla):
         self.hover_timer.setSingleShot(True)
         self.hover_timer.timeout.connect(self.show_hover_tooltip)
         self.cursorPositionChanged.connect(self.cancel_hover)
+        # Position-based insert/delete ops (UTF-8 byte offsets) recorded from
+        # Scintilla's modification notifications, drained by the collab client
+        self.pending_ops = []
+        self.applying_remote = False
+        self.SCN_MODIFIED.connect(self.on_modified)
+        # Jedi results are cached per (completion_context, line, word start).
+        # The context changes on every edit except typing or deleting inside
+        # the word being completed, so narrowing a prefix reuses the names.
+        self.completion_context = 0
+        self.completion_anchor = None  # byte position of that word's start
+        self.completion_cache = None  # (key, names)
+        self.completion_request = None  # last request handed to the analysis service
+        self.analysis = None  # AnalysisService for file_path's project
+        self.file_path = None  # kept in sync by EditorTab
+        # Hover docstrings by (line, word start byte in line), LRU-ordered.
+        # An edit drops only the entries on its line, or on its line and
+        # everything below when it adds or removes lines.
+        self.hover_cache = OrderedDict()
+        self.text_version = 0  # bumped on every modification
+        # Other users' carets and selections, drawn with two indicators that
+        # take each range's colour from its value. Updates clear and fill
+        # just the ranges that moved, so Scintilla repaints only those lines.
+        self.remote_cursors = {}  # user_id: [caret start, caret end, selection start, selection end, value]
+        self.cursor_indicators = None  # (caret, selection), defined on first use
+
+    def on_modified(self, position, mod_type, text, length, *args):
+        if mod_type & QsciScintilla.SC_MOD_INSERTTEXT:
+            data = bytes(self.bytes(position, position + length))[:length]
+            op = (INSERT, position, data)
+        elif mod_type & QsciScintilla.SC_MOD_DELETETEXT:
+            data = None
+            op = (DELETE, position, length)
+        else:
+            return
+        self.text_version += 1
+        if self.remote_cursors:
+            self.shift_remote_cursors(position, length if data is not None else -length)
+        if self.hover_cache:
+            self.invalidate_hover(position, args[0])
+        if not self.edits_completion_word(position, data):
+            self.completion_context += 1
+        if self.applying_remote:
+            return
+        self.pending_ops.append(op)
+        self.local_edit_signal.emit()
+
+    def edits_completion_word(self, position, data):
+        anchor = self.completion_anchor
+        if anchor is None or not anchor <= position <= self.SendScintilla(QsciScintilla.SCI_WORDENDPOSITION, anchor, True):
+            return False
+        return data is None or ('_' + data.decode('utf-8', 'replace')).isidentifier()
+
+    def invalidate_hover(self, position, lines_added):
+        line = self.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+        for key in [key for key in self.hover_cache if key[0] == line or (lines_added and key[0] > line)]:
+            del self.hover_cache[key]
+
+    def take_ops(self):
+        ops = self.pending_ops
+        self.pending_ops = []
+        return ops
+
+    def apply_ops(self, ops):
+        # Apply remote ops as in-place range edits; False means the ops don't
+        # fit this buffer and the caller should fall back to full content
+        self.applying_remote = True
+        self.beginUndoAction()
+        try:
+            for kind, pos, arg in ops:
+                length = self.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+                if kind == INSERT and pos <= length:
+                    self.SendScintilla(QsciScintilla.SCI_INSERTTEXT, pos, arg)
+                elif kind == DELETE and pos + arg <= length:
+                    self.SendScintilla(QsciScintilla.SCI_DELETERANGE, pos, arg)
+                else:
+                    return False
+            return True
+        finally:
+            self.endUndoAction()
+            self.applying_remote = False
+
+    def set_remote_text(self, data):
+        # data is UTF-8. Replace just the range that differs, so the caret,
+        # selection, scroll position and folds survive and only the changed
+        # lines are re-lexed
+        length = self.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        start, old_end, new_end = diff_range(bytes(self.bytes(0, length))[:length], data)
+        if start == old_end == new_end:
+            return
+        self.applying_remote = True
+        self.beginUndoAction()
+        try:
+            self.SendScintilla(QsciScintilla.SCI_SETTARGETRANGE, start, old_end)
+            self.SendScintilla(QsciScintilla.SCI_REPLACETARGET, new_end - start, data[start:new_end])
+        finally:
+            self.endUndoAction()
+            self.applying_remote = False
+
+    def remote_cursor_indicators(self):
+        if self.cursor_indicators is None:
+            caret = self.indicatorDefine(QsciScintilla.TriangleIndicator)
+            selection = self.indicatorDefine(QsciScintilla.StraightBoxIndicator)
+            for indicator in (caret, selection):
+                self.SendScintilla(QsciScintilla.SCI_INDICSETFLAGS, indicator, SC_INDICFLAG_VALUEFORE)
+            self.SendScintilla(QsciScintilla.SCI_INDICSETALPHA, selection, REMOTE_SELECTION_ALPHA)
+            self.SendScintilla(QsciScintilla.SCI_INDICSETUNDER, selection, True)
+            self.cursor_indicators = (caret, selection)
+        return self.cursor_indicators
+
+    def set_remote_cursor(self, user_id, pos, anchor):
+        # pos and anchor are byte offsets; the caret marks the character
+        # after it, or the last one at the end of the text
+        length = self.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        pos = min(pos, length)
+        anchor = min(anchor, length)
+        caret = pos if pos < length else self.SendScintilla(QsciScintilla.SCI_POSITIONBEFORE, length)
+        ranges = [caret, self.SendScintilla(QsciScintilla.SCI_POSITIONAFTER, caret), min(pos, anchor), max(pos, anchor)]
+        old = self.remote_cursors.pop(user_id, None)
+        if old is not None:
+            if old[:4] == ranges:
+                self.remote_cursors[user_id] = old
+                return
+            self.clear_remote_ranges(old)
+        entry = self.remote_cursors[user_id] = [*ranges, old[4] if old is not None else remote_cursor_value(user_id)]
+        self.fill_remote_ranges(entry, *ranges)
+
+    def remove_remote_cursor(self, user_id):
+        entry = self.remote_cursors.pop(user_id, None)
+        if entry is not None:
+            self.clear_remote_ranges(entry)
+
+    def clear_remote_ranges(self, entry):
+        # Overlapping users share the indicators, so whatever the cleared
+        # ranges covered of the others is filled back
+        caret, selection = self.remote_cursor_indicators()
+        for indicator, start, end in ((caret, entry[0], entry[1]), (selection, entry[2], entry[3])):
+            if start < end:
+                self.SendScintilla(QsciScintilla.SCI_SETINDICATORCURRENT, indicator)
+                self.SendScintilla(QsciScintilla.SCI_INDICATORCLEARRANGE, start, end - start)
+        for other in self.remote_cursors.values():
+            self.fill_remote_ranges(other, max(other[0], entry[0]), min(other[1], entry[1]), max(other[2], entry[2]), min(other[3], entry[3]))
+
+    def fill_remote_ranges(self, entry, caret_start, caret_end, selection_start, selection_end):
+        caret, selection = self.remote_cursor_indicators()
+        for indicator, start, end in ((caret, caret_start, caret_end), (selection, selection_start, selection_end)):
+            if start < end:
+                self.SendScintilla(QsciScintilla.SCI_SETINDICATORCURRENT, indicator)
+                self.SendScintilla(QsciScintilla.SCI_SETINDICATORVALUE, entry[4])
+                self.SendScintilla(QsciScintilla.SCI_INDICATORFILLRANGE, start, end - start)
+
+    def shift_remote_cursors(self, position, change):
+        # Scintilla moves the drawn ranges with the text; this keeps our copy
+        # of them in step. An insert at a range's edge widens the range, so
+        # clearing it later covers whatever Scintilla decided to draw there.
+        for entry in self.remote_cursors.values():
+            for i, offset in enumerate(entry[:4]):
+                if change > 0:
+                    if offset > position or (offset == position and i % 2):
+                        entry[i] = offset + change
+                elif offset > position:
+                    entry[i] = max(position, offset + change)
 
     def setLexerByLanguage(self, language):
         self.language = language
-        if language == 'python':
-            lexer = QsciLexerPython()
-        elif language == 'cpp':
-            lexer = QsciLexerCPP()
-        elif language == 'js':
-            lexer = QsciLexerJavaScript()
+        old = self.lexer()
+        if self.large_file:
+            self.setLexer(None)
+            self.setAutoCompletionSource(QsciScintilla.AcsNone)
         else:
-            lexer = QsciLexerPython()
-        self.setLexer(lexer)
-        self.setup_autocompletion_keywords(language)
+            # Parented to the editor: setLexer() doesn't keep the lexer alive
+            self.setLexer(LEXERS.get(language, QsciLexerPython)(self))
+            self.setup_autocompletion_keywords(language)
+        if old is not None:
+            old.deleteLater()
+
+    def set_large_file(self):
+        self.large_file = True
+        self.setFolding(QsciScintilla.NoFoldStyle)
+        self.setBraceMatching(QsciScintilla.NoBraceMatch)
+        self.setMarginWidth(0, '00000000')
+        self.setLexerByLanguage(self.language)
 
     def setup_autocompletion_keywords(self, language):
         if language == 'python':
             self.setAutoCompletionSource(QsciScintilla.AcsAll)
             self.setAutoCompletionThreshold(1)
-        elif language == 'html':
-            html_keywords = [
-                'html', 'head', 'body', 'div', 'span', 'a', 'img', 'ul', 'li', 'table', 'tr', 'td', 'th', 'form', 'input', 'button', 'script', 'style', 'link', 'meta', 'title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'br', 'hr', 'label', 'select', 'option', 'textarea', 'iframe', 'nav', 'footer', 'header', 'section', 'article', 'main', 'aside', 'canvas', 'svg', 'video', 'audio', 'source', 'track', 'embed', 'object', 'param', 'blockquote', 'cite', 'code', 'pre', 'small', 'strong', 'em', 'b', 'i', 'u', 's', 'sub', 'sup', 'mark', 'del', 'ins', 'details', 'summary', 'figure', 'figcaption', 'fieldset', 'legend', 'datalist', 'output', 'progress', 'meter', 'template', 'noscript', 'area', 'map', 'col', 'colgroup', 'caption', 'tbody', 'thead', 'tfoot', 'address', 'abbr', 'acronym', 'applet', 'base', 'basefont', 'bdo', 'big', 'center', 'dir', 'font', 'frame', 'frameset', 'noframes', 'strike', 'tt'
-            ]
-            self.setAutoCompletionSource(QsciScintilla.AcsAPIs)
-            self.api = QsciScintilla.APIs(self.lexer())
-            for kw in html_keywords:
-                self.api.add(kw)
-            self.api.prepare()
-        elif language == 'css':
-            css_keywords = [
-                'color', 'background', 'background-color', 'width', 'height', 'margin', 'padding', 'border', 'font', 'font-size', 'font-family', 'display', 'position', 'top', 'left', 'right', 'bottom', 'float', 'clear', 'z-index', 'overflow', 'visibility', 'opacity', 'content', 'align-items', 'justify-content', 'flex', 'grid', 'gap', 'row-gap', 'column-gap', 'box-shadow', 'text-shadow', 'text-align', 'vertical-align', 'line-height', 'letter-spacing', 'word-spacing', 'white-space', 'list-style', 'cursor', 'pointer', 'transition', 'animation', 'transform', 'border-radius', 'box-sizing', 'min-width', 'max-width', 'min-height', 'max-height', 'outline', 'clip', 'filter', 'resize', 'user-select', 'object-fit', 'object-position', 'background-image', 'background-repeat', 'background-size', 'background-position', 'background-clip', 'background-origin', 'border-collapse', 'border-spacing', 'caption-side', 'empty-cells', 'table-layout', 'direction', 'unicode-bidi', 'writing-mode', 'quotes', 'counter-reset', 'counter-increment', 'content', 'page-break-before', 'page-break-after', 'page-break-inside', 'orphans', 'widows', 'columns', 'column-count', 'column-gap', 'column-rule', 'column-span', 'column-width', 'break-before', 'break-after', 'break-inside', 'will-change', 'caret-color', 'scroll-behavior', 'scroll-snap-type', 'scroll-snap-align', 'scroll-snap-stop', 'scrollbar-color', 'scrollbar-width', 'tab-size', 'text-decoration', 'text-overflow', 'text-transform', 'word-break', 'word-wrap', 'writing-mode', 'zoom'
-            ]
-            self.setAutoCompletionSource(QsciScintilla.AcsAPIs)
-            self.api = QsciScintilla.APIs(self.lexer())
-            for kw in css_keywords:
-                self.api.add(kw)
-            self.api.prepare()
-        elif language == 'js':
-            js_keywords = [
-                'break', 'case', 'catch', 'class', 'const', 'continue', 'debugger', 'default', 'delete', 'do', 'else', 'export', 'extends', 'finally', 'for', 'function', 'if', 'import', 'in', 'instanceof', 'let', 'new', 'return', 'super', 'switch', 'this', 'throw', 'try', 'typeof', 'var', 'void', 'while', 'with', 'yield', 'async', 'await', 'constructor', 'get', 'set', 'static', 'of', 'from', 'as', 'null', 'true', 'false', 'undefined', 'NaN', 'Infinity', 'arguments', 'eval', 'isFinite', 'isNaN', 'parseFloat', 'parseInt', 'decodeURI', 'decodeURIComponent', 'encodeURI', 'encodeURIComponent', 'escape', 'unescape', 'Object', 'Function', 'Boolean', 'Symbol', 'Error', 'EvalError', 'InternalError', 'RangeError', 'ReferenceError', 'SyntaxError', 'TypeError', 'URIError', 'Number', 'Math', 'Date', 'String', 'RegExp', 'Array', 'Int8Array', 'Uint8Array', 'Uint8ClampedArray', 'Int16Array', 'Uint16Array', 'Int32Array', 'Uint32Array', 'Float32Array', 'Float64Array', 'Map', 'Set', 'WeakMap', 'WeakSet', 'ArrayBuffer', 'SharedArrayBuffer', 'Atomics', 'DataView', 'JSON', 'Promise', 'Generator', 'GeneratorFunction', 'Reflect', 'Proxy', 'Intl', 'WebAssembly', 'window', 'document', 'console', 'alert', 'prompt', 'confirm', 'fetch', 'XMLHttpRequest', 'setTimeout', 'setInterval', 'clearTimeout', 'clearInterval', 'requestAnimationFrame', 'cancelAnimationFrame', 'addEventListener', 'removeEventListener', 'dispatchEvent', 'localStorage', 'sessionStorage', 'location', 'history', 'navigator', 'screen', 'frames', 'self', 'parent', 'top', 'opener', 'event', 'Image', 'Audio', 'File', 'FileReader', 'Blob', 'URL', 'Worker', 'postMessage', 'onmessage', 'close', 'open', 'print', 'stop', 'focus', 'blur', 'scroll', 'scrollTo', 'scrollBy', 'moveTo', 'moveBy', 'resizeTo', 'resizeBy', 'getComputedStyle', 'matchMedia', 'querySelector', 'querySelectorAll', 'getElementById', 'getElementsByClassName', 'getElementsByTagName', 'createElement', 'createTextNode', 'appendChild', 'removeChild', 'replaceChild', 'insertBefore', 'cloneNode', 'hasChildNodes', 'contains', 'compareDocumentPosition', 'getAttribute', 'setAttribute', 'removeAttribute', 'hasAttribute', 'attributes', 'style', 'classList', 'className', 'id', 'innerHTML', 'outerHTML', 'textContent', 'value', 'checked', 'selected', 'disabled', 'readonly', 'required', 'type', 'name', 'form', 'action', 'method', 'enctype', 'target', 'submit', 'reset', 'elements', 'length', 'options', 'selectedIndex', 'selectedOptions', 'files', 'accept', 'multiple', 'size', 'maxLength', 'minLength', 'pattern', 'placeholder', 'step', 'min', 'max', 'autocomplete', 'autofocus', 'spellcheck', 'tabIndex', 'accessKey', 'draggable', 'hidden', 'contentEditable', 'contextMenu', 'dir', 'lang', 'title', 'translate', 'dataset', 'dropzone', 'itemScope', 'itemType', 'itemId', 'itemRef', 'itemProp', 'itemValue', 'role', 'aria-*', 'data-*'
-            ]
-            self.setAutoCompletionSource(QsciScintilla.AcsAPIs)
-            self.api = QsciScintilla.APIs(self.lexer())
-            for kw in js_keywords:
-                self.api.add(kw)
-            self.api.prepare()
-        else:
+            return
+        apis = shared_keyword_apis(language)
+        if apis is None:
             self.setAutoCompletionSource(QsciScintilla.AcsNone)
+            return
+        self.setAutoCompletionSource(QsciScintilla.AcsAPIs)
+        self.lexer().setAPIs(apis)
 
     def keyPressEvent(self, event):
-        if self.language == 'python' and event.text() and event.text().isidentifier():
+        if self.language == 'python' and not self.large_file and event.text() and event.text().isidentifier():
             # Trigger Jedi completion on dot or after typing
             QTimer.singleShot(0, self.show_python_completions)
         super().keyPressEvent(event)
 
+    def completion_key(self):
+        pos = self.SendScintilla(QsciScintilla.SCI_GETCURRENTPOS)
+        start = self.SendScintilla(QsciScintilla.SCI_WORDSTARTPOSITION, pos, True)
+        line = self.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+        return (self.completion_context, line, start), pos
+
     def show_python_completions(self):
-        # Get current line and column
-        line, index = self.getCursorPosition()
-        text = self.text()
-        script = jedi.Script(text, path='')
-        try:
-            completions = script.complete(line+1, index)
-            if completions:
-                self.clearAutoCompletionWordSeparators()
-                self.autoCompleteFromAPIs()
-                self.api = QsciScintilla.APIs(self.lexer())
-                for c in completions:
-                    self.api.add(c.name)
-                self.api.prepare()
-        except Exception:
-            pass
+        # Completions for the word at the caret are computed once at the
+        # word's start and filtered by the typed prefix
+        key, pos = self.completion_key()
+        _, line, start = key
+        self.completion_anchor = start
+        if self.completion_cache is not None and self.completion_cache[0] == key:
+            self.show_completion_list(self.completion_cache[1], start, pos)
+            return
+        service = self.analysis_service()
+        request = self.completion_request
+        if request is not None and request is service.latest.get('complete') and request['key'] == key:
+            return  # still running; on_analysis shows the list for the caret then
+        line_start = self.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+        column = self.SendScintilla(QsciScintilla.SCI_COUNTCHARACTERS, line_start, start)
+        self.completion_request = {'kind': 'complete', 'editor': self, 'key': key, 'text': self.text(), 'path': self.file_path, 'line': line, 'column': column}
+        service.request(self.completion_request)
+
+    def analysis_service(self):
+        service = service_for(self.file_path)
+        if service is not self.analysis:
+            if self.analysis is not None:
+                self.analysis.finished.disconnect(self.on_analysis)
+            service.finished.connect(self.on_analysis)
+            self.analysis = service
+        return service
+
+    def on_analysis(self, request, result):
+        if request['editor'] is not self:
+            return
+        if request['kind'] == 'help':
+            self.on_hover_help(request, result)
+            return
+        names = result or []
+        self.completion_cache = (request['key'], names)
+        key, pos = self.completion_key()
+        if key == request['key'] and self.hasFocus():
+            self.show_completion_list(names, key[2], pos)
+
+    def show_completion_list(self, names, start, pos):
+        prefix = bytes(self.bytes(start, pos))[:pos - start].decode('utf-8', 'replace').lower()
+        matches = [name for name in names if name.lower().startswith(prefix)]
+        if not matches or not prefix:
+            return
+        self.SendScintilla(QsciScintilla.SCI_AUTOCSETIGNORECASE, True)
+        self.SendScintilla(QsciScintilla.SCI_AUTOCSETORDER, QsciScintilla.SC_ORDER_PERFORMSORT)
+        self.SendScintilla(QsciScintilla.SCI_AUTOCSHOW, pos - start, ' '.join(matches).encode('utf-8'))
 
     def mouseMoveEvent(self, event):
         self.last_hover_pos = event.pos()
@@ -120,48 +420,52 @@ class CodeEditor(QsciScintilla):
     def cancel_hover(self):
         self.hover_timer.stop()
 
+    def hover_key(self, pos):
+        # (line, word start byte in line, word start) under a widget point
+        char_pos = self.SendScintilla(QsciScintilla.SCI_CHARPOSITIONFROMPOINT, pos.x(), pos.y())
+        if char_pos < 0:
+            return None
+        start = self.SendScintilla(QsciScintilla.SCI_WORDSTARTPOSITION, char_pos, True)
+        if start == self.SendScintilla(QsciScintilla.SCI_WORDENDPOSITION, char_pos, True):
+            return None
+        line = self.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+        return line, start - self.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line), start
+
     def show_hover_tooltip(self):
-        if not self.last_hover_pos:
+        if not self.last_hover_pos or self.large_file:
             return
         pos = self.last_hover_pos
-        # Use SCI_CHARPOSITIONFROMPOINT to get char position
-        x, y = pos.x(), pos.y()
-        char_pos = self.SendScintilla(QsciScintilla.SCI_CHARPOSITIONFROMPOINT, x, y)
-        if char_pos < 0:
+        if self.language != 'python':
+            doc = HOVER_DOCS.get(self.language, {}).get(self.wordAtPoint(pos))
+            if doc:
+                QToolTip.showText(self.mapToGlobal(pos), doc, self)
             return
-        line = self.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, char_pos)
-        index = char_pos - self.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
-        word = self.wordAtPoint(pos)
-        if not word:
+        key = self.hover_key(pos)
+        if key is None:
             return
-        if self.language == 'python':
-            text = self.text()
-            import jedi
-            script = jedi.Script(text, path='')
-            try:
-                definitions = script.help(line+1, index)
-                if definitions:
-                    doc = definitions[0].docstring()
-                    if doc:
-                        from PyQt5.QtWidgets import QToolTip
-                        QToolTip.showText(self.mapToGlobal(pos), doc, self)
-            except Exception:
-                pass
-        elif self.language == 'html':
-            html_docs = {'div': 'Defines a division or section.', 'span': 'Defines a section in a document.', 'a': 'Defines a hyperlink.'}
-            if word in html_docs:
-                from PyQt5.QtWidgets import QToolTip
-                QToolTip.showText(self.mapToGlobal(pos), html_docs[word], self)
-        elif self.language == 'css':
-            css_docs = {'color': 'Sets the color of text.', 'background': 'Sets all background style properties at once.'}
-            if word in css_docs:
-                from PyQt5.QtWidgets import QToolTip
-                QToolTip.showText(self.mapToGlobal(pos), css_docs[word], self)
-        elif self.language == 'js':
-            js_docs = {'function': 'Defines a function.', 'var': 'Declares a variable.'}
-            if word in js_docs:
-                from PyQt5.QtWidgets import QToolTip
-                QToolTip.showText(self.mapToGlobal(pos), js_docs[word], self)
+        line, index, start = key
+        doc = self.hover_cache.get(key[:2])
+        if doc is not None:
+            self.hover_cache.move_to_end(key[:2])
+            if doc:
+                QToolTip.showText(self.mapToGlobal(pos), doc, self)
+            return
+        line_start = start - index
+        column = self.SendScintilla(QsciScintilla.SCI_COUNTCHARACTERS, line_start, start)
+        self.analysis_service().request({'kind': 'help', 'editor': self, 'key': key[:2], 'version': self.text_version, 'text': self.text(), 'path': self.file_path, 'line': line, 'column': column})
+
+    def on_hover_help(self, request, doc):
+        if doc is None or request['version'] != self.text_version:
+            return  # failed, or the text changed while Jedi was looking
+        self.hover_cache[request['key']] = doc
+        if len(self.hover_cache) > HOVER_CACHE_SIZE:
+            self.hover_cache.popitem(last=False)
+        pos = self.last_hover_pos
+        if not doc or pos is None or not self.underMouse():
+            return
+        key = self.hover_key(pos)
+        if key is not None and key[:2] == request['key']:
+            QToolTip.showText(self.mapToGlobal(pos), doc, self)
 
 class EditorTab(QWidget):
     def __init__(self, file_path=None, language='python'):
@@ -169,7 +473,11 @@ class EditorTab(QWidget):
         self.file_path = file_path
         self.language = language
         self.editor = CodeEditor(language=language)
+        self.editor.file_path = file_path
         self.modified = False
+        self.loader = None  # FileLoader while a large file is still loading
+        self.save_serial = 0  # number of its latest save request
+        self.close_after_save = None  # save_serial whose write, once it succeeds, closes the tab
         self.editor.textChanged.connect(self.on_text_changed)
         layout = QVBoxLayout()
         layout.addWidget(self.editor)
@@ -203,6 +511,9 @@ class FileExplorer(QTreeView):
 
     def set_project_dir(self, path):
         self.project_dir = path
+        open_project(path)  # starts warming Jedi for this project
+        open_index(path)  # starts building the find-in-files index
+        open_symbols(path)  # and the symbol index
         self.model.setRootPath(path)
         self.setRootIndex(self.model.index(path))
 
@@ -365,10 +676,126 @@ class SessionCreatedDialog(QDialog):
         clipboard = QApplication.clipboard()
         clipboard.setText(self.link_label.text())
 
+class SearchPanel(QWidget):
+    # Find in files: results stream in from the project's SearchIndex
+    def __init__(self, open_result_callback):
+        super().__init__()
+        self.open_result_callback = open_result_callback
+        self.index = None
+        self.request = None
+        self.query = QLineEdit()
+        self.query.setPlaceholderText('Find in files')
+        self.query.returnPressed.connect(self.run_search)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.run_search)
+        self.query.textChanged.connect(self.search_timer.start)
+        self.status = QLabel()
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.open_result)
+        layout = QVBoxLayout()
+        layout.addWidget(self.query)
+        layout.addWidget(self.status)
+        layout.addWidget(self.results)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def set_index(self, index):
+        if index is self.index:
+            return
+        if self.index is not None:
+            self.index.results.disconnect(self.on_results)
+            self.index.finished.disconnect(self.on_finished)
+        self.index = index
+        if index is not None:
+            index.results.connect(self.on_results)
+            index.finished.connect(self.on_finished)
+
+    def run_search(self):
+        self.search_timer.stop()
+        self.results.clear()
+        text = self.query.text()
+        if self.index is None:
+            self.status.setText('Open a project directory to search it')
+        elif text:
+            self.request = {'text': text}
+            self.index.search(self.request)
+        else:
+            self.request = None
+            self.status.clear()
+
+    def on_results(self, request, batch):
+        if request is not self.request:
+            return
+        for path, line, text in batch:
+            item = QListWidgetItem(f'{os.path.relpath(path, self.index.project_dir)}:{line + 1}: {text}')
+            item.setData(Qt.UserRole, (path, line))
+            self.results.addItem(item)
+
+    def on_finished(self, request, stats):
+        if request is not self.request:
+            return
+        message = f"{stats['matches']} matches in {stats['candidates']} of {stats['files']} files ({stats['seconds'] * 1e3:.0f} ms)"
+        if not self.index.ready.is_set():
+            message += ', still indexing'
+        self.status.setText(message)
+
+    def open_result(self, item):
+        self.open_result_callback(*item.data(Qt.UserRole))
+
+class SymbolDialog(QDialog):
+    # Fuzzy search over the project's symbol index, answered as you type
+    def __init__(self, index, open_location_callback, text='', parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Go to Symbol')
+        self.resize(600, 400)
+        self.index = index
+        self.open_location_callback = open_location_callback
+        self.query = QLineEdit(text)
+        self.query.setPlaceholderText('Symbol name')
+        self.query.textChanged.connect(self.refresh)
+        self.query.returnPressed.connect(self.accept_current)
+        self.status = QLabel()
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.open_item)
+        layout = QVBoxLayout()
+        layout.addWidget(self.query)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self):
+        self.results.clear()
+        matches = self.index.fuzzy(self.query.text())
+        for name, path, line, column, kind, container in matches:
+            label = f'{container}.{name}' if container else name
+            item = QListWidgetItem(f'{label}  ({kind})  {os.path.relpath(path, self.index.project_dir)}:{line}')
+            item.setData(Qt.UserRole, (path, line - 1, column))
+            self.results.addItem(item)
+        if matches:
+            self.results.setCurrentRow(0)
+        self.status.setText('' if self.index.ready.is_set() else 'Still indexing the project...')
+
+    def accept_current(self):
+        item = self.results.currentItem()
+        if item is not None:
+            self.open_item(item)
+
+    def open_item(self, item):
+        self.accept()
+        self.open_location_callback(*item.data(Qt.UserRole))
+
 class MainWindow(QMainWindow):
-    collab_update_signal = pyqtSignal(str, str)  # file_path, content
-    collab_open_file_signal = pyqtSignal(str, str)  # file_path, content
-    collab_presence_signal = pyqtSignal(list)  # user list
+    collab_update_signal = pyqtSignal(str, list, int)  # file_path, ops, version
+    collab_open_file_signal = pyqtSignal(str, bytes, int, object)  # file_path, UTF-8 content, version, our highest seq in it or None
+    collab_ack_signal = pyqtSignal(str, int)  # file_path, version
+    collab_unknown_file_signal = pyqtSignal(str)  # file_path
+    collab_presence_signal = pyqtSignal(object)  # presence message: full 'users' list or 'joined'/'left' deltas
+    collab_resumed_signal = pyqtSignal(str, int, int)  # file_path, version, highest seq the server applied
+    collab_status_signal = pyqtSignal(str)  # connection state for the status bar
+    collab_cursor_signal = pyqtSignal()  # remote cursor positions are waiting in collab_cursors_pending
 
     def __init__(self):
         super().__init__()
@@ -379,8 +806,8 @@ class MainWindow(QMainWindow):
         self.stacked = QStackedWidget()
         self.home_page = HomePage(self.open_project_from_home, self.new_file_from_home, self.open_recent_from_home, self.theme, self.create_session, self.join_session)
         self.stacked.addWidget(self.home_page)
-        self.editor_widget = QWidget()
-        self.init_editor_ui()
+        self.editor_widget = QWidget()  # filled in by init_editor_ui on first show_editor
+        self.editor_ui_ready = False
         self.stacked.addWidget(self.editor_widget)
         self.setCentralWidget(self.stacked)
         self.show_home()
@@ -388,11 +815,51 @@ class MainWindow(QMainWindow):
         self.collab_update_signal.connect(self.apply_collab_update)
         self.collab_open_file_signal.connect(self.apply_collab_open_file)
         self.collab_presence_signal.connect(self.update_presence)
-        self.open_files = {}  # file_path: tab index
+        self.collab_ack_signal.connect(self.apply_collab_ack)
+        self.collab_unknown_file_signal.connect(self.apply_collab_unknown_file)
+        self.collab_resumed_signal.connect(self.apply_collab_resumed)
+        # Open documents by path, whatever their tab's position. A shared file
+        # whose tab is closed keeps its text here, current with remote edits,
+        # so reopening it needs neither the disk copy nor a snapshot.
+        self.open_tabs = {}  # file_path: EditorTab
+        self.closed_texts = {}  # file_path: UTF-8 bytearray
+        self.collab_docs = {}  # file_path: ClientDocument, open or closed
+        self.collab_dirty_tabs = set()  # tabs with edits not yet handed to their ClientDocument
+        self.collab_send_timer = QTimer(self)
+        self.collab_send_timer.setSingleShot(True)
+        self.collab_send_timer.setInterval(COLLAB_BATCH_MS)
+        self.collab_send_timer.timeout.connect(self.flush_collab_edits)
+        self.collab_outbox = queue.Queue()  # messages for the sender thread
+        self.collab_ws = None  # current connection, None once its client is stopped
+        self.collab_stop = None  # set to end the running client's threads
+        self.collab_lock = threading.Lock()  # orders stopping against a reconnect
+        self.collab_joined = False  # welcomed on the current connection
+        self.client_id = str(uuid.uuid4())  # kept across reconnects so the server recognises our edits
+        self.collab_seq = itertools.count(1)  # numbers outgoing edit batches
+        # Our caret goes out latest-value-only, throttled to COLLAB_CURSOR_MS
+        self.collab_cursor_timer = QTimer(self)
+        self.collab_cursor_timer.setSingleShot(True)
+        self.collab_cursor_timer.setInterval(COLLAB_CURSOR_MS)
+        self.collab_cursor_timer.timeout.connect(self.send_collab_cursor)
+        self.collab_cursor_sent = None  # (file_path, pos, anchor) last sent
+        self.collab_cursor_due = False  # held back behind unsent edits
+        # Remote cursors received on the socket thread, newest per user; the
+        # UI thread takes them as one batch per signal
+        self.collab_cursors_pending = {}  # user_id: (file_path or None, pos, anchor)
+        self.collab_cursors_lock = threading.Lock()
+        self.collab_cursor_signal.connect(self.apply_collab_cursors)
+        self.remote_cursor_files = {}  # user_id: file_path their cursor is drawn in
+        self.save_service = SaveService()
+        self.save_serials = itertools.count(1)  # numbers save requests, see close_tab
+        self.save_service.finished.connect(self.on_file_saved)
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(AUTOSAVE_MS)
+        self.autosave_timer.timeout.connect(self.autosave)
         self.user_id = None
-        self.users_in_session = []
+        self.users_in_session = {}  # user_id: None, in join order
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+        self.collab_status_signal.connect(self.status_bar.showMessage)
 
     def show_home(self):
         self.home_page.set_recent(self.recent_files)
@@ -400,6 +867,8 @@ class MainWindow(QMainWindow):
         self.apply_theme()
 
     def show_editor(self):
+        if not self.editor_ui_ready:
+            self.init_editor_ui()
         self.stacked.setCurrentWidget(self.editor_widget)
         self.apply_theme()
 
@@ -425,6 +894,7 @@ class MainWindow(QMainWindow):
             self.recent_files = self.recent_files[:10]
 
     def init_editor_ui(self):
+        self.editor_ui_ready = True
         self.file_explorer = FileExplorer()
         self.file_explorer.set_file_open_callback(self.open_file_from_explorer)
         self.tabs = QTabWidget()
@@ -438,6 +908,11 @@ class MainWindow(QMainWindow):
         layout = QVBoxLayout()
         layout.addWidget(splitter)
         self.editor_widget.setLayout(layout)
+        self.search_panel = SearchPanel(self.go_to_location)
+        self.search_dock = QDockWidget('Find in Files', self)
+        self.search_dock.setWidget(self.search_panel)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.search_dock)
+        self.search_dock.hide()
         self.create_menu()
         self.create_toolbar()
         self.new_tab()
@@ -454,6 +929,9 @@ class MainWindow(QMainWindow):
         save_action.triggered.connect(self.save_file)
         saveas_action = QAction('Save As', self)
         saveas_action.triggered.connect(self.save_file_as)
+        autosave_action = QAction('Autosave', self)
+        autosave_action.setCheckable(True)
+        autosave_action.toggled.connect(self.set_autosave)
         new_action = QAction('New', self)
         new_action.triggered.connect(self.new_tab)
         file_menu.addAction(new_action)
@@ -461,6 +939,7 @@ class MainWindow(QMainWindow):
         file_menu.addAction(open_dir_action)
         file_menu.addAction(save_action)
         file_menu.addAction(saveas_action)
+        file_menu.addAction(autosave_action)
         file_menu.addSeparator()
         exit_action = QAction('Exit', self)
         exit_action.triggered.connect(self.close)
@@ -470,6 +949,18 @@ class MainWindow(QMainWindow):
         find_action = QAction('Find', self)
         find_action.triggered.connect(self.find_text)
         edit_menu.addAction(find_action)
+        find_files_action = QAction('Find in Files', self)
+        find_files_action.setShortcut('Ctrl+Shift+F')
+        find_files_action.triggered.connect(self.find_in_files)
+        edit_menu.addAction(find_files_action)
+        definition_action = QAction('Go to Definition', self)
+        definition_action.setShortcut('F12')
+        definition_action.triggered.connect(self.go_to_definition)
+        edit_menu.addAction(definition_action)
+        symbol_action = QAction('Go to Symbol', self)
+        symbol_action.setShortcut('Ctrl+T')
+        symbol_action.triggered.connect(lambda: self.go_to_symbol())
+        edit_menu.addAction(symbol_action)
 
         view_menu = menubar.addMenu('View')
         theme_action = QAction('Toggle Theme', self)
@@ -503,7 +994,7 @@ class MainWindow(QMainWindow):
         idx = self.tabs.addTab(tab, 'Untitled')
         self.tabs.setCurrentIndex(idx)
         self.apply_theme_to_tab(tab)
-        tab.editor.textChanged.connect(self.on_editor_text_changed_collab)
+        tab.editor.local_edit_signal.connect(self.on_editor_text_changed_collab)
 
     def open_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, 'Open File', '', 'All Files (*);;Python (*.py);;C++ (*.cpp *.h);;JavaScript (*.js)')
@@ -511,24 +1002,82 @@ class MainWindow(QMainWindow):
             self.open_file_by_path(file_path)
 
     def open_file_by_path(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+        tab = self.find_tab(file_path)
+        if tab is not None:
+            self.tabs.setCurrentWidget(tab)
+            return
+        closed_text = self.closed_texts.pop(file_path, None)
+        large = closed_text is None and os.path.getsize(file_path) >= LARGE_FILE_BYTES
         language = self.detect_language(file_path)
         tab = EditorTab(file_path=file_path, language=language)
-        tab.editor.setText(text)
-        idx = self.tabs.addTab(tab, os.path.basename(file_path))
-        self.tabs.setCurrentIndex(idx)
-        self.apply_theme_to_tab(tab)
+        if large:
+            tab.editor.set_large_file()
+        elif closed_text is not None:
+            # Still shared: the session's copy, not the one on disk
+            tab.editor.set_remote_text(bytes(closed_text))
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            tab.editor.setText(text)
+            tab.editor.take_ops()  # loading from disk isn't an edit to share
+        self.add_tab(tab)
         self.add_recent(file_path)
-        self.open_files[file_path] = idx
-        tab.editor.textChanged.connect(self.on_editor_text_changed_collab)
+        if large:
+            # Large files stay local even in a collab session
+            self.load_large_file(tab)
+            return
         # If in collab session, broadcast file open
-        if hasattr(self, 'collab_ws') and self.collab_ws and self.collab_ws.sock and self.collab_ws.sock.connected:
-            msg = json.dumps({'type': 'open_file', 'file_path': file_path, 'content': text, 'session_id': self.session_id})
-            try:
-                self.collab_ws.send(msg)
-            except Exception:
-                pass
+        if closed_text is None and self.collab_connected():
+            self.share_collab_file(file_path, tab.editor.text())
+
+    def add_tab(self, tab):
+        self.open_tabs[tab.file_path] = tab
+        idx = self.tabs.addTab(tab, os.path.basename(tab.file_path))
+        self.tabs.setCurrentIndex(idx)
+        self.apply_theme_to_tab(tab)
+        tab.editor.local_edit_signal.connect(self.on_editor_text_changed_collab)
+
+    def load_large_file(self, tab):
+        editor = tab.editor
+        editor.setReadOnly(True)
+        editor.SendScintilla(QsciScintilla.SCI_SETUNDOCOLLECTION, False)
+        # QScintilla's modification handler makes every append cost time
+        # proportional to the document so far; loading is not an edit anyway
+        tab.load_event_mask = editor.SendScintilla(QsciScintilla.SCI_GETMODEVENTMASK)
+        editor.SendScintilla(QsciScintilla.SCI_SETMODEVENTMASK, 0)
+        tab.load_size = os.path.getsize(tab.file_path)
+        tab.loader = FileLoader(tab.file_path)
+        tab.loader.chunk_ready.connect(lambda chunk: self.append_file_chunk(tab, chunk))
+        tab.loader.finished.connect(lambda error: self.finish_large_file(tab, error))
+        tab.loader.start()
+
+    def append_file_chunk(self, tab, chunk):
+        if tab.loader.cancelled:
+            return
+        editor = tab.editor
+        editor.setReadOnly(False)
+        editor.SendScintilla(QsciScintilla.SCI_APPENDTEXT, len(chunk), chunk)
+        editor.setReadOnly(True)
+        tab.loader.consumed()
+        loaded = editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        self.status_bar.showMessage(f'Loading {os.path.basename(tab.file_path)}: {loaded * 100 // max(tab.load_size, 1)}%')
+
+    def finish_large_file(self, tab, error):
+        cancelled = tab.loader.cancelled
+        tab.loader = None
+        if cancelled:
+            return  # tab was closed
+        editor = tab.editor
+        editor.SendScintilla(QsciScintilla.SCI_SETMODEVENTMASK, tab.load_event_mask)
+        editor.SendScintilla(QsciScintilla.SCI_SETUNDOCOLLECTION, True)
+        editor.SendScintilla(QsciScintilla.SCI_EMPTYUNDOBUFFER)
+        editor.setReadOnly(False)
+        tab.set_saved()
+        name = os.path.basename(tab.file_path)
+        if error is not None:
+            self.status_bar.showMessage(f'Could not finish loading {name}: {error}')
+        else:
+            self.status_bar.showMessage(f'Opened {name} in large-file mode (no highlighting, folding or completion; not shared)')
 
     def open_file_from_explorer(self, file_path):
         self.open_file_by_path(file_path)
@@ -541,39 +1090,112 @@ class MainWindow(QMainWindow):
             self.add_recent(dir_path)
 
     def save_file(self):
+        # True if a save was started; it reports back through on_file_saved
         tab = self.tabs.currentWidget()
+        if tab.loader is not None:
+            self.status_bar.showMessage(f'{os.path.basename(tab.file_path)} is still loading')
+            return False
         if tab.file_path:
-            with open(tab.file_path, 'w', encoding='utf-8') as f:
-                f.write(tab.editor.text())
-            self.tabs.setTabText(self.tabs.currentIndex(), os.path.basename(tab.file_path))
-            if hasattr(tab, 'set_saved'):
-                tab.set_saved()
-        else:
-            self.save_file_as()
+            self.save_tab(tab)
+            return True
+        return self.save_file_as()
 
     def save_file_as(self):
         tab = self.tabs.currentWidget()
         file_path, _ = QFileDialog.getSaveFileName(self, 'Save File As', '', 'All Files (*);;Python (*.py);;C++ (*.cpp *.h);;JavaScript (*.js)')
         if file_path:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(tab.editor.text())
+            if tab.file_path and self.open_tabs.get(tab.file_path) is tab:
+                del self.open_tabs[tab.file_path]
+            self.open_tabs[file_path] = tab
             tab.file_path = file_path
+            tab.editor.file_path = file_path
             ext = file_path.split('.')[-1]
             tab.language = 'python' if ext == 'py' else 'cpp' if ext in ['cpp', 'h'] else 'js' if ext == 'js' else 'python'
             tab.editor.setLexerByLanguage(tab.language)
             self.tabs.setTabText(self.tabs.currentIndex(), os.path.basename(file_path))
+            self.save_tab(tab)
+            return True
+        return False
+
+    def save_tab(self, tab):
+        # Only the snapshot is taken here; SaveService writes it on its own
+        # thread, atomically, and reports back through on_file_saved
+        editor = tab.editor
+        length = editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        data = bytes(editor.bytes(0, length))[:length]
+        tab.save_serial = next(self.save_serials)
+        self.save_service.save({'path': tab.file_path, 'data': data, 'tab': tab, 'version': editor.text_version, 'serial': tab.save_serial})
+
+    def on_file_saved(self, request, error):
+        tab = request['tab']
+        name = os.path.basename(request['path'])
+        # Reports of saves requested before a pending close don't settle it
+        closing = tab.close_after_save is not None and request['serial'] >= tab.close_after_save
+        if closing:
+            tab.close_after_save = None
+        if error is not None:
+            tab.modified = True  # and open, if it was closing, showing the error
+            self.status_bar.showMessage(f'Could not save {name}: {error}')
+            return
+        # Still saved only if nothing changed since the snapshot
+        if tab.file_path == request['path'] and tab.editor.text_version == request['version']:
+            tab.set_saved()
+        index = index_for(request['path'])
+        if index is not None:
+            index.update(request['path'])
+        symbols = symbols_for(request['path'])
+        if symbols is not None:
+            symbols.update(request['path'])
+        index = self.tabs.indexOf(tab)
+        if index != -1:
+            self.tabs.setTabText(index, name)
+            if closing and not tab.modified:
+                # Left open if it was edited again while being written
+                self.remove_tab(tab)
+
+    def set_autosave(self, enabled):
+        if enabled:
+            self.autosave_timer.start()
+        else:
+            self.autosave_timer.stop()
+
+    def autosave(self):
+        for i in range(self.tabs.count()):
+            tab = self.tabs.widget(i)
+            if tab.modified and tab.file_path and tab.loader is None:
+                self.save_tab(tab)
 
     def close_tab(self, index):
         tab = self.tabs.widget(index)
-        if tab and getattr(tab, 'modified', False):
+        if tab is None:
+            return
+        if tab.modified:
             reply = QMessageBox.question(self, 'Unsaved Changes', 'This file has unsaved changes. Save before closing?', QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.Yes)
             if reply == QMessageBox.Yes:
                 self.tabs.setCurrentIndex(index)
-                self.save_file()
-                tab.set_saved()
+                if self.save_file():
+                    # Closed by on_file_saved once the write has succeeded
+                    tab.close_after_save = tab.save_serial
+                return
             elif reply == QMessageBox.Cancel:
                 return
-        self.tabs.removeTab(index)
+        self.remove_tab(tab)
+
+    def remove_tab(self, tab):
+        if tab.loader is not None:
+            tab.loader.cancel()
+        if tab.file_path and self.open_tabs.get(tab.file_path) is tab:
+            del self.open_tabs[tab.file_path]
+            doc = self.collab_docs.get(tab.file_path)
+            if doc is not None:
+                # Unsent edits go to the document first; it keeps syncing
+                # without an editor until the file is opened again
+                self.collab_dirty_tabs.discard(tab)
+                doc.local(tab.editor.take_ops())
+                self.send_collab_ops(tab.file_path, doc)
+                length = tab.editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+                self.closed_texts[tab.file_path] = bytearray(tab.editor.bytes(0, length))[:length]
+        self.tabs.removeTab(self.tabs.indexOf(tab))
         if self.tabs.count() == 0:
             self.show_home()
 
@@ -588,6 +1210,50 @@ class MainWindow(QMainWindow):
             if not pos:
                 QMessageBox.information(self, 'Find', f'"{text}" not found.')
 
+    def find_in_files(self):
+        project_dir = self.file_explorer.project_dir
+        self.search_panel.set_index(open_index(project_dir) if project_dir else None)
+        self.search_dock.show()
+        self.search_panel.query.setFocus()
+        self.search_panel.query.selectAll()
+
+    def go_to_location(self, file_path, line, column=0):
+        self.open_file_by_path(file_path)
+        editor = self.tabs.currentWidget().editor
+        editor.setCursorPosition(line, column)
+        editor.ensureLineVisible(line)
+        editor.setFocus()
+
+    def symbol_index(self):
+        tab = self.tabs.currentWidget()
+        index = symbols_for(tab.file_path) if tab is not None else None
+        if index is None and self.file_explorer.project_dir:
+            index = open_symbols(self.file_explorer.project_dir)
+        return index
+
+    def go_to_symbol(self, text=''):
+        index = self.symbol_index()
+        if index is None:
+            self.status_bar.showMessage('Open a project directory to search its symbols')
+            return
+        SymbolDialog(index, self.go_to_location, text, self).exec_()
+
+    def go_to_definition(self):
+        tab = self.tabs.currentWidget()
+        index = self.symbol_index()
+        if tab is None or index is None:
+            return
+        line, column = tab.editor.getCursorPosition()
+        name = tab.editor.wordAtLineIndex(line, column)
+        found = index.definitions(name, near=tab.file_path) if name else []
+        if not found:
+            self.status_bar.showMessage(f'No definition of {name} found' if name else 'No name under the cursor')
+        elif len(found) == 1 or found[0][0] == tab.file_path:
+            path, line, column = found[0][:3]
+            self.go_to_location(path, line - 1, column)
+        else:
+            self.go_to_symbol(name)
+
     def toggle_theme(self):
         self.theme = 'dark' if self.theme == 'light' else 'light'
         self.apply_theme()
@@ -597,9 +1263,10 @@ class MainWindow(QMainWindow):
             self.setStyleSheet('QMainWindow { background: #232629; color: #f8f8f2; } QTabWidget::pane { border: 1px solid #444; } QTabBar::tab { background: #444; color: #f8f8f2; } QTabBar::tab:selected { background: #232629; } QToolBar { background: #232629; color: #f8f8f2; }')
         else:
             self.setStyleSheet('')
-        for i in range(self.tabs.count()):
-            self.apply_theme_to_tab(self.tabs.widget(i))
-        self.file_explorer.apply_theme(self.theme)
+        if self.editor_ui_ready:
+            for i in range(self.tabs.count()):
+                self.apply_theme_to_tab(self.tabs.widget(i))
+            self.file_explorer.apply_theme(self.theme)
         self.home_page.apply_theme(self.theme)
 
     def apply_theme_to_tab(self, tab):
@@ -610,36 +1277,68 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         # Check all tabs for unsaved changes
-        for i in range(self.tabs.count()):
+        saving = []
+        for i in range(self.tabs.count() if self.editor_ui_ready else 0):
             tab = self.tabs.widget(i)
             if tab and getattr(tab, 'modified', False):
                 self.tabs.setCurrentIndex(i)
                 reply = QMessageBox.question(self, 'Unsaved Changes', 'One or more files have unsaved changes. Save before exiting?', QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.Yes)
                 if reply == QMessageBox.Yes:
-                    self.save_file()
-                    tab.set_saved()
+                    if not self.save_file():
+                        event.ignore()
+                        return
+                    saving.append(tab)
                 elif reply == QMessageBox.Cancel:
                     event.ignore()
                     return
         reply = QMessageBox.question(self, 'Exit', 'Are you sure you want to exit?', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
+            self.save_service.wait()  # saves still being written
+            failed = [tab for tab in saving if tab.file_path in self.save_service.failed]
+            if failed:
+                # on_file_saved marks them modified and shows the error
+                names = ', '.join(os.path.basename(tab.file_path) for tab in failed)
+                QMessageBox.warning(self, 'Save Failed', f'Could not save {names}. The editor stays open.')
+                event.ignore()
+                return
             event.accept()
         else:
             event.ignore()
 
-    def start_collab_client(self):
-        self.collab_ws = websocket.WebSocketApp(
-            'ws://localhost:8765',
-            on_open=self.on_collab_open,
-            on_message=self.on_collab_message,
-            on_close=self.on_collab_close,
-            on_error=self.on_collab_error
-        )
-        self.collab_thread = threading.Thread(target=self.collab_ws.run_forever, daemon=True)
+    def start_collab_client(self, url=COLLAB_URL):
+        # One client per window: joining another session ends the last one
+        first = self.collab_stop is None
+        self.stop_collab_client()
+        self.collab_stop = threading.Event()
+        self.collab_outbox = queue.Queue()
+        self.collab_thread = threading.Thread(target=self.run_collab_client, args=(url, self.collab_stop), daemon=True)
         self.collab_thread.start()
-        self._collab_ignore_next = False
+        self.collab_sender = threading.Thread(target=self.run_collab_sender, args=(self.collab_outbox, self.collab_stop), daemon=True)
+        self.collab_sender.start()
         self.connect_editor_signal()
-        self.tabs.currentChanged.connect(self.connect_editor_signal)
+        if first:
+            self.tabs.currentChanged.connect(self.connect_editor_signal)
+
+    def stop_collab_client(self):
+        # Its threads exit at their next wakeup; the files it shared become
+        # plain local files, and a closed one opens from disk again
+        if self.collab_stop is None:
+            return
+        with self.collab_lock:
+            self.collab_stop.set()
+            ws, self.collab_ws = self.collab_ws, None
+            self.collab_joined = False
+        if ws is not None:
+            ws.close()
+        self.collab_outbox.put(None)  # wakes the sender
+        self.collab_docs.clear()
+        self.closed_texts.clear()
+        self.collab_dirty_tabs.clear()
+        for user_id in list(self.remote_cursor_files):
+            self.remove_remote_cursor(user_id)
+        with self.collab_cursors_lock:
+            self.collab_cursors_pending = {}
+        self.users_in_session = {}
 
     def create_session(self):
         session_id = str(uuid.uuid4())
@@ -658,87 +1357,352 @@ class MainWindow(QMainWindow):
 
 
 
+    def run_collab_client(self, url, stop):
+        # Reconnects until stop is set, backing off exponentially with
+        # jitter while the server stays unreachable. Local edits made in the
+        # meantime wait in each file's ClientDocument and go out once the
+        # server has replayed what we missed.
+        import websocket
+        self.collab_reconnect_delay = COLLAB_RECONNECT_MIN
+        while True:
+            ws = websocket.WebSocketApp(
+                url,
+                on_open=self.on_collab_open,
+                on_message=self.on_collab_message,
+                on_close=self.on_collab_close,
+                on_error=self.on_collab_error
+            )
+            with self.collab_lock:
+                if stop.is_set():
+                    return
+                self.collab_ws = ws
+            ws.run_forever(ping_interval=COLLAB_PING_SECONDS, ping_timeout=COLLAB_PING_SECONDS / 2)
+            with self.collab_lock:
+                if stop.is_set():
+                    return
+                self.collab_joined = False
+            delay = self.collab_reconnect_delay * random.uniform(0.5, 1)
+            self.collab_status_signal.emit(f'Collaboration server unreachable, reconnecting in {delay:.1f}s')
+            if stop.wait(delay):
+                return
+            self.collab_reconnect_delay = min(self.collab_reconnect_delay * 2, COLLAB_RECONNECT_MAX)
+
     def on_collab_open(self, ws):
-        join_msg = json.dumps({'type': 'join', 'session_id': self.session_id})
+        if ws is not self.collab_ws:
+            ws.close()  # connected just as its client was stopped
+            return
+        self.collab_reconnect_delay = COLLAB_RECONNECT_MIN
+        self.snapshot_parts = {}  # (file_path, version): chunks received so far
+        self.collab_wire = 'json'  # switched by the server's welcome
+        self.collab_files = FileTable()
+        # Whatever was queued for the previous connection is covered by the resume
+        try:
+            while True:
+                self.collab_outbox.get_nowait()
+        except queue.Empty:
+            pass
+        # The version we have of every shared file, so the server replays
+        # only what we missed; None for a share still waiting on its reply
+        resume = [[file_path, None if doc.inflight == [] else doc.version] for file_path, doc in list(self.collab_docs.items())]
+        self.collab_cursor_sent = None
+        self.collab_cursor_due = True  # sent again once the resume has settled
+        join_msg = json.dumps({'type': 'join', 'session_id': self.session_id, 'client_id': self.client_id, 'resume': resume, 'snapshot': ['zlib', 'chunks'], 'wire': ['binary']})
         ws.send(join_msg)
 
     def on_collab_message(self, ws, message):
-        data = json.loads(message)
+        if ws is not self.collab_ws:
+            return  # from a stopped client
+        data = decode(message, self.collab_files.paths)
         if data.get('type') == 'edit':
             file_path = data.get('file_path')
-            content = data.get('content')
-            self.collab_update_signal.emit(file_path, content)
+            if data.get('user_id') == self.client_id:
+                # Our own edit replayed on resume: it reached the server
+                self.collab_ack_signal.emit(file_path, data['version'])
+            else:
+                self.collab_update_signal.emit(file_path, data['ops'], data['version'])
         elif data.get('type') == 'open_file':
             file_path = data.get('file_path')
-            content = data.get('content')
-            self.collab_open_file_signal.emit(file_path, content)
+            content = data.get('content').encode('utf-8')
+            self.collab_open_file_signal.emit(file_path, content, data.get('version', 0), data.get('seq'))
+        elif data.get('type') == 'snapshot_chunk':
+            key = (data['file_path'], data['version'])
+            parts = self.snapshot_parts.setdefault(key, [])
+            parts.append(data['data'])
+            if len(parts) == data['count']:
+                del self.snapshot_parts[key]
+                content = zlib.decompress(b''.join(parts))
+                self.collab_open_file_signal.emit(data['file_path'], content, data['version'], data.get('seq'))
+        elif data.get('type') == 'ack':
+            self.collab_ack_signal.emit(data['file_path'], data['version'])
+        elif data.get('type') == 'unknown_file':
+            self.collab_unknown_file_signal.emit(data['file_path'])
+        elif data.get('type') == 'resumed':
+            self.collab_resumed_signal.emit(data['file_path'], data['version'], data['seq'])
+        elif data.get('type') == 'welcome':
+            self.collab_wire = data['wire']
+            self.collab_joined = True
+            self.collab_status_signal.emit('Connected to collaboration server')
+        elif data.get('type') == 'file_id':
+            self.collab_files.define(data['file_id'], data['file_path'])
         elif data.get('type') == 'presence':
-            users = data.get('users', [])
-            self.collab_presence_signal.emit(users)
+            self.collab_presence_signal.emit(data)
+        elif data.get('type') == 'cursor' and data.get('user_id') != self.client_id:
+            with self.collab_cursors_lock:
+                first = not self.collab_cursors_pending
+                self.collab_cursors_pending[data['user_id']] = (data['file_path'], data.get('pos'), data.get('anchor'))
+            if first:
+                self.collab_cursor_signal.emit()
 
     def on_collab_close(self, ws, *args):
-        pass
+        if ws is self.collab_ws:
+            self.collab_joined = False
 
     def on_collab_error(self, ws, error):
-        print('Collab error:', error)
-
-    def apply_collab_update(self, file_path, content):
-        # Only update if this file is open and current
-        idx = self.open_files.get(file_path)
-        if idx is not None and self.tabs.currentIndex() == idx:
-            editor = self.tabs.widget(idx).editor
-            if editor.text() != content:
-                cursor = editor.getCursorPosition()
-                self._collab_ignore_next = True
-                editor.setText(content)
-                editor.setCursorPosition(*cursor)
-
-    def apply_collab_open_file(self, file_path, content):
-        # If file is already open, switch to it; else open new tab
-        idx = self.open_files.get(file_path)
-        if idx is not None:
-            self.tabs.setCurrentIndex(idx)
+        self.collab_status_signal.emit(f'Collaboration error: {error}')
+
+    def find_tab(self, file_path):
+        return self.open_tabs.get(file_path)
+
+    def apply_collab_update(self, file_path, ops, version):
+        # Background tabs take edits like the current one; a hidden editor
+        # only restyles what it paints, when it is shown
+        doc = self.collab_docs.get(file_path)
+        if doc is None or version <= doc.version:
+            # Unknown file, or ops already covered by a newer snapshot
+            return
+        tab = self.find_tab(file_path)
+        if tab is None:
+            try:
+                apply_ops(self.closed_texts[file_path], doc.remote(ops, version))
+            except (KeyError, ValueError):
+                self.send_collab_message({'type': 'sync', 'file_path': file_path, 'session_id': self.session_id})
+            return
+        # Unsent local edits must be in the buffer to be transformed
+        doc.local(tab.editor.take_ops())
+        try:
+            ops = doc.remote(ops, version)
+        except ValueError:
+            ops = None  # don't fit our copy of the server's text
+        if ops is None or not tab.editor.apply_ops(ops):
+            # Our copy diverged from the server's; ask for a snapshot
+            self.send_collab_message({'type': 'sync', 'file_path': file_path, 'session_id': self.session_id})
+
+    def apply_collab_ack(self, file_path, version):
+        doc = self.collab_docs.get(file_path)
+        if doc is None or version < doc.version or (version == doc.version and doc.inflight != []):
+            # Already covered by a newer snapshot, which can overtake an ack
+            # held back for the log flush; only a held share is acked at
+            # the version it already has
+            return
+        doc.ack(version)
+        self.send_collab_ops(file_path, doc)
+        self.resume_collab_cursor()
+
+    def apply_collab_resumed(self, file_path, version, seq):
+        # The server has replayed everything we missed of file_path
+        doc = self.collab_docs.get(file_path)
+        if doc is None:
+            return
+        if doc.inflight and doc.seq > seq:
+            # Lost with the old connection; by now it is transformed past the
+            # replayed edits, so it goes again against the current version
+            self.send_collab_message({'type': 'edit', 'file_path': file_path, 'ops': doc.inflight, 'version': doc.version, 'seq': doc.seq, 'session_id': self.session_id})
         else:
+            self.send_collab_ops(file_path, doc)
+        self.resume_collab_cursor()
+
+    def apply_collab_unknown_file(self, file_path):
+        tab = self.find_tab(file_path)
+        if tab is not None:
+            self.share_collab_file(file_path, tab.editor.text())
+        elif file_path in self.closed_texts:
+            self.share_collab_file(file_path, self.closed_texts[file_path].decode('utf-8', 'replace'))
+
+    def apply_collab_open_file(self, file_path, content, version, seq):
+        # A file shared by someone else opens in a new tab. A snapshot of one
+        # we have replaces its text where it is, a closed one included, with
+        # our edits the server has not seen yet rebased onto it
+        doc = self.collab_docs.get(file_path)
+        tab = self.find_tab(file_path)
+        local_ops = tab.editor.take_ops() if tab is not None else []
+        ops = None
+        text = content
+        if doc is None:
+            # Edits to a file we had not shared are overwritten
+            doc = self.collab_docs[file_path] = ClientDocument(version, content)
+        else:
+            doc.local(local_ops)
+            try:
+                ops = doc.rebase(content, version, seq)
+                text = bytearray(content)
+                apply_ops(text, doc.buffer)
+            except ValueError:
+                # Our copy was out of step with the server's; its copy wins
+                doc.reset(version, content)
+                ops = None
+                text = content
+        if file_path in self.closed_texts:
+            self.closed_texts[file_path] = bytearray(text)
+        elif tab is None:
             tab = EditorTab(file_path=file_path, language=self.detect_language(file_path))
-            tab.editor.setText(content)
-            idx = self.tabs.addTab(tab, os.path.basename(file_path))
-            self.tabs.setCurrentIndex(idx)
-            self.open_files[file_path] = idx
-            self.apply_theme_to_tab(tab)
-        # Connect editor signal for this tab
-        self.tabs.widget(idx).editor.textChanged.connect(self.on_editor_text_changed_collab)
+            tab.editor.set_remote_text(bytes(text))
+            self.add_tab(tab)
+        elif ops is None or not tab.editor.apply_ops(ops):
+            tab.editor.set_remote_text(bytes(text))
+        self.send_collab_ops(file_path, doc)
+        self.resume_collab_cursor()
 
     def detect_language(self, file_path):
         ext = file_path.split('.')[-1]
         return 'python' if ext == 'py' else 'cpp' if ext in ['cpp', 'h'] else 'js' if ext == 'js' else 'python'
 
+    def collab_connected(self):
+        return self.collab_joined
+
+    def send_collab_message(self, msg):
+        if self.collab_connected():
+            self.collab_outbox.put(msg)
+
+    def run_collab_sender(self, outbox, stop):
+        # Encodes and writes on its own thread so the UI never waits on the socket
+        import websocket
+        while True:
+            msg = outbox.get()
+            if stop.is_set():
+                return
+            if not self.collab_joined:
+                continue  # the resume after the next join covers it
+            try:
+                frame = encode(msg, self.collab_wire, self.collab_files.ids)
+                if isinstance(frame, bytes):
+                    self.collab_ws.send(frame, opcode=websocket.ABNF.OPCODE_BINARY)
+                else:
+                    self.collab_ws.send(frame)
+            except Exception:
+                pass
+
+    def send_collab_ops(self, file_path, doc):
+        if not self.collab_connected():
+            return  # kept in doc.buffer until the resume
+        ops = doc.outgoing(next(self.collab_seq))
+        if ops is not None:
+            self.send_collab_message({'type': 'edit', 'file_path': file_path, 'ops': ops, 'version': doc.version, 'seq': doc.seq, 'session_id': self.session_id})
+
+    def share_collab_file(self, file_path, text):
+        # Server replies with an ack (new document) or a snapshot (already shared)
+        doc = self.collab_docs[file_path] = ClientDocument(0, text.encode('utf-8'))
+        doc.hold()
+        self.send_collab_message({'type': 'open_file', 'file_path': file_path, 'content': text, 'session_id': self.session_id})
+
     def on_editor_text_changed_collab(self):
-        if getattr(self, '_collab_ignore_next', False):
-            self._collab_ignore_next = False
-            return
-        if hasattr(self, 'collab_ws') and self.collab_ws and self.collab_ws.sock and self.collab_ws.sock.connected:
-            tab = self.tabs.currentWidget()
-            if tab and hasattr(tab, 'file_path'):
-                content = tab.editor.text()
-                msg = json.dumps({'type': 'edit', 'file_path': tab.file_path, 'content': content, 'session_id': self.session_id})
-                try:
-                    self.collab_ws.send(msg)
-                except Exception:
-                    pass
-
-    def update_presence(self, users):
-        self.users_in_session = users
+        editor = self.sender()
+        tab = self.find_tab(editor.file_path)
+        if tab is None or tab.editor is not editor or (tab.file_path not in self.collab_docs and not self.collab_connected()):
+            # Untitled, or not shared with a session to share it with:
+            # nothing would ever send these ops
+            editor.take_ops()
+            return
+        self.collab_dirty_tabs.add(tab)
+        if not self.collab_send_timer.isActive():
+            self.collab_send_timer.start()
+
+    def flush_collab_edits(self):
+        tabs, self.collab_dirty_tabs = self.collab_dirty_tabs, set()
+        for tab in tabs:
+            # A remote edit may already have moved these ops into the buffer
+            ops = tab.editor.take_ops()
+            if not tab.file_path or tab.editor.large_file:
+                continue
+            doc = self.collab_docs.get(tab.file_path)
+            if doc is None:
+                if ops and self.collab_connected():
+                    # First edit to a file opened before joining: share it whole
+                    self.share_collab_file(tab.file_path, tab.editor.text())
+                continue
+            doc.local(ops)  # buffered while offline
+            self.send_collab_ops(tab.file_path, doc)
+
+    def on_collab_cursor_moved(self, *args):
+        if not self.collab_cursor_timer.isActive():
+            self.collab_cursor_timer.start()
+
+    def resume_collab_cursor(self):
+        if self.collab_cursor_due and not self.collab_cursor_timer.isActive():
+            self.collab_cursor_due = False
+            self.collab_cursor_timer.start()
+
+    def send_collab_cursor(self):
+        if not self.collab_connected():
+            return
+        tab = self.tabs.currentWidget()
+        doc = self.collab_docs.get(tab.file_path) if tab is not None else None
+        if doc is None:
+            cursor = (None,)
+        elif doc.inflight == [] or tab.editor.pending_ops or doc.buffer or tab in self.collab_dirty_tabs:
+            # Not shared yet, or positions count our unsent edits; wait until
+            # the server has them, so others never see the caret ahead of the text
+            self.collab_cursor_due = True
+            return
+        else:
+            editor = tab.editor
+            cursor = (tab.file_path, editor.SendScintilla(editor.SCI_GETCURRENTPOS), editor.SendScintilla(editor.SCI_GETANCHOR))
+        if cursor != self.collab_cursor_sent:
+            self.collab_cursor_sent = cursor
+            if doc is None:
+                self.send_collab_message({'type': 'cursor', 'file_path': None})
+            else:
+                self.send_collab_message({'type': 'cursor', 'file_path': cursor[0], 'pos': cursor[1], 'anchor': cursor[2]})
+
+    def apply_collab_cursors(self):
+        with self.collab_cursors_lock:
+            cursors, self.collab_cursors_pending = self.collab_cursors_pending, {}
+        for user_id, (file_path, pos, anchor) in cursors.items():
+            if self.remote_cursor_files.get(user_id, file_path) != file_path:
+                self.remove_remote_cursor(user_id)
+            tab = self.find_tab(file_path) if file_path is not None else None
+            if tab is None:
+                continue
+            tab.editor.set_remote_cursor(user_id, pos, anchor)
+            self.remote_cursor_files[user_id] = file_path
+
+    def remove_remote_cursor(self, user_id):
+        file_path = self.remote_cursor_files.pop(user_id, None)
+        tab = self.find_tab(file_path) if file_path is not None else None
+        if tab is not None:
+            tab.editor.remove_remote_cursor(user_id)
+
+    def update_presence(self, data):
+        if 'users' in data:
+            self.users_in_session = dict.fromkeys(data['users'])
+            for user_id in [user_id for user_id in self.remote_cursor_files if user_id not in self.users_in_session]:
+                self.remove_remote_cursor(user_id)
+        else:
+            for user_id in data.get('left', ()):
+                self.users_in_session.pop(user_id, None)
+                self.remove_remote_cursor(user_id)
+            self.users_in_session.update(dict.fromkeys(data.get('joined', ())))
+        users = list(self.users_in_session)
         self.status_bar.showMessage(f'Users in session: {len(users)} | IDs: {", ".join(users)}')
 
     def connect_editor_signal(self):
         try:
-            self.tabs.currentWidget().editor.textChanged.disconnect(self.on_editor_text_changed_collab)
+            self.tabs.currentWidget().editor.local_edit_signal.disconnect(self.on_editor_text_changed_collab)
         except Exception:
             pass
         try:
-            self.tabs.currentWidget().editor.textChanged.connect(self.on_editor_text_changed_collab)
+            self.tabs.currentWidget().editor.local_edit_signal.connect(self.on_editor_text_changed_collab)
         except Exception:
             pass
+        for signal in ('cursorPositionChanged', 'selectionChanged'):
+            try:
+                getattr(self.tabs.currentWidget().editor, signal).disconnect(self.on_collab_cursor_moved)
+            except Exception:
+                pass
+            try:
+                getattr(self.tabs.currentWidget().editor, signal).connect(self.on_collab_cursor_moved)
+            except Exception:
+                pass
+        self.on_collab_cursor_moved()  # our cursor is now in this tab's file
 
 def main():
     app = QApplication(sys.argv)
@@ -0,0 +1,1175 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from collab_doc import ClientDocument, Document, INSERT, DELETE
+from collab_wire import FileTable, decode, encode
+
+
+LOAD_FILE = 'load.py'  # the one file each load-test session shares
+LOAD_DRAIN_SECONDS = 2.0  # load clients keep reading this long after typing stops
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench_ot(args):
+    # Users type concurrently against a shared document; each op is based on
+    # a version `lag` behind the server so every apply transforms through history
+    rng = random.Random(args.seed)
+    doc = Document(b'x' * args.doc_size)
+    timings = []
+    for _ in range(args.ops):
+        base = max(doc.version - rng.randint(0, args.lag), doc.version - len(doc.history))
+        pos = rng.randint(0, len(doc.buf) // 2)
+        op = (INSERT, pos, b'a') if rng.random() < 0.7 else (DELETE, pos, 1)
+        start = time.perf_counter()
+        doc.apply([op], base)
+        timings.append(time.perf_counter() - start)
+    total = sum(timings)
+    return {
+        'benchmark': 'ot',
+        'ops': args.ops,
+        'lag': args.lag,
+        'doc_size': args.doc_size,
+        'ops_per_sec': round(args.ops / total),
+        'p50_us': round(percentile(timings, 50) * 1e6, 1),
+        'p99_us': round(percentile(timings, 99) * 1e6, 1),
+    }
+
+
+class FakeSocket:
+    # Stands in for a websocket so the broadcast engine can be measured
+    # without network noise; `delay` simulates a slow consumer
+    def __init__(self, state, delay=0.0):
+        self.state = state
+        self.delay = delay
+
+    async def send(self, msg):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+            return
+        self.state['remaining'] -= 1
+        if self.state['remaining'] == 0:
+            self.state['done'].set()
+
+
+async def fanout_round(peer_count, messages, slow, slow_delay, wire, with_metrics=False):
+    import collab_server
+    from collab_metrics import ServerMetrics
+    from collab_wire import FileTable
+    collab_server.metrics = ServerMetrics() if with_metrics else None
+    state = {}
+    session_id = 'bench'
+    collab_server.sessions[session_id] = {}
+    collab_server.file_tables[session_id] = FileTable()
+    collab_server.file_tables[session_id].intern('bench.py')
+    for i in range(peer_count):
+        ws = FakeSocket(state, slow_delay if i < slow else 0.0)
+        peer = collab_server.peers[ws] = collab_server.Peer(ws)
+        peer.wire = wire
+        collab_server.sessions[session_id][ws] = str(i)
+    payload = {'type': 'edit', 'file_path': 'bench.py', 'ops': [(INSERT, 0, b'a')], 'user_id': '00000000-0000-0000-0000-000000000000'}
+    timings = []
+    for n in range(messages):
+        state['remaining'] = peer_count - slow
+        state['done'] = asyncio.Event()
+        start = time.perf_counter()
+        collab_server.broadcast(session_id, None, {**payload, 'version': n})
+        await state['done'].wait()
+        timings.append(time.perf_counter() - start)
+    for peer in collab_server.peers.values():
+        peer.close()
+    collab_server.peers.clear()
+    collab_server.sessions.clear()
+    collab_server.file_tables.clear()
+    return {
+        'peers': peer_count,
+        'slow_peers': slow,
+        'p50_ms': round(percentile(timings, 50) * 1e3, 3),
+        'p99_ms': round(percentile(timings, 99) * 1e3, 3),
+    }
+
+
+def bench_fanout(args):
+    # Time from encoding a message to the last fast peer's send completing
+    results = []
+    for peer_count in args.peers:
+        slow = min(args.slow, peer_count - 1)
+        results.append(asyncio.run(fanout_round(peer_count, args.messages, slow, args.slow_delay, args.wire, args.metrics)))
+    return {'benchmark': 'fanout', 'wire': args.wire, 'metrics': args.metrics, 'messages': args.messages, 'results': results}
+
+
+def bench_recovery(args):
+    # Log --ops edits through a SessionStore, then time a cold load
+    from collab_store import SessionStore
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(directory, args.snapshot_every)
+        doc = Document(b'x' * args.doc_size)
+        docs = {'bench.py': doc}
+        store.record_open('bench', docs, 'bench.py', doc)
+        start = time.perf_counter()
+        for i in range(args.ops):
+            pos = rng.randint(0, len(doc.buf) - 1)
+            op = (INSERT, pos, b'a') if rng.random() < 0.6 else (DELETE, pos, 1)
+            doc.apply([op])
+            store.record_ops('bench', docs, 'bench.py', doc.version, [op])
+            if i % 10000 == 0:
+                store.flush()
+        store.flush()
+        store.executor.shutdown(wait=True)
+        write_time = time.perf_counter() - start
+        snap_path, log_path = store.paths('bench')
+        log_bytes = os.path.getsize(log_path)
+        start = time.perf_counter()
+        recovered = SessionStore(directory).load('bench')['bench.py']
+        load_time = time.perf_counter() - start
+        assert recovered.buf == doc.buf and recovered.version == doc.version
+    return {
+        'benchmark': 'recovery',
+        'ops': args.ops,
+        'snapshot_every': args.snapshot_every,
+        'write_s': round(write_time, 3),
+        'log_tail_bytes': log_bytes,
+        'recovery_s': round(load_time, 3),
+    }
+
+
+def wire_messages():
+    paste = ''.join(random.Random(0).choice('abcdefghij \n') for _ in range(10000))
+    user_id = '6f1c2d3e-4b5a-4c6d-8e7f-901234567890'
+    return {
+        'keystroke': {'type': 'edit', 'file_path': '/home/dev/project/src/app/main.py', 'ops': [(INSERT, 1234, b'a')], 'version': 5012, 'user_id': user_id},
+        'paste_10k': {'type': 'edit', 'file_path': '/home/dev/project/src/app/main.py', 'ops': [(DELETE, 200, 40), (INSERT, 200, paste.encode('utf-8'))], 'version': 5013, 'user_id': user_id},
+        'ack': {'type': 'ack', 'file_path': '/home/dev/project/src/app/main.py', 'version': 5014},
+        'open_file_100k': {'type': 'open_file', 'file_path': '/home/dev/project/src/app/main.py', 'content': (paste * 10), 'version': 0},
+    }
+
+
+def bench_wire(args):
+    from collab_wire import FileTable, decode, encode
+    files = FileTable()
+    files.intern('/home/dev/project/src/app/main.py')
+    results = []
+    for name, data in wire_messages().items():
+        for wire in ('json', 'binary'):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                frame = encode(data, wire, files.ids)
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                decode(frame, files.paths)
+            decode_time = time.perf_counter() - start
+            size = len(frame.encode('utf-8')) if isinstance(frame, str) else len(frame)
+            results.append({
+                'message': name,
+                'wire': wire,
+                'bytes': size,
+                'encode_us': round(encode_time / args.iterations * 1e6, 2),
+                'decode_us': round(decode_time / args.iterations * 1e6, 2),
+            })
+    return {'benchmark': 'wire', 'results': results}
+
+
+def start_server(port, *extra):
+    server = subprocess.Popen([sys.executable, 'collab_server.py', '--port', str(port), *extra], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError(f'collab_server did not start on port {port}')
+
+
+async def wait_for(websocket, kind):
+    while True:
+        data = json.loads(await websocket.recv())
+        if data.get('type') == kind:
+            return data
+
+
+async def edit_pair(url, session_id, deadline):
+    # One writer typing as fast as acks allow, one reader counting deliveries
+    import websockets
+    async with websockets.connect(url) as writer, websockets.connect(url) as reader:
+        join = json.dumps({'type': 'join', 'session_id': session_id})
+        await writer.send(join)
+        await reader.send(join)
+        await writer.send(json.dumps({'type': 'open_file', 'file_path': 'load.txt', 'content': '', 'session_id': session_id}))
+        version = (await wait_for(writer, 'ack'))['version']
+        received = 0
+
+        async def read():
+            nonlocal received
+            async for message in reader:
+                if json.loads(message).get('type') == 'edit':
+                    received += 1
+        reading = asyncio.create_task(read())
+        while time.monotonic() < deadline:
+            await writer.send(json.dumps({'type': 'edit', 'file_path': 'load.txt', 'ops': [{'op': 'insert', 'pos': 0, 'text': 'a'}], 'version': version, 'session_id': session_id}))
+            version = (await wait_for(writer, 'ack'))['version']
+        await asyncio.sleep(0.2)
+        reading.cancel()
+        return received
+
+
+async def edit_pairs(url, prefix, sessions, duration):
+    deadline = time.monotonic() + duration
+    counts = await asyncio.gather(*(edit_pair(url, f'{prefix}-{n}', deadline) for n in range(sessions)))
+    return sum(counts)
+
+
+def load_process(url, prefix, sessions, duration):
+    return asyncio.run(edit_pairs(url, prefix, sessions, duration))
+
+
+def bench_scaling(args):
+    # Aggregate edit delivery rate with 1..N server workers; load comes from
+    # separate client processes so the clients are not the bottleneck
+    results = []
+    for workers in args.workers:
+        server = start_server(args.port, '--workers', str(workers))
+        try:
+            url = f'ws://localhost:{args.port}'
+            jobs = [(url, f'w{workers}-p{n}', args.sessions, args.duration) for n in range(args.clients)]
+            with multiprocessing.Pool(args.clients) as pool:
+                delivered = sum(pool.starmap(load_process, jobs))
+        finally:
+            server.terminate()
+            server.wait()
+        results.append({'workers': workers, 'edits_per_sec': round(delivered / args.duration)})
+    base = results[0]['edits_per_sec'] or 1
+    for result in results:
+        result['speedup'] = round(result['edits_per_sec'] / base, 2)
+    return {'benchmark': 'scaling', 'cpus': os.cpu_count(), 'sessions': args.sessions * args.clients, 'results': results}
+
+
+class LoadClient:
+    # One headless editor speaking the protocol MainWindow uses: join with a
+    # client id and the binary wire, share or receive the file, then type
+    # at a steady rate with keystrokes batched like COLLAB_BATCH_MS and at
+    # most one batch in flight. Propagation latency runs from the moment a
+    # batch leaves its sender to its arrival at each other session member.
+    def __init__(self, session_id, owner, args, start_at, stats):
+        self.session_id = session_id
+        self.owner = owner
+        self.args = args
+        self.start_at = start_at
+        self.stats = stats
+        self.client_id = str(uuid.uuid4())
+        self.files = FileTable()
+        self.wire = 'json'
+        self.doc = None
+        self.content = b''  # the file the owner shares
+        self.length = 0  # document bytes as this client sees them
+        self.sent_at = None  # when the batch in flight left
+        self.seq = 0
+        self.flush_pending = False
+        self.ready = asyncio.Event()  # the shared file is loaded
+        self.outbox = asyncio.Queue()
+        self.chunks = []
+
+    def send(self, data):
+        self.outbox.put_nowait(encode(data, self.wire, self.files.ids))
+
+    def flush(self):
+        self.flush_pending = False
+        if self.doc.inflight is not None or not self.doc.buffer:
+            return
+        self.seq += 1
+        ops = self.doc.outgoing(self.seq)
+        self.sent_at = time.monotonic()
+        self.send({'type': 'edit', 'file_path': LOAD_FILE, 'ops': ops, 'version': self.doc.version, 'seq': self.seq, 'session_id': self.session_id})
+
+    def loaded(self, content, version):
+        self.doc = ClientDocument(version, content)
+        self.length = len(content)
+        self.ready.set()
+
+    def receive(self, message):
+        data = decode(message, self.files.paths)
+        kind = data.get('type')
+        if kind == 'welcome':
+            self.wire = data['wire']
+        elif kind == 'file_id':
+            self.files.define(data['file_id'], data['file_path'])
+        elif kind == 'ack':
+            if self.doc is None:
+                self.loaded(self.content, data['version'])  # our share
+                return
+            if self.sent_at is not None and self.doc.inflight:
+                self.stats['sent'][(self.session_id, data['version'])] = self.sent_at
+                self.stats['batches'] += 1
+            self.doc.ack(data['version'])
+            self.flush()
+        elif kind == 'edit' and self.doc is not None and data['version'] > self.doc.version:
+            now = time.monotonic()
+            for op_kind, pos, arg in self.doc.remote(data['ops'], data['version']):
+                self.length += len(arg) if op_kind == INSERT else -arg
+            if now >= self.start_at:
+                self.stats['received'].append((self.session_id, data['version'], now))
+        elif kind == 'open_file':
+            self.loaded(data['content'].encode('utf-8'), data.get('version', 0))
+        elif kind == 'snapshot_chunk':
+            self.chunks.append(data['data'])
+            if len(self.chunks) == data['count']:
+                self.loaded(zlib.decompress(b''.join(self.chunks)), data['version'])
+                self.chunks = []
+
+    async def write(self, websocket):
+        while True:
+            await websocket.send(await self.outbox.get())
+
+    async def read(self, websocket):
+        async for message in websocket:
+            self.receive(message)
+
+    async def run(self, url, rng):
+        import websockets
+        async with websockets.connect(url, max_size=None) as websocket:
+            tasks = [asyncio.create_task(self.write(websocket)), asyncio.create_task(self.read(websocket))]
+            try:
+                await websocket.send(json.dumps({'type': 'join', 'session_id': self.session_id, 'client_id': self.client_id, 'resume': [], 'snapshot': ['zlib', 'chunks'], 'wire': ['binary']}))
+                if self.owner:
+                    content = ('x = compute(a, b)  # filler line\n' * (self.args.doc_size // 34 + 1))[:self.args.doc_size]
+                    self.content = content.encode('utf-8')
+                    self.send({'type': 'open_file', 'file_path': LOAD_FILE, 'content': content, 'session_id': self.session_id})
+                await self.ready.wait()
+                self.stats['connected'] += 1
+                await self.type(rng)
+                await asyncio.sleep(LOAD_DRAIN_SECONDS)  # let the last edits arrive
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def type(self, rng):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.args.rate
+        # Spread clients over the first keystroke interval
+        next_key = max(self.start_at, time.monotonic()) + rng.random() * interval
+        end = self.start_at + self.args.duration
+        while next_key < end:
+            await asyncio.sleep(max(0.0, next_key - time.monotonic()))
+            if self.length and rng.random() < 0.05:
+                self.doc.local([(DELETE, rng.randrange(self.length), 1)])
+                self.length -= 1
+            else:
+                self.doc.local([(INSERT, rng.randint(0, self.length), b'k')])
+                self.length += 1
+            self.stats['keystrokes'] += 1
+            if not self.flush_pending:
+                self.flush_pending = True
+                loop.call_later(self.args.batch_ms / 1000, self.flush)
+            next_key += interval * rng.uniform(0.5, 1.5)
+
+
+async def load_clients(url, sessions, args, start_at, seed):
+    rng = random.Random(seed)
+    stats = {'sent': {}, 'received': [], 'batches': 0, 'keystrokes': 0, 'connected': 0}
+    clients = []
+    for session_id in sessions:
+        clients.extend(LoadClient(session_id, n == 0, args, start_at, stats) for n in range(args.session_size))
+    # Owners share their file before the rest join; connections are spread
+    # over --ramp seconds so the server is not hit by one SYN burst
+    step = args.ramp / max(len(clients), 1)
+
+    async def start(n, client):
+        await asyncio.sleep(n * step)
+        if not client.owner:
+            await clients[n - n % args.session_size].ready.wait()
+        try:
+            await client.run(url, random.Random(rng.random()))
+        except Exception as e:  # refused or dropped connections, handshake timeouts
+            stats.setdefault('errors', []).append(repr(e))
+    await asyncio.gather(*(start(n, client) for n, client in enumerate(clients)))
+    latencies = [received - stats['sent'][(session_id, version)] for session_id, version, received in stats['received'] if (session_id, version) in stats['sent']]
+    return {'latencies': latencies, 'batches': stats['batches'], 'keystrokes': stats['keystrokes'], 'deliveries': len(stats['received']),
+            'connected': stats['connected'], 'errors': stats.get('errors', [])[:10], 'error_count': len(stats.get('errors', []))}
+
+
+def load_worker(url, sessions, args, start_at, seed):
+    raise_fd_limit()
+    return asyncio.run(load_clients(url, sessions, args, start_at, seed))
+
+
+def raise_fd_limit():
+    # Thousands of sockets need more descriptors than the usual soft limit
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def process_tree(pid):
+    pids = [pid]
+    for pid in pids:
+        try:
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def server_usage(pid):
+    # (CPU seconds, RSS bytes) summed over pid and its children, from /proc
+    cpu = 0.0
+    rss = 0
+    for pid in process_tree(pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_load(args):
+    # Headless clients against a real server: throughput, propagation
+    # latency, server CPU and RSS. Starts its own server unless --url is
+    # given; --server-pid then enables the CPU/RSS figures.
+    raise_fd_limit()
+    server = None
+    url = args.url
+    pid = args.server_pid
+    if url is None:
+        server = start_server(args.port, *args.server_args.split())
+        url = f'ws://localhost:{args.port}'
+        pid = server.pid
+    try:
+        sessions = [f'load-{time.time()}-{n}' for n in range(args.clients // args.session_size)]
+        processes = max(1, min(args.processes, len(sessions)))
+        start_at = time.monotonic() + args.ramp + args.setup
+        jobs = [(url, sessions[n::processes], args, start_at, args.seed + n) for n in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            pending = pool.starmap_async(load_worker, jobs)
+            time.sleep(max(0.0, start_at - time.monotonic()))
+            before = server_usage(pid) if pid else None
+            peak_rss = 0
+            end = start_at + args.duration
+            while time.monotonic() < end:
+                if pid:
+                    peak_rss = max(peak_rss, server_usage(pid)[1])
+                time.sleep(min(0.5, max(0.0, end - time.monotonic())))
+            after = server_usage(pid) if pid else None
+            results = pending.get()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    summary = {
+        'benchmark': 'load',
+        'commit': git_commit(),
+        'config': {key: getattr(args, key) for key in ('clients', 'session_size', 'rate', 'doc_size', 'batch_ms', 'duration', 'processes', 'server_args')},
+        'connected': sum(result['connected'] for result in results),
+        'errors': sum(result['error_count'] for result in results),
+        'error_samples': [error for result in results for error in result['errors']][:5],
+        'keystrokes_per_sec': round(sum(result['keystrokes'] for result in results) / args.duration),
+        'edits_per_sec': round(sum(result['batches'] for result in results) / args.duration),
+        'deliveries_per_sec': round(sum(result['deliveries'] for result in results) / args.duration),
+        'latency_ms': {f'p{pct}': round(percentile(latencies, pct) * 1e3, 2) for pct in (50, 90, 99, 99.9)},
+        'latency_samples': len(latencies),
+    }
+    if before and after:
+        summary['server'] = {
+            'cpu_percent': round((after[0] - before[0]) / args.duration * 100, 1),
+            'rss_mb': round(after[1] / 2 ** 20, 1),
+            'peak_rss_mb': round(max(peak_rss, after[1]) / 2 ** 20, 1),
+        }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+class PresenceClient:
+    # A bare session member that only tracks who else is there
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.client_id = str(uuid.uuid4())
+        self.users = set()
+        self.presence_messages = 0
+        self.presence_bytes = 0
+        self.websocket = None
+
+    async def connect(self, url):
+        import websockets
+        self.websocket = await websockets.connect(url, max_size=None)
+        await self.websocket.send(json.dumps({'type': 'join', 'session_id': self.session_id, 'client_id': self.client_id}))
+        self.reader = asyncio.create_task(self.read(self.websocket))
+
+    async def read(self, websocket):
+        import websockets
+        try:
+            async for message in websocket:
+                data = json.loads(message)
+                if data.get('type') != 'presence':
+                    continue
+                self.presence_messages += 1
+                self.presence_bytes += len(message)
+                if 'users' in data:
+                    self.users = set(data['users'])
+                else:
+                    self.users.difference_update(data.get('left', ()))
+                    self.users.update(data.get('joined', ()))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await self.websocket.close()
+        await self.reader
+
+
+async def presence_storm(url, members, timeout, server_pid):
+    # Everyone joins, then everyone drops and reconnects at once; counts the
+    # presence traffic of the storm and the time until every member again
+    # sees the whole room
+    session_id = f'presence-{time.time()}'
+    clients = [PresenceClient(session_id) for _ in range(members)]
+    for client in clients:
+        await client.connect(url)
+    everyone = {client.client_id for client in clients}
+    deadline = time.monotonic() + timeout
+    while any(client.users != everyone for client in clients) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    for client in clients:
+        client.presence_messages = client.presence_bytes = 0
+    cpu = server_usage(server_pid)[0]
+    start = time.monotonic()
+    await asyncio.gather(*(client.close() for client in clients))
+    await asyncio.gather(*(client.connect(url) for client in clients))
+    while any(client.users != everyone for client in clients) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    settle = time.monotonic() - start
+    converged = all(client.users == everyone for client in clients)
+    await asyncio.sleep(0.5)  # stragglers still queued
+    result = {
+        'members': members,
+        'converged': converged,
+        'settle_ms': round(settle * 1e3),
+        'server_cpu_s': round(server_usage(server_pid)[0] - cpu, 2),
+        'presence_messages': sum(client.presence_messages for client in clients),
+        'presence_bytes': sum(client.presence_bytes for client in clients),
+    }
+    await asyncio.gather(*(client.close() for client in clients))
+    return result
+
+
+def bench_presence(args):
+    # Presence cost of a reconnect storm by room size, including server CPU
+    raise_fd_limit()
+    results = []
+    for members in args.members:
+        server = start_server(args.port)
+        try:
+            results.append(asyncio.run(presence_storm(f'ws://localhost:{args.port}', members, args.timeout, server.pid)))
+        finally:
+            server.terminate()
+            server.wait()
+    return {'benchmark': 'presence', 'commit': git_commit(), 'results': results}
+
+
+def pump(app, seconds):
+    end = time.perf_counter() + seconds
+    while True:
+        app.processEvents()
+        left = end - time.perf_counter()
+        if left <= 0:
+            return
+        time.sleep(min(left, 0.001))
+
+
+def pump_until(app, condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError('timed out waiting for the editor')
+        pump(app, 0.01)
+
+
+def typing_round(app, url, batch_ms, args):
+    # Scripted keystrokes into one editor of a collab session. batch_ms=None
+    # replays the old path: one edit message per change, sent synchronously
+    # from the UI thread.
+    import code_editor
+    import websocket
+    from collab_wire import encode
+    window = code_editor.MainWindow()
+    window.session_id = f'typing-{batch_ms}-{time.time()}'
+    window.show_editor()
+    window.start_collab_client(url)
+    pump_until(app, window.collab_connected)
+    sent = []
+    ws_send = window.collab_ws.send
+
+    def counting_send(frame, *send_args, **kwargs):
+        sent.append(len(frame))
+        return ws_send(frame, *send_args, **kwargs)
+    window.collab_ws.send = counting_send
+    ui_time = [0.0]  # UI thread time in the edit handler and the batch flush
+
+    def timed_flush():
+        start = time.perf_counter()
+        window.flush_collab_edits()
+        ui_time[0] += time.perf_counter() - start
+    if batch_ms is None:
+        def send_now(msg):
+            frame = encode(msg, window.collab_wire, window.collab_files.ids)
+            window.collab_ws.send(frame, opcode=websocket.ABNF.OPCODE_BINARY if isinstance(frame, bytes) else websocket.ABNF.OPCODE_TEXT)
+
+        def flush_now():
+            window.collab_dirty_tabs.add(window.tabs.currentWidget())
+            timed_flush()
+        window.send_collab_message = send_now
+        window.on_editor_text_changed_collab = flush_now
+    else:
+        window.collab_send_timer.setInterval(batch_ms)
+        window.collab_send_timer.timeout.disconnect()
+        window.collab_send_timer.timeout.connect(timed_flush)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'typing.py')
+        with open(file_path, 'w') as f:
+            f.write('def main():\n    pass\n')
+        window.open_file_by_path(file_path)
+        doc = window.collab_docs[file_path]
+        pump_until(app, lambda: doc.inflight is None)
+        editor = window.find_tab(file_path).editor
+        editor.SendScintilla(editor.SCI_DOCUMENTEND)
+        sent.clear()
+        text = ('    value = compute(a, b)  # keep going\n' * (args.chars // 38 + 1))[:args.chars]
+        interval = 1.0 / args.cps
+        changes = 0
+        start = time.perf_counter()
+        for n, ch in enumerate(text):
+            if n % 20 == 19:
+                editor.SendScintilla(editor.SCI_DELETEBACK)  # the odd typo fix
+                changes += 1
+            editor.SendScintilla(editor.SCI_ADDTEXT, 1, ch.encode())
+            changes += 1
+            pump(app, start + (n + 1) * interval - time.perf_counter())
+        typing_time = time.perf_counter() - start
+        pump_until(app, lambda: not window.collab_dirty_tabs and doc.inflight is None and not doc.buffer)
+    window.collab_ws.close()
+    return {
+        'batch_ms': batch_ms if batch_ms is not None else 'unbatched',
+        'changes': changes,
+        'messages': len(sent),
+        'messages_per_sec': round(len(sent) / typing_time, 1),
+        'bytes_sent': sum(sent),
+        'ui_send_ms': round(ui_time[0] * 1e3, 2),
+    }
+
+
+def bench_apply(args):
+    # A remote snapshot that differs from the open buffer by one small edit,
+    # applied by full setText() vs. the diffed range replacement
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from code_editor import CodeEditor
+    line = 'def handler(request, *args):  return respond(request.user, args)\n'
+    results = []
+    for size in args.sizes:
+        base = line * (size // len(line))
+        timings = {'set_text': [], 'set_remote_text': []}
+        for n in range(args.repeat):
+            middle = len(base) // 2
+            content = base[:middle] + f'edit{n}' + base[middle:]
+            data = content.encode('utf-8')  # as received from the server
+            for method in timings:
+                editor = CodeEditor()
+                editor.setText(base)
+                app.processEvents()
+                start = time.perf_counter()
+                if method == 'set_text':
+                    editor.setText(content)
+                else:
+                    editor.set_remote_text(data)
+                app.processEvents()  # include the re-lex/redraw that follows
+                timings[method].append(time.perf_counter() - start)
+                editor.deleteLater()
+        results.append({
+            'doc_bytes': len(base),
+            **{f'{method}_ms': round(percentile(values, 50) * 1e3, 2) for method, values in timings.items()},
+        })
+    return {'benchmark': 'apply', 'results': results}
+
+
+def bench_typing(args):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    server = start_server(args.port)
+    try:
+        url = f'ws://localhost:{args.port}'
+        results = [typing_round(app, url, None, args)]
+        for batch_ms in args.batch_ms:
+            results.append(typing_round(app, url, batch_ms, args))
+    finally:
+        server.terminate()
+        server.wait()
+    return {'benchmark': 'typing', 'cps': args.cps, 'results': results}
+
+
+def reconnect_round(app, scenario, args):
+    # Two editors in one session type continuously (one at the top of the
+    # file, one at the end) while either the first one's connection drops
+    # or the server is killed and restarted on the same data directory.
+    # 'compact' restarts a server that snapshots after every logged edit,
+    # so it comes back with no history and both resume from a snapshot.
+    # Both must reconnect, resume and end up with identical text holding
+    # every keystroke.
+    import code_editor
+    url = f'ws://localhost:{args.port}'
+    with tempfile.TemporaryDirectory() as directory:
+        data_dir = os.path.join(directory, 'data')
+        server_args = ('--data-dir', data_dir, *(('--snapshot-every', '1') if scenario == 'compact' else ()))
+        server = start_server(args.port, *server_args)
+        try:
+            windows = []
+            resumes = {'resumed': 0, 'snapshots': 0}
+            session_id = f'reconnect-{scenario}-{time.time()}'
+            joined = [0.0, 0.0]
+            for n in range(2):
+                window = code_editor.MainWindow()
+                window.session_id = session_id
+                window.show_editor()
+                window.collab_status_signal.connect(lambda message, n=n: message.startswith('Connected') and joined.__setitem__(n, time.perf_counter()))
+                window.start_collab_client(url)
+                pump_until(app, window.collab_connected)
+                window.collab_resumed_signal.connect(lambda *_: resumes.__setitem__('resumed', resumes['resumed'] + 1))
+                window.collab_open_file_signal.connect(lambda *_: resumes.__setitem__('snapshots', resumes['snapshots'] + 1))
+                windows.append(window)
+            file_path = os.path.join(directory, 'shared.py')
+            with open(file_path, 'w') as f:
+                f.write('\n')
+            windows[0].open_file_by_path(file_path)
+            pump_until(app, lambda: windows[1].find_tab(file_path) is not None and windows[0].collab_docs[file_path].inflight is None)
+            editors = [window.find_tab(file_path).editor for window in windows]
+            editors[1].SendScintilla(editors[1].SCI_DOCUMENTEND)
+            typed = [0, 0]
+            interval = 1.0 / args.cps
+
+            def type_for(seconds):
+                start = time.perf_counter()
+                n = 0
+                while time.perf_counter() - start < seconds:
+                    for i, editor in enumerate(editors):
+                        editor.SendScintilla(editor.SCI_ADDTEXT, 1, b'ab'[i:i + 1])
+                        typed[i] += 1
+                    n += 1
+                    pump(app, start + n * interval - time.perf_counter())
+            type_for(args.before)
+            resumes.update(resumed=0, snapshots=0)
+            if scenario in ('restart', 'compact'):
+                server.kill()
+                server.wait()
+                type_for(args.offline)
+                server = start_server(args.port, *server_args)
+            else:
+                windows[0].collab_ws.close()
+                pump_until(app, lambda: not windows[0].collab_connected())
+            back = time.perf_counter()  # from when the server could be reached again
+            pump_until(app, lambda: all(window.collab_connected() for window in windows), timeout=2 * code_editor.COLLAB_RECONNECT_MAX)
+            reconnect_time = max(joined) - back
+            type_for(args.after)
+
+            def settled():
+                docs = [window.collab_docs[file_path] for window in windows]
+                return (not any(window.collab_dirty_tabs for window in windows)
+                        and all(doc.inflight is None and not doc.buffer for doc in docs)
+                        and docs[0].version == docs[1].version and editors[0].text() == editors[1].text())
+            pump_until(app, settled, timeout=30)
+            text = editors[0].text()
+            for window in windows:
+                window.collab_ws.close()
+        finally:
+            server.terminate()
+            server.wait()
+    return {
+        'scenario': scenario,
+        'typed': sum(typed),
+        'lost': typed[0] - text.count('a') + typed[1] - text.count('b'),
+        'reconnect_ms': round(reconnect_time * 1e3),
+        **resumes,
+    }
+
+
+def bench_reconnect(args):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    return {'benchmark': 'reconnect', 'results': [reconnect_round(app, scenario, args) for scenario in args.scenarios]}
+
+
+async def move_cursors(url, session_id, file_path, clients, rate, duration, seed):
+    # Headless members each moving their caret rate times a second, sometimes
+    # with a selection, while reading and discarding everything relayed
+    import websockets
+    rng = random.Random(seed)
+    sockets = []
+    for _ in range(clients):
+        websocket = await websockets.connect(url, max_size=None)
+        await websocket.send(json.dumps({'type': 'join', 'session_id': session_id, 'client_id': str(uuid.uuid4())}))
+        sockets.append(websocket)
+    length = len((await wait_for(sockets[0], 'open_file'))['content'].encode('utf-8'))
+    received = [0]
+
+    async def read(websocket):
+        try:
+            async for message in websocket:
+                received[0] += 1
+        except websockets.ConnectionClosed:
+            pass
+    readers = [asyncio.create_task(read(websocket)) for websocket in sockets]
+    sent = 0
+    start = time.monotonic()
+    for n in range(int(duration * rate)):
+        for websocket in sockets:
+            pos = rng.randrange(length)
+            anchor = pos if rng.random() < 0.7 else min(length, pos + rng.randrange(200))
+            await websocket.send(json.dumps({'type': 'cursor', 'file_path': file_path, 'pos': pos, 'anchor': anchor}))
+            sent += 1
+        await asyncio.sleep(max(0.0, start + (n + 1) / rate - time.monotonic()))
+    await asyncio.sleep(0.5)
+    for websocket in sockets:
+        await websocket.close()
+    await asyncio.gather(*readers)
+    return {'sent': sent, 'received_by_clients': received[0]}
+
+
+def cursor_process(url, session_id, file_path, clients, rate, duration, seed, results):
+    results.put(asyncio.run(move_cursors(url, session_id, file_path, clients, rate, duration, seed)))
+
+
+def server_counters(metrics_port, prefix):
+    import urllib.request
+    with urllib.request.urlopen(f'http://localhost:{metrics_port}/metrics', timeout=5) as response:
+        text = response.read().decode('utf-8')
+    counters = {}
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            name, value = line.rsplit(' ', 1)
+            counters[name[len(prefix):].removesuffix('_total')] = float(value)
+    return counters
+
+
+def cursors_round(app, url, server, clients, args):
+    # One editor in a session with clients other members streaming their
+    # cursors through the server, while the editor's own user types. The
+    # members run in a child process so only the editor's work lands on
+    # this process's event loop.
+    import code_editor
+    from collab_wire import CURSOR
+    window = code_editor.MainWindow()
+    window.session_id = f'cursors-{clients}-{time.time()}'
+    window.show_editor()
+    received = [0]
+    on_message = window.on_collab_message
+
+    def counting_message(ws, message):
+        if isinstance(message, bytes) and message[0] == CURSOR:
+            received[0] += 1
+        on_message(ws, message)
+    window.on_collab_message = counting_message
+    window.start_collab_client(url)
+    pump_until(app, window.collab_connected)
+    ui_time = [0.0]
+    applied = [0, 0]  # cursor updates, batches
+
+    def timed_apply():
+        start = time.perf_counter()
+        applied[0] += len(window.collab_cursors_pending)
+        applied[1] += 1
+        window.apply_collab_cursors()
+        ui_time[0] += time.perf_counter() - start
+    window.collab_cursor_signal.disconnect()
+    window.collab_cursor_signal.connect(timed_apply)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'cursors.py')
+        with open(file_path, 'w') as f:
+            f.write('    value = compute(a, b)  # keep going\n' * args.lines)
+        window.open_file_by_path(file_path)
+        doc = window.collab_docs[file_path]
+        pump_until(app, lambda: doc.inflight is None)
+        editor = window.find_tab(file_path).editor
+        editor.SendScintilla(editor.SCI_GOTOPOS, editor.SendScintilla(editor.SCI_GETLENGTH) // 2)
+        results = multiprocessing.Queue()
+        members = multiprocessing.Process(target=cursor_process, args=(url, window.session_id, file_path, clients, args.rate, args.duration, args.seed, results))
+        before = server_counters(args.metrics_port, 'collab_cursors_')
+        cpu = server_usage(server.pid)[0]
+        members.start()
+        pump_until(app, lambda: len(editor.remote_cursors) == clients, timeout=30)
+        ui_time[0] = 0.0
+        received[0] = 0
+        applied[0] = applied[1] = 0
+        max_event = 0.0
+        typed = 0
+        start = time.perf_counter()
+        # Measured while everyone is moving; typing shifts every drawn cursor
+        while time.perf_counter() - start < args.duration - 1.0:
+            event_start = time.perf_counter()
+            app.processEvents()
+            max_event = max(max_event, time.perf_counter() - event_start)
+            if (time.perf_counter() - start) * args.cps > typed:
+                editor.SendScintilla(editor.SCI_ADDTEXT, 1, b'x')
+                typed += 1
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        server_cpu = server_usage(server.pid)[0] - cpu
+        member_stats = results.get(timeout=60)
+        members.join()
+        after = server_counters(args.metrics_port, 'collab_cursors_')
+        drawn = len(editor.remote_cursors)
+    window.collab_ws.close()
+    return {
+        'clients': clients,
+        'rate_hz': args.rate,
+        'updates_received': received[0],
+        'updates_applied': applied[0],
+        'batches': applied[1],
+        'cursors_drawn': drawn,
+        'ui_ms_per_s': round(ui_time[0] * 1e3 / elapsed, 2),
+        'ui_us_per_update': round(ui_time[0] * 1e6 / max(applied[0], 1), 1),
+        'max_event_ms': round(max_event * 1e3, 2),
+        'typed': typed,
+        'server_cpu_pct': round(server_cpu * 100 / (elapsed + 1.0), 1),
+        **{f'server_{name}': int(after.get(name, 0) - before.get(name, 0)) for name in ('coalesced', 'dropped')},
+        **member_stats,
+    }
+
+
+def bench_cursors(args):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    raise_fd_limit()
+    server = start_server(args.port, '--metrics-port', str(args.metrics_port))
+    try:
+        url = f'ws://localhost:{args.port}'
+        results = [cursors_round(app, url, server, clients, args) for clients in args.clients]
+    finally:
+        server.terminate()
+        server.wait()
+    return {'benchmark': 'cursors', 'commit': git_commit(), 'results': results}
+
+
+def bench_tabs(args):
+    # One editor shares --files files and types into all of them in turn
+    # while the other keeps them open in background tabs, with --closed of
+    # them closed. Every file must converge from the relayed edits alone,
+    # with no snapshot or sync request, and closed files reopen from
+    # memory. Also times find_tab with all the tabs open.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    import code_editor
+    server = start_server(args.port)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            session_id = f'tabs-{time.time()}'
+            windows = []
+            for _ in range(2):
+                window = code_editor.MainWindow()
+                window.session_id = session_id
+                window.show_editor()
+                window.start_collab_client(f'ws://localhost:{args.port}')
+                pump_until(app, window.collab_connected)
+                windows.append(window)
+            writer, reader = windows
+            paths = []
+            for n in range(args.files):
+                file_path = os.path.join(directory, f'file{n}.py')
+                with open(file_path, 'w') as f:
+                    f.write(f'# file {n}\n' + 'pass\n' * args.lines)
+                writer.open_file_by_path(file_path)
+                paths.append(file_path)
+            pump_until(app, lambda: all(reader.find_tab(path) is not None for path in paths) and all(writer.collab_docs[path].inflight is None for path in paths), timeout=30)
+            for path in paths[:args.closed]:
+                tab = reader.find_tab(path)
+                tab.set_saved()  # no save prompt
+                reader.close_tab(reader.tabs.indexOf(tab))
+            counts = {'snapshots': 0, 'sync_requests': 0}
+            reader.collab_open_file_signal.connect(lambda *_: counts.__setitem__('snapshots', counts['snapshots'] + 1))
+            send = reader.send_collab_message
+
+            def counting_send(msg):
+                if msg['type'] == 'sync':
+                    counts['sync_requests'] += 1
+                send(msg)
+            reader.send_collab_message = counting_send
+            editors = [writer.find_tab(path).editor for path in paths]
+            edits = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < args.duration:
+                editor = editors[edits % len(editors)]
+                writer.tabs.setCurrentWidget(writer.find_tab(editor.file_path))
+                editor.SendScintilla(editor.SCI_INSERTTEXT, editor.SendScintilla(editor.SCI_GETLENGTH) // 2, b'x = 1\n')
+                edits += 1
+                pump(app, start + edits / args.cps - time.perf_counter())
+
+            def reader_text(path):
+                tab = reader.find_tab(path)
+                return tab.editor.text().encode('utf-8') if tab is not None else bytes(reader.closed_texts[path])
+
+            def settled():
+                return (not writer.collab_dirty_tabs and all(writer.collab_docs[path].inflight is None and not writer.collab_docs[path].buffer for path in paths)
+                        and all(reader.collab_docs[path].version == writer.collab_docs[path].version for path in paths))
+            pump_until(app, settled, timeout=30)
+            converged = all(reader_text(path) == editor.text().encode('utf-8') for path, editor in zip(paths, editors))
+            reopen = []
+            for path in paths[:args.closed]:
+                reopen_start = time.perf_counter()
+                reader.open_file_by_path(path)
+                reopen.append(time.perf_counter() - reopen_start)
+            reopened = all(reader.find_tab(path).editor.text() == editor.text() for path, editor in zip(paths, editors))
+            lookups = 10000
+            lookup_start = time.perf_counter()
+            for n in range(lookups):
+                reader.find_tab(paths[n % len(paths)])
+            lookup_time = time.perf_counter() - lookup_start
+            for window in windows:
+                window.collab_ws.close()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'benchmark': 'tabs',
+        'files': args.files,
+        'closed': args.closed,
+        'edits': edits,
+        'converged': converged and reopened,
+        **counts,
+        'reopen_ms': round(percentile(reopen, 50) * 1e3, 2) if reopen else None,
+        'find_tab_us': round(lookup_time * 1e6 / lookups, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the collaboration path')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ot = sub.add_parser('ot', help='server-side transform/apply throughput')
+    ot.add_argument('--ops', type=int, default=20000)
+    ot.add_argument('--lag', type=int, default=20, help='max versions a client is behind')
+    ot.add_argument('--doc-size', type=int, default=100000)
+    ot.add_argument('--seed', type=int, default=0)
+    ot.set_defaults(func=bench_ot)
+    fanout = sub.add_parser('fanout', help='broadcast latency by session size')
+    fanout.add_argument('--peers', type=lambda v: [int(n) for n in v.split(',')], default=[2, 10, 100, 1000])
+    fanout.add_argument('--messages', type=int, default=500)
+    fanout.add_argument('--slow', type=int, default=1, help='peers that take --slow-delay per send')
+    fanout.add_argument('--slow-delay', type=float, default=0.05)
+    fanout.add_argument('--wire', choices=['json', 'binary'], default='json')
+    fanout.add_argument('--metrics', action='store_true', help='with the server instrumentation switched on')
+    fanout.set_defaults(func=bench_fanout)
+    recovery = sub.add_parser('recovery', help='session store recovery time after N logged ops')
+    recovery.add_argument('--ops', type=int, default=1000000)
+    recovery.add_argument('--snapshot-every', type=int, default=10000, help='0 replays the whole log')
+    recovery.add_argument('--doc-size', type=int, default=100000)
+    recovery.add_argument('--seed', type=int, default=0)
+    recovery.set_defaults(func=bench_recovery)
+    wire = sub.add_parser('wire', help='bytes on wire and codec CPU, JSON vs. binary frames')
+    wire.add_argument('--iterations', type=int, default=2000)
+    wire.set_defaults(func=bench_wire)
+    apply = sub.add_parser('apply', help='editor time to apply a remote snapshot with a small change')
+    apply.add_argument('--sizes', type=lambda v: [int(n) for n in v.split(',')], default=[10000, 100000, 1000000, 5000000])
+    apply.add_argument('--repeat', type=int, default=5)
+    apply.set_defaults(func=bench_apply)
+    typing = sub.add_parser('typing', help='client edit messages and UI-thread time under scripted typing')
+    typing.add_argument('--chars', type=int, default=600)
+    typing.add_argument('--cps', type=float, default=60.0, help='keystrokes per second')
+    typing.add_argument('--batch-ms', type=lambda v: [int(n) for n in v.split(',')], default=[16, 30, 50])
+    typing.add_argument('--port', type=int, default=8798)
+    typing.set_defaults(func=bench_typing)
+    reconnect = sub.add_parser('reconnect', help='two clients typing through a dropped connection or a server restart')
+    reconnect.add_argument('--scenarios', type=lambda v: v.split(','), default=['drop', 'restart', 'compact'])
+    reconnect.add_argument('--cps', type=float, default=20.0, help='keystrokes per second per client')
+    reconnect.add_argument('--before', type=float, default=1.0, help='seconds of typing before the failure')
+    reconnect.add_argument('--offline', type=float, default=2.0, help='seconds the server stays down in the restart scenario')
+    reconnect.add_argument('--after', type=float, default=1.0, help='seconds of typing after it comes back')
+    reconnect.add_argument('--port', type=int, default=8797)
+    reconnect.set_defaults(func=bench_reconnect)
+    load = sub.add_parser('load', help='headless clients: throughput, propagation latency, server CPU and RSS')
+    load.add_argument('--clients', type=int, default=1000)
+    load.add_argument('--session-size', type=int, default=10, help='clients per session; the first shares the file')
+    load.add_argument('--rate', type=float, default=5.0, help='keystrokes per second per client')
+    load.add_argument('--doc-size', type=int, default=10000, help='bytes in each shared file')
+    load.add_argument('--batch-ms', type=int, default=30, help='client-side batching window, as COLLAB_BATCH_MS')
+    load.add_argument('--duration', type=float, default=30.0, help='seconds of typing measured')
+    load.add_argument('--ramp', type=float, default=5.0, help='seconds over which clients connect')
+    load.add_argument('--setup', type=float, default=5.0, help='extra seconds after the ramp before typing starts')
+    load.add_argument('--processes', type=int, default=os.cpu_count(), help='client processes; sessions are split between them')
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--url', help='an already running server; one is started on --port otherwise')
+    load.add_argument('--server-pid', type=int, help='pid of the --url server, for CPU and RSS')
+    load.add_argument('--server-args', default='', help='extra collab_server.py arguments for the started server')
+    load.add_argument('--port', type=int, default=8796)
+    load.add_argument('--output', help='also write the JSON result here, e.g. to compare commits')
+    load.set_defaults(func=bench_load)
+    presence = sub.add_parser('presence', help='presence traffic and settle time of a reconnect storm by room size')
+    presence.add_argument('--members', type=lambda v: [int(n) for n in v.split(',')], default=[50, 200, 500])
+    presence.add_argument('--timeout', type=float, default=60.0)
+    presence.add_argument('--port', type=int, default=8795)
+    presence.set_defaults(func=bench_presence)
+    cursors = sub.add_parser('cursors', help='editor and server cost of remote cursors streamed by other session members')
+    cursors.add_argument('--clients', type=lambda v: [int(n) for n in v.split(',')], default=[10, 50])
+    cursors.add_argument('--rate', type=float, default=20.0, help='cursor moves per second per member')
+    cursors.add_argument('--duration', type=float, default=10.0)
+    cursors.add_argument('--lines', type=int, default=1000, help='lines in the shared file')
+    cursors.add_argument('--cps', type=float, default=10.0, help='keystrokes per second typed in the editor meanwhile')
+    cursors.add_argument('--seed', type=int, default=0)
+    cursors.add_argument('--port', type=int, default=8794)
+    cursors.add_argument('--metrics-port', type=int, default=9794)
+    cursors.set_defaults(func=bench_cursors)
+    tabs = sub.add_parser('tabs', help='remote edits to background and closed tabs: convergence without snapshots')
+    tabs.add_argument('--files', type=int, default=20)
+    tabs.add_argument('--closed', type=int, default=5, help='files the receiving editor closes before the edits')
+    tabs.add_argument('--lines', type=int, default=1000, help='lines in each file')
+    tabs.add_argument('--cps', type=float, default=50.0, help='edits per second, spread over the files')
+    tabs.add_argument('--duration', type=float, default=4.0)
+    tabs.add_argument('--port', type=int, default=8793)
+    tabs.set_defaults(func=bench_tabs)
+    scaling = sub.add_parser('scaling', help='edit throughput vs. server worker count')
+    scaling.add_argument('--workers', type=lambda v: [int(n) for n in v.split(',')], default=[1, 2, 4, 8])
+    scaling.add_argument('--clients', type=int, default=os.cpu_count(), help='load-generating processes')
+    scaling.add_argument('--sessions', type=int, default=50, help='writer/reader session pairs per client process')
+    scaling.add_argument('--duration', type=float, default=10.0)
+    scaling.add_argument('--port', type=int, default=8799)
+    scaling.set_defaults(func=bench_scaling)
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
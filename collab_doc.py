@@ -0,0 +1,325 @@
+import zlib
+from collections import deque
+from difflib import SequenceMatcher
+from itertools import islice
+
+# Ops are (kind, pos, arg) tuples over the UTF-8 bytes of a document, the same
+# units Scintilla uses for positions: (INSERT, pos, data) or (DELETE, pos, length)
+INSERT = 'insert'
+DELETE = 'delete'
+
+HISTORY_LIMIT = 1000  # versions kept for transforming late ops
+
+
+class StaleVersionError(Exception):
+    pass
+
+
+def ops_from_wire(ops):
+    result = []
+    for op in ops:
+        pos = op['pos']
+        if not isinstance(pos, int) or pos < 0:
+            raise ValueError(f'bad op position: {pos!r}')
+        if op['op'] == INSERT:
+            result.append((INSERT, pos, op['text'].encode('utf-8')))
+        elif op['op'] == DELETE:
+            if not isinstance(op['length'], int) or op['length'] < 0:
+                raise ValueError(f'bad delete length: {op["length"]!r}')
+            result.append((DELETE, pos, op['length']))
+        else:
+            raise ValueError(f'unknown op: {op["op"]!r}')
+    return result
+
+
+def ops_to_wire(ops):
+    wire = []
+    for kind, pos, arg in ops:
+        if kind == INSERT:
+            wire.append({'op': INSERT, 'pos': pos, 'text': arg.decode('utf-8', 'replace')})
+        else:
+            wire.append({'op': DELETE, 'pos': pos, 'length': arg})
+    return wire
+
+
+def append_op(ops, op):
+    # Fold op into the last op when it continues it, so a burst of typing or
+    # backspacing collapses into one insert or delete
+    if ops:
+        kind, pos, arg = op
+        last_kind, last_pos, last_arg = ops[-1]
+        if last_kind == INSERT and last_pos <= pos <= last_pos + len(last_arg):
+            offset = pos - last_pos
+            if kind == INSERT:
+                ops[-1] = (INSERT, last_pos, last_arg[:offset] + arg + last_arg[offset:])
+                return
+            if offset + arg <= len(last_arg):
+                # Deleting text that was just typed
+                rest = last_arg[:offset] + last_arg[offset + arg:]
+                if rest:
+                    ops[-1] = (INSERT, last_pos, rest)
+                else:
+                    ops.pop()
+                return
+        elif last_kind == DELETE and kind == DELETE:
+            if pos == last_pos:
+                ops[-1] = (DELETE, pos, last_arg + arg)
+                return
+            if pos + arg == last_pos:
+                ops[-1] = (DELETE, pos, arg + last_arg)
+                return
+    ops.append(op)
+
+
+def apply_ops(buf, ops):
+    # Validate the whole batch first so a bad op never leaves buf half-edited
+    length = len(buf)
+    for kind, pos, arg in ops:
+        if kind == INSERT:
+            if pos > length:
+                raise ValueError(f'insert at {pos} past end of {length}-byte document')
+            length += len(arg)
+        else:
+            if pos + arg > length:
+                raise ValueError(f'delete of {pos}:{pos + arg} past end of {length}-byte document')
+            length -= arg
+    for kind, pos, arg in ops:
+        if kind == INSERT:
+            buf[pos:pos] = arg
+        else:
+            del buf[pos:pos + arg]
+
+
+def transform_op(a, b, a_first):
+    # Rewrite op a (concurrent with b, same base) so it applies after b.
+    # a_first breaks ties between inserts at the same position.
+    a_kind, a_pos, a_arg = a
+    b_kind, b_pos, b_arg = b
+    if a_kind == INSERT:
+        if b_kind == INSERT:
+            if a_pos < b_pos or (a_pos == b_pos and a_first):
+                return [a]
+            return [(INSERT, a_pos + len(b_arg), a_arg)]
+        if a_pos <= b_pos:
+            return [a]
+        if a_pos >= b_pos + b_arg:
+            return [(INSERT, a_pos - b_arg, a_arg)]
+        return [(INSERT, b_pos, a_arg)]
+    a_end = a_pos + a_arg
+    if b_kind == INSERT:
+        if b_pos >= a_end:
+            return [a]
+        if b_pos <= a_pos:
+            return [(DELETE, a_pos + len(b_arg), a_arg)]
+        # Insert landed inside the deleted range: keep it, delete around it
+        head = b_pos - a_pos
+        return [(DELETE, a_pos, head), (DELETE, a_pos + len(b_arg), a_arg - head)]
+    b_end = b_pos + b_arg
+    if a_end <= b_pos:
+        return [a]
+    if a_pos >= b_end:
+        return [(DELETE, a_pos - b_arg, a_arg)]
+    remaining = a_arg - (min(a_end, b_end) - max(a_pos, b_pos))
+    if remaining == 0:
+        return []
+    return [(DELETE, min(a_pos, b_pos), remaining)]
+
+
+def transform(a_ops, b_ops, a_first):
+    # Transform two concurrent op sequences against each other; returns
+    # (a', b') where a' applies after b_ops and b' applies after a_ops
+    a_out = []
+    for a in a_ops:
+        a_parts = [a]
+        b_next = []
+        for b in b_ops:
+            if len(a_parts) == 1:
+                a_part = a_parts[0]
+                a_parts = transform_op(a_part, b, a_first)
+                b_next.extend(transform_op(b, a_part, not a_first))
+            else:
+                a_parts, b_part = transform(a_parts, [b], a_first)
+                b_next.extend(b_part)
+        a_out.extend(a_parts)
+        b_ops = b_next
+    return a_out, b_ops
+
+
+def common_prefix(a, b):
+    # Binary search on slice equality keeps the comparisons in C
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def diff_range(old, new):
+    # Returns (start, old_end, new_end): only old[start:old_end] differs,
+    # and it became new[start:new_end]
+    prefix = common_prefix(old, new)
+    limit = min(len(old), len(new)) - prefix
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:len(old) - lo] == new[len(new) - mid:len(new) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, len(old) - lo, len(new) - lo
+
+
+def diff_ops(old, new):
+    start, old_end, new_end = diff_range(old, new)
+    ops = []
+    if old_end > start:
+        ops.append((DELETE, start, old_end - start))
+    if new_end > start:
+        ops.append((INSERT, start, bytes(new[start:new_end])))
+    return ops
+
+
+def diff_line_ops(old, new):
+    # Like diff_ops, but one delete/insert pair per changed run of lines, so
+    # ops transformed against the result keep their place between the runs.
+    # Pairs go last-first, so each position is still one in old.
+    start, old_end, new_end = diff_range(old, new)
+    old_lines = bytes(old[start:old_end]).splitlines(True)
+    new_lines = bytes(new[start:new_end]).splitlines(True)
+    offsets = [start]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+    ops = []
+    for tag, i1, i2, j1, j2 in reversed(SequenceMatcher(None, old_lines, new_lines).get_opcodes()):
+        if tag == 'equal':
+            continue
+        if i2 > i1:
+            ops.append((DELETE, offsets[i1], offsets[i2] - offsets[i1]))
+        if j2 > j1:
+            ops.append((INSERT, offsets[i1], b''.join(new_lines[j1:j2])))
+    return ops
+
+
+class Document:
+    def __init__(self, content=b'', version=0, history_limit=HISTORY_LIMIT):
+        self.buf = bytearray(content)
+        self.version = version
+        # history[-1] holds the ops that produced self.version, authors[-1]
+        # the (client_id, seq) that sent them, if known
+        self.history = deque(maxlen=history_limit)
+        self.authors = deque(maxlen=history_limit)
+        self.seqs = {}  # client_id: highest seq applied
+        self.compressed = None  # (version, zlib bytes) cached for late joiners
+
+    def text(self):
+        return self.buf.decode('utf-8', 'replace')
+
+    def snapshot(self):
+        if self.compressed is None or self.compressed[0] != self.version:
+            self.compressed = (self.version, zlib.compress(self.buf, 1))
+        return self.compressed[1]
+
+    def ops_since(self, version):
+        behind = self.version - version
+        if behind < 0 or behind > len(self.history):
+            raise StaleVersionError(f'version {version} not in history (at {self.version})')
+        return list(islice(self.history, len(self.history) - behind, None))
+
+    def history_since(self, version):
+        # [(version, ops, author)] for every version after the given one
+        missed = self.ops_since(version)
+        authors = islice(self.authors, len(self.authors) - len(missed), None)
+        return [(version + n + 1, ops, author) for n, (ops, author) in enumerate(zip(missed, authors))]
+
+    def apply(self, ops, base_version=None, author=None):
+        if base_version is not None:
+            for concurrent in self.ops_since(base_version):
+                ops, _ = transform(ops, concurrent, False)
+        apply_ops(self.buf, ops)
+        self.version += 1
+        self.history.append(ops)
+        self.authors.append(author)
+        if author is not None:
+            self.seqs[author[0]] = author[1]
+        return ops
+
+    def replace(self, content):
+        # Full-content fallback: diffed against the current state, so it
+        # overrides concurrent edits rather than merging with them
+        return self.apply(diff_ops(self.buf, content))
+
+
+class ClientDocument:
+    # Client half of the protocol: at most one batch in flight, later local
+    # ops buffered, remote ops transformed past both before being applied.
+    # shadow is the text at version as the server has it, without our
+    # unacknowledged ops, so a snapshot can be diffed against it and those
+    # ops carried over instead of lost.
+    def __init__(self, version=0, content=b''):
+        self.seq = 0  # sender's number for the latest batch, see outgoing()
+        self.reset(version, content)
+
+    def reset(self, version, content):
+        self.version = version
+        self.shadow = bytearray(content)
+        self.inflight = None
+        self.buffer = []
+
+    def hold(self):
+        # Block sends until the next ack, e.g. while an open_file is in flight
+        if self.inflight is None:
+            self.inflight = []
+
+    def local(self, ops):
+        for op in ops:
+            append_op(self.buffer, op)
+
+    def outgoing(self, seq):
+        # seq must grow with every batch a client sends; the server drops a
+        # batch whose seq it has already applied, so a resend after a
+        # reconnect is never applied twice
+        if self.inflight is not None or not self.buffer:
+            return None
+        self.seq = seq
+        self.inflight, self.buffer = self.buffer, []
+        return self.inflight
+
+    def ack(self, version):
+        if self.inflight:
+            # Transformed past every remote op since it was sent, so the
+            # server applied it in this form
+            apply_ops(self.shadow, self.inflight)
+        self.version = version
+        self.inflight = None
+
+    def remote(self, ops, version):
+        apply_ops(self.shadow, ops)
+        if self.inflight:
+            ops, self.inflight = transform(ops, self.inflight, True)
+        if self.buffer:
+            ops, self.buffer = transform(ops, self.buffer, True)
+        self.version = version
+        return ops
+
+    def rebase(self, content, version, seq=None):
+        # Move onto a snapshot at version. seq is the highest batch of ours
+        # the server had applied when it took the snapshot; the batch in
+        # flight is already in content if it is covered, and is sent again
+        # otherwise. Local ops are transformed past the snapshot's changes
+        # and buffered. Returns ops that turn the local text (shadow plus
+        # local ops) into content with the local ops on top.
+        if self.inflight and seq is not None and seq >= self.seq:
+            apply_ops(self.shadow, self.inflight)
+            local = self.buffer
+        else:
+            local = (self.inflight or []) + self.buffer
+        if local:
+            ops, local = transform(diff_line_ops(self.shadow, content), local, True)
+        else:
+            ops = diff_ops(self.shadow, content)
+        self.reset(version, content)
+        self.buffer = local
+        return ops
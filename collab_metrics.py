@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+
+# Upper bounds in seconds, from a fast local send up to a stalled event loop
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LOOP_LAG_INTERVAL = 0.25  # seconds between event-loop lag probes
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values: total
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+
+class Histogram:
+    # Cumulative buckets are built at scrape time; observe() only bumps one
+    # bucket, the sum and the count
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values: [per-bucket counts (last is +Inf), sum, count]
+
+    def observe(self, value, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                labels = format_labels((*self.labels, 'le'), (*label_values, format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Collected:
+    # A gauge or counter kept elsewhere and read at scrape time from
+    # collect(), which returns {label values: value}
+    def __init__(self, name, help, kind, labels, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for label_values, value in sorted(self.collect().items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+
+class ServerMetrics:
+    # Instrumentation for collab_server, served in the Prometheus text
+    # format. The server keeps a module-level reference that stays None
+    # unless --metrics-port is given, and every hot-path call sits behind
+    # that check, so a server without metrics pays one global lookup.
+    def __init__(self):
+        self.received_messages = Counter('collab_received_messages_total', 'Messages received from clients.', ('type',))
+        self.received_bytes = Counter('collab_received_bytes_total', 'Frame bytes received from clients.', ('type',))
+        self.sent_messages = Counter('collab_sent_messages_total', 'Messages queued for clients.', ('type',))
+        self.sent_bytes = Counter('collab_sent_bytes_total', 'Frame bytes queued for clients.', ('type',))
+        self.errors = Counter('collab_handler_errors_total', 'Connections closed by an unexpected error in the handler.', ('error',))
+        self.encode_seconds = Histogram('collab_broadcast_encode_seconds', 'Time to encode a broadcast message, once per wire format.', ('wire',))
+        self.broadcast_seconds = Histogram('collab_broadcast_seconds', 'Time to encode and queue a broadcast for every recipient.', ('type',))
+        self.queue_seconds = Histogram('collab_send_queue_seconds', 'Time a message waits in a client queue before the send starts.')
+        self.send_seconds = Histogram('collab_send_seconds', 'Time to hand one message to the websocket.')
+        self.loop_lag_seconds = Histogram('collab_event_loop_lag_seconds', 'How late the event loop wakes a sleeping task.')
+        self.metrics = [self.received_messages, self.received_bytes, self.sent_messages, self.sent_bytes, self.errors,
+                        self.encode_seconds, self.broadcast_seconds, self.queue_seconds, self.send_seconds, self.loop_lag_seconds]
+
+    def add_collected(self, name, help, kind, labels, collect):
+        self.metrics.append(Collected(name, help, kind, labels, collect))
+
+    def received(self, kind, size):
+        self.received_messages.inc(kind)
+        self.received_bytes.inc(kind, amount=size)
+
+    def sent(self, kind, size, count=1):
+        # size: total bytes of the count messages
+        self.sent_messages.inc(kind, amount=count)
+        self.sent_bytes.inc(kind, amount=size)
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+    async def watch_loop_lag(self, interval=LOOP_LAG_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag_seconds.observe(max(loop.time() - start - interval, 0.0))
+
+    async def serve(self, host, port):
+        # Just enough HTTP for a scraper: GET /metrics, one response per connection
+        async def respond(reader, writer):
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+                path = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+                if path.split(b'?')[0] == b'/metrics':
+                    body = self.render().encode('utf-8')
+                    status = b'200 OK'
+                else:
+                    body = b'Not found; metrics are at /metrics\n'
+                    status = b'404 Not Found'
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                             + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('ascii') + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+        return await asyncio.start_server(respond, host, port)
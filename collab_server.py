@@ -1,50 +1,605 @@
+import argparse
 import asyncio
 import websockets
 import uuid
 import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+import zlib
+from collections import deque
+from functools import partial
+from collab_doc import Document, StaleVersionError
+from collab_metrics import ServerMetrics
+from collab_store import SessionStore, SNAPSHOT_EVERY
+from collab_wire import FileTable, decode, encode
 
-sessions = {}  # session_id: set of (websocket, user_id)
+sessions = {}  # session_id: {websocket: user_id}
 user_sessions = {}  # websocket: (session_id, user_id)
+user_counts = {}  # session_id: {user_id: open connections}
+presence_pending = {}  # session_id: {user_id: True if joined, False if left} within the coalescing window
+documents = {}  # session_id: {file_path: Document}
+file_tables = {}  # session_id: FileTable of ids used in binary frames
+sessions_closed = 0  # sessions emptied so far, to spot a read a close may have made stale
+peers = {}  # websocket: Peer
+store = None  # SessionStore when running with --data-dir
+metrics = None  # ServerMetrics when running with --metrics-port
+WORKER_INDEX = 0
+WORKERS = 1
 
-async def broadcast_presence(session_id):
-    users = [user_id for ws, user_id in sessions.get(session_id, set())]
-    msg = json.dumps({'type': 'presence', 'users': users})
-    for ws, _ in sessions.get(session_id, set()):
-        await ws.send(msg)
+# Slow-consumer policy; a peer whose pending outbound data exceeds either
+# limit is disconnected rather than buffered without bound
+MAX_QUEUE_MESSAGES = 10000
+MAX_QUEUE_BYTES = 16 * 1024 * 1024
+# Snapshots at least this large go to late joiners compressed and in chunks
+SNAPSHOT_COMPRESS_MIN = 64 * 1024
+SNAPSHOT_CHUNK_SIZE = 256 * 1024
+# Presence goes out as joined/left deltas gathered over a short window; a
+# full user list goes to each newcomer and to everyone periodically, in
+# case a delta was lost with a dropped queue entry
+PRESENCE_COALESCE_SECONDS = 0.1
+PRESENCE_RESYNC_SECONDS = 30.0
+# Cursor positions are relayed latest-wins per user and never queued behind
+# a backlog: a peer with more than this many messages waiting misses new
+# ones. Rewriting a queued one instead would move it ahead of edits queued
+# since, so the caret could arrive before the text it points into.
+CURSOR_QUEUE_LIMIT = 64
+stats = {'presence_coalesced': 0, 'presence_dropped': 0, 'cursors_coalesced': 0, 'cursors_dropped': 0, 'snapshots_coalesced': 0, 'edits_coalesced': 0, 'slow_disconnects': 0}
 
-async def handler(websocket):
+class Peer:
+    # Outbound side of one connection. Messages are queued already encoded and
+    # a dedicated writer task sends them in order, so a slow client only delays
+    # itself and never the broadcaster.
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue = deque()  # [msg, kind, key]; msg is None once superseded
+        self.queued_bytes = 0
+        self.latest = {}  # (kind, key): newest pending presence/snapshot/cursor entry
+        self.unlogged = 0  # this client's edits still waiting for the log flush
+        self.ready = asyncio.Event()
+        self.closing = False
+        self.accepts = set()  # snapshot encodings the client advertised at join
+        self.wire = 'json'  # 'binary' once negotiated at join
+        self.files = FileTable()  # replaced by the session's table at join
+        self.writer = asyncio.create_task(self.drain())
+
+    def send(self, msg, kind=None, key=None):
+        if self.closing:
+            return
+        if kind == 'cursor' and len(self.queue) > CURSOR_QUEUE_LIMIT:
+            stats['cursors_dropped'] += 1
+            return
+        entry = [msg, kind, key]
+        if metrics:
+            entry.append(time.perf_counter())  # queued at
+        if kind == 'presence':
+            # A full user list covers every delta queued before it
+            for pending in self.queue:
+                if pending[1] == 'presence_delta' and pending[0] is not None:
+                    self.drop(pending)
+                    stats['presence_dropped'] += 1
+        if kind in ('presence', 'snapshot', 'cursor'):
+            old = self.latest.get((kind, key))
+            if old is not None:
+                if kind == 'presence':
+                    stats['presence_dropped'] += 1
+                elif kind == 'cursor':
+                    stats['cursors_coalesced'] += 1
+                else:
+                    # The new snapshot already contains any edits queued since the old one
+                    stats['snapshots_coalesced'] += 1
+                    for pending in self.queue:
+                        if pending[1] == 'edit' and pending[2] == key and pending[0] is not None:
+                            self.drop(pending)
+                            stats['edits_coalesced'] += 1
+                self.drop(old)
+            self.latest[(kind, key)] = entry
+        self.queue.append(entry)
+        self.queued_bytes += len(msg)
+        if len(self.queue) > MAX_QUEUE_MESSAGES or self.queued_bytes > MAX_QUEUE_BYTES:
+            stats['slow_disconnects'] += 1
+            self.closing = True
+            self.close()
+            asyncio.create_task(self.websocket.close(1013, 'outbound backlog too large'))
+            return
+        self.ready.set()
+
+    def send_message(self, data, kind=None, key=None):
+        msg = encode(data, self.wire, self.files.ids)
+        if metrics:
+            metrics.sent(data['type'], len(msg))
+        self.send(msg, kind, key)
+
+    def drop(self, entry):
+        self.queued_bytes -= len(entry[0])
+        entry[0] = None
+
+    async def drain(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                entry = self.queue.popleft()
+                msg, kind, key = entry[:3]
+                if self.latest.get((kind, key)) is entry:
+                    del self.latest[(kind, key)]
+                if msg is None:
+                    continue
+                self.queued_bytes -= len(msg)
+                if metrics and len(entry) > 3:
+                    start = time.perf_counter()
+                    metrics.queue_seconds.observe(start - entry[3])
+                    await self.websocket.send(msg)
+                    metrics.send_seconds.observe(time.perf_counter() - start)
+                else:
+                    await self.websocket.send(msg)
+        except websockets.ConnectionClosed:
+            pass
+
+    def close(self):
+        self.writer.cancel()
+        self.queue.clear()
+        self.latest.clear()
+        self.queued_bytes = 0
+
+def session_queues():
+    # {(session_id,): (queued messages, queued bytes)} over the session's peers
+    totals = {}
+    for ws, (session_id, _) in user_sessions.items():
+        peer = peers.get(ws)
+        if peer is not None:
+            messages, queued_bytes = totals.get((session_id,), (0, 0))
+            totals[(session_id,)] = (messages + len(peer.queue), queued_bytes + peer.queued_bytes)
+    return totals
+
+async def start_metrics(args, index):
+    global metrics
+    metrics = ServerMetrics()
+    metrics.add_collected('collab_connections', 'Open client connections.', 'gauge', (), lambda: {(): len(peers)})
+    metrics.add_collected('collab_sessions', 'Sessions with at least one client.', 'gauge', (), lambda: {(): len(sessions)})
+    metrics.add_collected('collab_documents', 'Shared documents held in memory.', 'gauge', (), lambda: {(): sum(len(docs) for docs in documents.values())})
+    metrics.add_collected('collab_session_queued_messages', 'Messages waiting in the outbound queues of a session\'s clients.', 'gauge', ('session',), lambda: {key: value[0] for key, value in session_queues().items()})
+    metrics.add_collected('collab_session_queued_bytes', 'Bytes waiting in the outbound queues of a session\'s clients.', 'gauge', ('session',), lambda: {key: value[1] for key, value in session_queues().items()})
+    metrics.add_collected('collab_max_queue_depth', 'Deepest single outbound queue.', 'gauge', (), lambda: {(): max((len(peer.queue) for peer in peers.values()), default=0)})
+    for name, help in (('presence_coalesced', 'Joins and leaves folded into another within the presence window.'),
+                       ('presence_dropped', 'Presence messages superseded by a newer full user list before sending.'),
+                       ('snapshots_coalesced', 'Snapshots replaced by a newer one before sending.'),
+                       ('edits_coalesced', 'Queued edits dropped because a newer snapshot covers them.'),
+                       ('cursors_coalesced', 'Cursor positions replaced by a newer one from the same user before sending.'),
+                       ('cursors_dropped', 'Cursor positions not queued because the client was backlogged.'),
+                       ('slow_disconnects', 'Clients disconnected for an outbound backlog over the limits.')):
+        metrics.add_collected(f'collab_{name}_total', help, 'counter', (), lambda name=name: {(): stats[name]})
+    # Each worker of a --workers server gets its own port
+    port = args.metrics_port + index
+    print(f'Metrics at http://{args.metrics_host}:{port}/metrics', flush=True)
+    return asyncio.create_task(metrics.watch_loop_lag()), await metrics.serve(args.metrics_host, port)
+
+def queue_stats():
+    depths = [len(peer.queue) for peer in peers.values()]
+    return {
+        **stats,
+        'connections': len(peers),
+        'sessions': len(sessions),
+        'queued_messages': sum(depths),
+        'queued_bytes': sum(peer.queued_bytes for peer in peers.values()),
+        'max_queue_depth': max(depths, default=0),
+    }
+
+async def report_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({'queue_stats': queue_stats()}), flush=True)
+
+def add_member(session_id, websocket, user_id):
+    sessions[session_id][websocket] = user_id
+    user_sessions[websocket] = (session_id, user_id)
+    counts = user_counts.setdefault(session_id, {})
+    counts[user_id] = counts.get(user_id, 0) + 1
+    if counts[user_id] == 1:
+        queue_presence(session_id, user_id, True)
+
+def remove_member(session_id, websocket):
+    # Returns whether the session is now empty
+    user_id = sessions[session_id].pop(websocket)
+    del user_sessions[websocket]
+    counts = user_counts[session_id]
+    counts[user_id] -= 1
+    if not counts[user_id]:
+        del counts[user_id]
+        queue_presence(session_id, user_id, False)
+    if sessions[session_id]:
+        return False
+    del sessions[session_id]
+    del user_counts[session_id]
+    presence_pending.pop(session_id, None)
+    return True
+
+def leave_session(websocket):
+    # The last member out closes the session
+    global sessions_closed
+    session_id = user_sessions[websocket][0]
+    if remove_member(session_id, websocket):
+        docs = documents.pop(session_id, None)
+        del file_tables[session_id]
+        sessions_closed += 1
+        if store and docs:
+            store.close_session(session_id, docs)
+
+def queue_presence(session_id, user_id, joined):
+    # A user's first connection joins, its last one leaves; a leave and a
+    # join of the same user within the window (a reconnect) cancel out
+    pending = presence_pending.get(session_id)
+    if pending is None:
+        pending = presence_pending[session_id] = {}
+        asyncio.get_running_loop().call_later(PRESENCE_COALESCE_SECONDS, flush_presence, session_id)
+    if pending.get(user_id) is (not joined):
+        del pending[user_id]
+        stats['presence_coalesced'] += 2
+    else:
+        if user_id in pending:
+            stats['presence_coalesced'] += 1
+        pending[user_id] = joined
+
+def flush_presence(session_id):
+    pending = presence_pending.pop(session_id, None)
+    if pending and session_id in sessions:
+        joined = [user_id for user_id, change in pending.items() if change]
+        left = [user_id for user_id, change in pending.items() if not change]
+        broadcast(session_id, None, {'type': 'presence', 'joined': joined, 'left': left}, 'presence_delta')
+
+async def resync_presence(interval):
+    while True:
+        await asyncio.sleep(interval)
+        for session_id, counts in list(user_counts.items()):
+            if session_id in sessions:
+                broadcast(session_id, None, {'type': 'presence', 'users': list(counts)}, 'presence')
+
+def broadcast(session_id, sender, data, kind=None, key=None):
+    # Encoded at most once per wire format and shared by every recipient
+    if metrics:
+        start = time.perf_counter()
+        sent = sent_bytes = 0
+    encoded = {}
+    file_ids = file_tables[session_id].ids
+    for ws in sessions[session_id]:
+        if ws != sender:
+            peer = peers[ws]
+            msg = encoded.get(peer.wire)
+            if msg is None:
+                if metrics:
+                    encode_start = time.perf_counter()
+                    msg = encoded[peer.wire] = encode(data, peer.wire, file_ids)
+                    metrics.encode_seconds.observe(time.perf_counter() - encode_start, peer.wire)
+                else:
+                    msg = encoded[peer.wire] = encode(data, peer.wire, file_ids)
+            if metrics:
+                sent += 1
+                sent_bytes += len(msg)
+            peer.send(msg, kind, key)
+    if metrics:
+        metrics.sent(data['type'], sent_bytes, sent)
+        metrics.broadcast_seconds.observe(time.perf_counter() - start, data['type'])
+
+def announce_file(session_id, file_path):
+    file_id, new = file_tables[session_id].intern(file_path)
+    if new:
+        msg = encode({'type': 'file_id', 'file_id': file_id, 'file_path': file_path}, 'binary', {})
+        for ws in sessions[session_id]:
+            if peers[ws].wire == 'binary':
+                if metrics:
+                    metrics.sent('file_id', len(msg))
+                peers[ws].send(msg)
+
+def send_snapshot(peer, file_path, doc, user_id):
+    # Carries the highest seq of user_id's the snapshot includes, so the
+    # client knows whether its batch in flight is in it and can carry any
+    # other unacknowledged edits over onto it
+    seq = doc.seqs.get(user_id, 0)
+    if len(doc.buf) < SNAPSHOT_COMPRESS_MIN or not {'zlib', 'chunks'} <= peer.accepts:
+        peer.send_message({'type': 'open_file', 'file_path': file_path, 'content': doc.text(), 'version': doc.version, 'seq': seq}, 'snapshot', file_path)
+        return
+    # Chunks are queued untracked, so unlike the single-message form they are
+    # never replaced by a newer snapshot and never drop the edits queued
+    # behind them; the client applies those edits on top once it has every
+    # chunk. Dropping a set partly sent would leave the client unable to
+    # reassemble it.
+    payload = doc.snapshot()
+    count = -(-len(payload) // SNAPSHOT_CHUNK_SIZE)
+    for index in range(count):
+        chunk = payload[index * SNAPSHOT_CHUNK_SIZE:(index + 1) * SNAPSHOT_CHUNK_SIZE]
+        peer.send_message({'type': 'snapshot_chunk', 'file_path': file_path, 'version': doc.version, 'seq': seq, 'encoding': 'zlib', 'index': index, 'count': count, 'data': chunk})
+
+def after_logged(callback):
+    # With --data-dir, acks and relayed changes wait for the log flush, so no
+    # client ever builds on an edit that a crashed server has forgotten
+    if store:
+        store.when_durable(callback)
+    else:
+        callback()
+
+def deliver(session_id, peer, ack, data, kind, key):
+    peer.unlogged -= 1
+    peer.send_message(ack)
+    if session_id in sessions:
+        broadcast(session_id, peer.websocket, data, kind, key)
+
+def relay_cursor(session_id, peer, data):
+    if session_id in sessions:
+        broadcast(session_id, peer.websocket, data, 'cursor', data['user_id'])
+
+def resume_file(peer, file_path, doc, version, user_id):
+    # A reconnecting client that was at version gets only the edits it
+    # missed, then its highest applied seq so it can tell whether the batch
+    # it had in flight when the connection dropped needs sending again.
+    # Its own edits among the missed ones carry its user id and act as acks.
+    # Past the history, e.g. after a compaction or a restart, it gets a
+    # snapshot instead and rebases its unacknowledged edits onto it.
+    try:
+        missed = doc.history_since(version)
+    except StaleVersionError:
+        send_snapshot(peer, file_path, doc, user_id)
+        return
+    for missed_version, ops, author in missed:
+        edit = {'type': 'edit', 'file_path': file_path, 'ops': ops, 'version': missed_version}
+        if author is not None:
+            edit['user_id'] = author[0]
+        peer.send_message(edit, 'edit', file_path)
+    peer.send_message({'type': 'resumed', 'file_path': file_path, 'version': doc.version, 'seq': doc.seqs.get(user_id, 0)})
+
+def client_user_id(data):
+    # A client keeps its id across reconnects so the server can recognise
+    # its edits; anything that is not a UUID gets a fresh one
+    try:
+        return str(uuid.UUID(data.get('client_id')))
+    except (TypeError, ValueError, AttributeError):
+        return str(uuid.uuid4())
+
+async def load_session(session_id):
+    # A session emptied moments ago may still have its snapshot queued; the
+    # read waits behind it. If any session closed while the read ran, it may
+    # have been this one, reopened meanwhile, so it is read again.
+    while session_id not in sessions and session_id not in documents:
+        closed = sessions_closed
+        docs = await store.read(session_id)
+        if sessions_closed == closed and session_id not in sessions and session_id not in documents:
+            documents[session_id] = docs
+
+def shard_for(session_id, workers):
+    # Stable across processes, unlike hash()
+    return zlib.crc32(session_id.encode('utf-8')) % workers
+
+def worker_socket(port, index):
+    return os.path.join(tempfile.gettempdir(), f'devhub-collab-{port}-{index}.sock')
+
+async def incoming(websocket, first_message):
+    if first_message is not None:
+        yield first_message
+    async for message in websocket:
+        yield message
+
+async def relay(source, target):
+    try:
+        async for message in source:
+            await target.send(message)
+    except websockets.ConnectionClosed:
+        pass
+
+async def route(websocket, port):
+    # Public entry point with --workers: every session lives on the worker its
+    # id hashes to, and whichever worker accepted the connection relays frames
+    # to the owner over that worker's Unix socket
+    try:
+        first_message = await websocket.recv()
+        session_id = json.loads(first_message).get('session_id')
+    except (websockets.ConnectionClosed, ValueError, AttributeError):
+        return
+    owner = shard_for(session_id, WORKERS) if isinstance(session_id, str) else WORKER_INDEX
+    if owner == WORKER_INDEX:
+        await handler(websocket, first_message)
+        return
+    async with websockets.unix_connect(worker_socket(port, owner)) as upstream:
+        await upstream.send(first_message)
+        relays = [asyncio.create_task(relay(websocket, upstream)), asyncio.create_task(relay(upstream, websocket))]
+        await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+        for task in relays:
+            task.cancel()
+
+async def handler(websocket, first_message=None):
     session_id = None
-    user_id = str(uuid.uuid4())
+    user_id = None
+    peer = peers[websocket] = Peer(websocket)
     try:
-        async for message in websocket:
-            data = json.loads(message)
+        async for message in incoming(websocket, first_message):
+            data = decode(message, peer.files.paths)
+            if metrics:
+                metrics.received(str(data.get('type')), len(message))
             if data['type'] == 'join':
+                if websocket in user_sessions:
+                    leave_session(websocket)  # a connection is in one session at a time
                 session_id = data['session_id']
+                user_id = client_user_id(data)
+                if store and session_id not in sessions:
+                    await load_session(session_id)
                 if session_id not in sessions:
-                    sessions[session_id] = set()
-                sessions[session_id].add((websocket, user_id))
-                user_sessions[websocket] = (session_id, user_id)
-                await broadcast_presence(session_id)
-            elif data['type'] in ('edit', 'open_file') and session_id:
-                # Broadcast to all other clients in the session
-                for ws, _ in sessions[session_id]:
-                    if ws != websocket:
-                        await ws.send(json.dumps({**data, 'user_id': user_id}))
-    except Exception:
+                    sessions[session_id] = {}
+                    file_tables[session_id] = FileTable()
+                    for file_path in documents.get(session_id, {}):
+                        file_tables[session_id].intern(file_path)
+                add_member(session_id, websocket, user_id)
+                peer.accepts = set(data.get('snapshot', ()))
+                peer.files = file_tables[session_id]
+                if 'binary' in data.get('wire', ()):
+                    # The welcome still goes out as JSON; binary frames follow it
+                    peer.send_message({'type': 'welcome', 'wire': 'binary'})
+                    peer.wire = 'binary'
+                    for file_path, file_id in peer.files.ids.items():
+                        peer.send_message({'type': 'file_id', 'file_id': file_id, 'file_path': file_path})
+                else:
+                    peer.send_message({'type': 'welcome', 'wire': 'json'})
+                # Bring the newcomer up to date; edits arriving meanwhile queue
+                # behind. A reconnecting client lists the version it has of
+                # each file it had open.
+                resume = {}
+                for entry in data.get('resume', ()):
+                    try:
+                        file_path, version = entry
+                    except (TypeError, ValueError):
+                        continue
+                    resume[file_path] = version
+                for file_path, doc in documents.get(session_id, {}).items():
+                    version = resume.pop(file_path, None)
+                    if isinstance(version, int):
+                        resume_file(peer, file_path, doc, version, user_id)
+                    else:
+                        send_snapshot(peer, file_path, doc, user_id)
+                for file_path in resume:
+                    # Lost with a restart of a server without --data-dir
+                    peer.send_message({'type': 'unknown_file', 'file_path': file_path})
+                peer.send_message({'type': 'presence', 'users': list(user_counts[session_id])}, 'presence')
+            elif data['type'] == 'open_file' and session_id:
+                file_path = data['file_path']
+                docs = documents.setdefault(session_id, {})
+                doc = docs.get(file_path)
+                if doc is None:
+                    doc = docs[file_path] = Document(data.get('content', '').encode('utf-8'))
+                    if store:
+                        store.record_open(session_id, docs, file_path, doc)
+                    announce_file(session_id, file_path)
+                    ack = {'type': 'ack', 'file_path': file_path, 'version': doc.version}
+                    peer.unlogged += 1
+                    after_logged(partial(deliver, session_id, peer, ack, {**data, 'version': doc.version, 'user_id': user_id}, 'snapshot', file_path))
+                else:
+                    # Already shared in this session: the server copy wins
+                    send_snapshot(peer, file_path, doc, user_id)
+            elif data['type'] == 'edit' and session_id:
+                file_path = data.get('file_path')
+                doc = documents.get(session_id, {}).get(file_path)
+                if doc is None:
+                    peer.send_message({'type': 'unknown_file', 'file_path': file_path})
+                    continue
+                seq = data.get('seq')
+                author = (user_id, seq) if isinstance(seq, int) else None
+                if author and seq <= doc.seqs.get(user_id, 0):
+                    continue  # resent after a reconnect but applied before it
+                try:
+                    if 'ops' in data:
+                        ops = doc.apply(data['ops'], data.get('version'), author)
+                    else:
+                        ops = doc.replace(data['content'].encode('utf-8'))
+                except (StaleVersionError, ValueError, KeyError):
+                    # Client is out of step with the server copy; resync it
+                    send_snapshot(peer, file_path, doc, user_id)
+                    continue
+                if store:
+                    store.record_ops(session_id, documents[session_id], file_path, doc.version, ops, author)
+                ack = {'type': 'ack', 'file_path': file_path, 'version': doc.version}
+                edit = {'type': 'edit', 'file_path': file_path, 'ops': ops, 'version': doc.version, 'user_id': user_id}
+                peer.unlogged += 1
+                after_logged(partial(deliver, session_id, peer, ack, edit, 'edit', file_path))
+            elif data['type'] == 'cursor' and session_id:
+                # Byte offsets into the sender's copy of a shared file; any
+                # other file (or none) hides the sender's cursor
+                file_path = data.get('file_path')
+                doc = documents.get(session_id, {}).get(file_path)
+                pos = data.get('pos')
+                anchor = data.get('anchor')
+                if doc is not None and isinstance(pos, int) and isinstance(anchor, int) and 0 <= pos <= len(doc.buf) and 0 <= anchor <= len(doc.buf):
+                    cursor = {'type': 'cursor', 'file_path': file_path, 'pos': pos, 'anchor': anchor, 'user_id': user_id}
+                else:
+                    cursor = {'type': 'cursor', 'file_path': None, 'user_id': user_id}
+                if peer.unlogged:
+                    # Kept behind the sender's edits, whose positions it already reflects
+                    after_logged(partial(relay_cursor, session_id, peer, cursor))
+                else:
+                    relay_cursor(session_id, peer, cursor)
+            elif data['type'] == 'sync' and session_id:
+                doc = documents.get(session_id, {}).get(data.get('file_path'))
+                if doc is not None:
+                    send_snapshot(peer, data['file_path'], doc, user_id)
+    except websockets.ConnectionClosed:
         pass
+    except Exception as e:
+        # A malformed message or a bug; the connection is dropped either way
+        if metrics:
+            metrics.errors.inc(type(e).__name__)
+        print(f'Closing connection of {user_id} in session {session_id} after an error:', file=sys.stderr, flush=True)
+        traceback.print_exc()
+    finally:
+        if websocket in user_sessions:
+            leave_session(websocket)
+        peer.close()
+        del peers[websocket]
+
+async def serve(args, index=0):
+    global MAX_QUEUE_MESSAGES, MAX_QUEUE_BYTES, store, WORKER_INDEX, WORKERS
+    MAX_QUEUE_MESSAGES = args.max_queue_messages
+    MAX_QUEUE_BYTES = args.max_queue_bytes
+    WORKER_INDEX = index
+    WORKERS = args.workers
+    if args.stats_interval:
+        stats_task = asyncio.create_task(report_stats(args.stats_interval))
+    resync_task = asyncio.create_task(resync_presence(PRESENCE_RESYNC_SECONDS))
+    if args.metrics_port:
+        lag_task, metrics_server = await start_metrics(args, index)
+    if args.data_dir:
+        store = SessionStore(args.data_dir, args.snapshot_every)
+        start = time.perf_counter()
+        documents.update(store.load_all(lambda session_id: shard_for(session_id, WORKERS) == index))
+        print(f'Recovered {len(documents)} sessions from {args.data_dir} in {time.perf_counter() - start:.3f}s')
+        store_task = asyncio.create_task(store.run())
+    try:
+        if WORKERS > 1:
+            path = worker_socket(args.port, index)
+            if os.path.exists(path):
+                os.remove(path)
+            async with websockets.serve(lambda ws: route(ws, args.port), args.host, args.port, reuse_port=True), websockets.unix_serve(handler, path):
+                print(f'Collaboration worker {index}/{WORKERS} running on ws://{args.host}:{args.port}')
+                await asyncio.Future()  # run forever
+        else:
+            async with websockets.serve(handler, args.host, args.port):
+                print(f'Collaboration server running on ws://{args.host}:{args.port}')
+                await asyncio.Future()  # run forever
     finally:
-        if session_id:
-            sessions[session_id] = {(ws, uid) for ws, uid in sessions[session_id] if ws != websocket}
-            if not sessions[session_id]:
-                del sessions[session_id]
-            if websocket in user_sessions:
-                del user_sessions[websocket]
-            await broadcast_presence(session_id)
-
-async def main():
-    async with websockets.serve(handler, 'localhost', 8765):
-        print('Collaboration server running on ws://localhost:8765')
-        await asyncio.Future()  # run forever
+        if store:
+            store.flush()
+
+def run_worker(args, index):
+    try:
+        asyncio.run(serve(args, index))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='DevHub collaboration server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-queue-messages', type=int, default=MAX_QUEUE_MESSAGES)
+    parser.add_argument('--max-queue-bytes', type=int, default=MAX_QUEUE_BYTES)
+    parser.add_argument('--stats-interval', type=float, default=0, help='seconds between queue stats lines; 0 disables')
+    parser.add_argument('--data-dir', help='persist sessions here (op log + snapshots); in-memory only if unset')
+    parser.add_argument('--snapshot-every', type=int, default=SNAPSHOT_EVERY, help='logged ops between snapshots')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes; sessions are sharded across them by id')
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve Prometheus metrics on this port (worker N uses port + N); off if 0')
+    parser.add_argument('--metrics-host', default='localhost')
+    args = parser.parse_args()
+    if args.workers <= 1:
+        asyncio.run(serve(args))
+        return
+    workers = [multiprocessing.Process(target=run_worker, args=(args, index)) for index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    main()
+
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+from collab_doc import Document, ops_from_wire, ops_to_wire
+
+SNAPSHOT_EVERY = 10000  # logged entries per session between compactions
+FLUSH_INTERVAL = 0.05  # seconds of log writes grouped into one fsync
+
+
+class SessionStore:
+    # Optional on-disk state for collab_server. Each session has an
+    # append-only log of [file_path, version, ops-or-content] JSON lines and a
+    # compacted snapshot; recovery loads the snapshot and replays the log tail.
+    # All file I/O runs on one worker thread, so writes land in order.
+    def __init__(self, directory, snapshot_every=SNAPSHOT_EVERY, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self.pending = {}  # session_id: [log lines not yet written]
+        self.since_snapshot = {}  # session_id: entries logged since last snapshot
+        self.logs = {}  # session_id: open log file (worker thread only)
+        self.unwritten = {}  # session_id: snapshot state that failed to write (worker thread only)
+        self.snapshotted = set()  # sessions snapshotted while a log write was in flight
+        self.waiting = []  # callbacks for entries not yet on disk
+        self.failing = False  # log writes are failing; reported once, and again on recovery
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(directory, exist_ok=True)
+
+    def paths(self, session_id):
+        base = os.path.join(self.directory, quote(session_id, safe=''))
+        return base + '.snap', base + '.log'
+
+    def session_ids(self):
+        names = set()
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext in ('.snap', '.log'):
+                names.add(unquote(stem))
+        return sorted(names)
+
+    def load(self, session_id):
+        docs = {}
+        snap_path, log_path = self.paths(session_id)
+        # A snapshot still waiting to be written is newer than the disk copy,
+        # and nothing has been logged behind it
+        state = self.unwritten.get(session_id)
+        if state is None and os.path.exists(snap_path):
+            with open(snap_path, encoding='utf-8') as f:
+                state = json.load(f)
+        for file_path, (version, content, *seqs) in (state or {}).items():
+            doc = docs[file_path] = Document(content.encode('utf-8'), version)
+            if seqs:
+                doc.seqs = seqs[0]
+        if session_id not in self.unwritten and os.path.exists(log_path):
+            with open(log_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        file_path, version, payload, *author = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the tail from a crash
+                    doc = docs.get(file_path)
+                    if isinstance(payload, str):
+                        docs[file_path] = Document(payload.encode('utf-8'), version)
+                    elif doc is not None and version > doc.version:
+                        doc.apply(ops_from_wire(payload), author=tuple(author) if author else None)
+                        doc.version = version
+        return docs
+
+    async def read(self, session_id):
+        # load() on the I/O thread, behind any snapshot a close has queued,
+        # and off the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.load, session_id)
+
+    def load_all(self, include=None):
+        return {session_id: self.load(session_id) for session_id in self.session_ids() if include is None or include(session_id)}
+
+    def record_open(self, session_id, docs, file_path, doc):
+        self.append(session_id, docs, [file_path, doc.version, doc.text()])
+
+    def record_ops(self, session_id, docs, file_path, version, ops, author=None):
+        # author: (client_id, seq), kept so a client resuming after a restart
+        # can recognise its own edits
+        self.append(session_id, docs, [file_path, version, ops_to_wire(ops), *(author or ())])
+
+    def append(self, session_id, docs, entry):
+        self.pending.setdefault(session_id, []).append(json.dumps(entry) + '\n')
+        count = self.since_snapshot[session_id] = self.since_snapshot.get(session_id, 0) + 1
+        if self.snapshot_every and count >= self.snapshot_every:
+            self.snapshot(session_id, docs)
+
+    def snapshot(self, session_id, docs):
+        # Everything still pending is already reflected in docs, so it is
+        # dropped; the snapshot job then truncates the log behind it
+        self.pending.pop(session_id, None)
+        self.snapshotted.add(session_id)
+        self.since_snapshot[session_id] = 0
+        # seqs go along so a batch resent after a restart is still recognised
+        state = {file_path: [doc.version, doc.text(), doc.seqs] for file_path, doc in docs.items()}
+        return self.executor.submit(self.write_snapshot, session_id, state)
+
+    def write_snapshot(self, session_id, state):
+        # A snapshot that fails to write is kept and written before anything
+        # else is logged: lines logged ahead of it would be lost with the
+        # log it truncates
+        self.unwritten[session_id] = state
+        try:
+            self.write_unwritten()
+        except OSError as e:
+            print(f'Could not write snapshot of session {session_id}, retrying with the next log write: {e}', file=sys.stderr, flush=True)
+
+    def write_unwritten(self):
+        for session_id in list(self.unwritten):
+            snap_path, log_path = self.paths(session_id)
+            tmp_path = snap_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.unwritten[session_id], f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, snap_path)
+            log = self.logs.pop(session_id, None)
+            if log is not None:
+                log.close()
+            open(log_path, 'w').close()
+            del self.unwritten[session_id]
+
+    def write_batch(self, batch):
+        # Sessions are removed from batch once on disk; after an error the
+        # rest are left in it to be written again
+        self.write_unwritten()
+        for session_id in list(batch):
+            log_path = self.paths(session_id)[1]
+            log = self.logs.get(session_id)
+            if log is None:
+                log = self.logs[session_id] = open(log_path, 'a', encoding='utf-8')
+            size = os.fstat(log.fileno()).st_size
+            try:
+                log.write(''.join(batch[session_id]))
+                log.flush()
+                os.fsync(log.fileno())
+            except OSError:
+                # Cut off whatever part made it, so the retry does not land
+                # behind a torn line that would end recovery there
+                del self.logs[session_id]
+                try:
+                    log.close()
+                except OSError:
+                    pass
+                os.truncate(log_path, size)
+                raise
+            del batch[session_id]
+
+    def close_session(self, session_id, docs):
+        # Compact on the way out so the next load is a snapshot read
+        self.snapshot(session_id, docs)
+        self.since_snapshot.pop(session_id, None)
+        self.executor.submit(self.close_log, session_id)
+
+    def close_log(self, session_id):
+        log = self.logs.pop(session_id, None)
+        if log is not None:
+            log.close()
+
+    def when_durable(self, callback):
+        # Runs callback on the event loop once everything appended so far is
+        # on disk, in the log or in a snapshot
+        self.waiting.append(callback)
+
+    def flush(self):
+        batch, self.pending = self.pending, {}
+        self.executor.submit(self.write_batch, batch).result()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.pending or self.waiting:
+                # Written after any snapshot job already queued, so the
+                # callbacks also cover entries a snapshot absorbed
+                batch, self.pending = self.pending, {}
+                callbacks, self.waiting = self.waiting, []
+                self.snapshotted = set()
+                try:
+                    await loop.run_in_executor(self.executor, self.write_batch, batch)
+                except OSError as e:
+                    # Disk full or failing: keep what was not written, ahead
+                    # of anything appended since, and hold its acks until a
+                    # later attempt succeeds. Lines a snapshot taken meanwhile
+                    # covers are dropped, as in snapshot().
+                    if not self.failing:
+                        self.failing = True
+                        print(f'Could not write session log, retrying every {self.flush_interval}s: {e}', file=sys.stderr, flush=True)
+                    for session_id in self.snapshotted:
+                        batch.pop(session_id, None)
+                    for session_id, lines in self.pending.items():
+                        batch.setdefault(session_id, []).extend(lines)
+                    self.pending = batch
+                    self.waiting = callbacks + self.waiting
+                    continue
+                if self.failing:
+                    self.failing = False
+                    print('Session log writes recovered', file=sys.stderr, flush=True)
+                for callback in callbacks:
+                    callback()
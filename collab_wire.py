@@ -0,0 +1,163 @@
+import base64
+import json
+import struct
+import uuid
+import zlib
+from collab_doc import INSERT, DELETE, ops_from_wire, ops_to_wire
+
+# Message dicts carry ops as collab_doc tuples and snapshot chunk data as raw
+# bytes; encode() turns them into a JSON text frame or, once a peer has
+# negotiated 'binary' at join, a compact binary frame. Binary frames start
+# with a (type, flags) byte pair; paths are replaced by per-session file ids.
+JSON, EDIT, ACK, FILE_ID, SNAPSHOT_CHUNK, CURSOR = range(6)
+FLAG_ZLIB = 1  # body after the type/flags bytes is zlib-compressed
+FLAG_USER = 2  # an edit or cursor carries the sender's 16-byte user id
+FLAG_SEQ = 4  # an edit carries the client's batch number, after any user id; a snapshot chunk the receiver's, after its header
+
+COMPRESS_MIN = 1024  # binary bodies at least this large are compressed
+
+HEADER = struct.Struct('!BB')
+FILE_VERSION = struct.Struct('!HI')
+OP = struct.Struct('!BII')
+CHUNK = struct.Struct('!HIII')
+SEQ = struct.Struct('!I')
+CURSOR_POS = struct.Struct('!HII')  # file id, caret, anchor
+
+
+class FileTable:
+    def __init__(self):
+        self.ids = {}  # file_path: file_id
+        self.paths = {}  # file_id: file_path
+
+    def intern(self, file_path):
+        file_id = self.ids.get(file_path)
+        if file_id is not None:
+            return file_id, False
+        file_id = len(self.ids)
+        self.define(file_id, file_path)
+        return file_id, True
+
+    def define(self, file_id, file_path):
+        self.ids[file_path] = file_id
+        self.paths[file_id] = file_path
+
+
+def encode(data, wire, file_ids):
+    if wire == 'binary':
+        return encode_binary(data, file_ids)
+    return encode_json(data)
+
+
+def encode_json(data):
+    if 'ops' in data:
+        data = {**data, 'ops': ops_to_wire(data['ops'])}
+    if isinstance(data.get('data'), bytes):
+        data = {**data, 'data': base64.b64encode(data['data']).decode('ascii')}
+    return json.dumps(data)
+
+
+def encode_binary(data, file_ids):
+    kind = data['type']
+    file_id = file_ids.get(data.get('file_path'))
+    flags = 0
+    if kind == 'edit' and file_id is not None and 'ops' in data:
+        kind = EDIT
+        parts = [FILE_VERSION.pack(file_id, data['version'])]
+        if data.get('user_id'):
+            flags |= FLAG_USER
+            parts.append(uuid.UUID(data['user_id']).bytes)
+        if data.get('seq') is not None:
+            flags |= FLAG_SEQ
+            parts.append(SEQ.pack(data['seq']))
+        for op_kind, pos, arg in data['ops']:
+            if op_kind == INSERT:
+                parts.append(OP.pack(0, pos, len(arg)))
+                parts.append(arg)
+            else:
+                parts.append(OP.pack(1, pos, arg))
+        body = b''.join(parts)
+    elif kind == 'ack' and file_id is not None:
+        kind = ACK
+        body = FILE_VERSION.pack(file_id, data['version'])
+    elif kind == 'cursor' and file_id is not None:
+        kind = CURSOR
+        body = CURSOR_POS.pack(file_id, data['pos'], data['anchor'])
+        if data.get('user_id'):
+            flags |= FLAG_USER
+            body += uuid.UUID(data['user_id']).bytes
+    elif kind == 'file_id':
+        kind = FILE_ID
+        body = struct.pack('!H', data['file_id']) + data['file_path'].encode('utf-8')
+    elif kind == 'snapshot_chunk' and file_id is not None:
+        kind = SNAPSHOT_CHUNK
+        body = CHUNK.pack(file_id, data['version'], data['index'], data['count'])
+        if data.get('seq') is not None:
+            flags |= FLAG_SEQ
+            body += SEQ.pack(data['seq'])
+        body += data['data']
+    else:
+        kind = JSON
+        body = encode_json(data).encode('utf-8')
+    # Snapshot chunks are already zlib data
+    if len(body) >= COMPRESS_MIN and kind != SNAPSHOT_CHUNK:
+        flags |= FLAG_ZLIB
+        body = zlib.compress(body, 1)
+    return HEADER.pack(kind, flags) + body
+
+
+def decode(frame, file_paths):
+    if isinstance(frame, str):
+        return decode_json(frame)
+    kind, flags = HEADER.unpack_from(frame)
+    body = memoryview(frame)[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = memoryview(zlib.decompress(body))
+    if kind == JSON:
+        return decode_json(bytes(body).decode('utf-8'))
+    if kind == FILE_ID:
+        return {'type': 'file_id', 'file_id': struct.unpack_from('!H', body)[0], 'file_path': bytes(body[2:]).decode('utf-8')}
+    if kind == SNAPSHOT_CHUNK:
+        file_id, version, index, count = CHUNK.unpack_from(body)
+        data = {'type': 'snapshot_chunk', 'file_path': file_paths[file_id], 'version': version, 'index': index, 'count': count, 'encoding': 'zlib'}
+        offset = CHUNK.size
+        if flags & FLAG_SEQ:
+            data['seq'] = SEQ.unpack_from(body, offset)[0]
+            offset += SEQ.size
+        data['data'] = bytes(body[offset:])
+        return data
+    if kind == CURSOR:
+        file_id, pos, anchor = CURSOR_POS.unpack_from(body)
+        data = {'type': 'cursor', 'file_path': file_paths[file_id], 'pos': pos, 'anchor': anchor}
+        if flags & FLAG_USER:
+            data['user_id'] = str(uuid.UUID(bytes=bytes(body[CURSOR_POS.size:CURSOR_POS.size + 16])))
+        return data
+    file_id, version = FILE_VERSION.unpack_from(body)
+    data = {'type': 'ack' if kind == ACK else 'edit', 'file_path': file_paths[file_id], 'version': version}
+    if kind == EDIT:
+        offset = FILE_VERSION.size
+        if flags & FLAG_USER:
+            data['user_id'] = str(uuid.UUID(bytes=bytes(body[offset:offset + 16])))
+            offset += 16
+        if flags & FLAG_SEQ:
+            data['seq'] = SEQ.unpack_from(body, offset)[0]
+            offset += SEQ.size
+        ops = []
+        while offset < len(body):
+            op_kind, pos, arg = OP.unpack_from(body, offset)
+            offset += OP.size
+            if op_kind == 0:
+                ops.append((INSERT, pos, bytes(body[offset:offset + arg])))
+                offset += arg
+            else:
+                ops.append((DELETE, pos, arg))
+        data['ops'] = ops
+    return data
+
+
+def decode_json(frame):
+    data = json.loads(frame)
+    if data.get('type') == 'edit' and 'ops' in data:
+        data['ops'] = ops_from_wire(data['ops'])
+    elif data.get('type') == 'snapshot_chunk':
+        data['data'] = base64.b64decode(data['data'])
+    return data
@@ -0,0 +1,318 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ATTRIBUTE_RE = re.compile(r'\b[A-Za-z_]\w*\.(?=[A-Za-z_])')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def completion_points(text, count):
+    # Attribute accesses spread through the file, completed right after the dot
+    matches = list(ATTRIBUTE_RE.finditer(text))
+    step = max(1, len(matches) // count)
+    points = []
+    for match in matches[::step][:count]:
+        line = text.count('\n', 0, match.end())
+        column = match.end() - (text.rfind('\n', 0, match.end()) + 1)
+        points.append((line, column))
+    return points
+
+
+def completion_run(mode, project_dir, file_path, count):
+    # Runs in a fresh process so the first request really is cold
+    with open(file_path, encoding='utf-8') as f:
+        text = f.read()
+    points = completion_points(text, count)
+    result = {'mode': mode}
+    start = time.perf_counter()
+    if mode == 'per_request':
+        # What the editor did before: no project and no path, new Script each time
+        import jedi
+
+        def complete(line, column):
+            return jedi.Script(text, path='').complete(line + 1, column)
+    else:
+        from analysis import open_project
+        service = open_project(project_dir)
+        service.warmed.wait()
+        result['warm_up_s'] = round(time.perf_counter() - start, 2)
+
+        def complete(line, column):
+            return service.complete(text, file_path, line, column)
+    timings = []
+    for line, column in points:
+        start = time.perf_counter()
+        complete(line, column)
+        timings.append(time.perf_counter() - start)
+    result['first_ms'] = round(timings[0] * 1e3, 1)
+    result['steady_p50_ms'] = round(percentile(timings[1:], 50) * 1e3, 1)
+    result['steady_p90_ms'] = round(percentile(timings[1:], 90) * 1e3, 1)
+    return result
+
+
+def bench_completion(args):
+    file_path = os.path.abspath(args.file)
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for mode in ('per_request', 'project_service'):
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(completion_run, (mode, os.path.abspath(args.project), file_path, args.requests)))
+    return {'benchmark': 'completion', 'project': args.project, 'file': args.file, 'requests': args.requests, 'results': results}
+
+
+def bench_save(args):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.Qsci import QsciScintilla
+    from saving import SaveService, write_atomic
+    app = QApplication.instance() or QApplication([])
+    editor = QsciScintilla()
+    editor.setUtf8(True)
+    line = 'result = compute(value, other)  # some code\n'
+    editor.setText(line * (args.size_kb * 1024 // len(line)))
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.py')
+    service = SaveService()
+    written = []
+    service.finished.connect(lambda request, error: written.append(error))
+
+    def snapshot():
+        length = editor.SendScintilla(QsciScintilla.SCI_GETLENGTH)
+        return bytes(editor.bytes(0, length))[:length]
+
+    modes = {
+        # What save_file did before: plain open('w') with the text, no fsync
+        'sync_write': lambda: open(path, 'w', encoding='utf-8').write(editor.text()),
+        # Crash-safe, but still on the UI thread
+        'sync_atomic': lambda: write_atomic(path, snapshot()),
+        'save_service': lambda: service.save({'path': path, 'data': snapshot()}),
+    }
+    results = []
+    try:
+        for mode, save in modes.items():
+            del written[:]
+            stalls = []
+            start = time.perf_counter()
+            for _ in range(args.saves):
+                editor.append('#')  # every save has something new
+                t = time.perf_counter()
+                save()
+                stalls.append(time.perf_counter() - t)
+            service.wait()
+            total = time.perf_counter() - start
+            app.processEvents()
+            results.append({
+                'mode': mode,
+                'ui_stall_p50_ms': round(percentile(stalls, 50) * 1e3, 2),
+                'ui_stall_max_ms': round(max(stalls) * 1e3, 2),
+                'total_s': round(total, 3),
+                'writes': len(written) if mode == 'save_service' else args.saves,
+            })
+    finally:
+        shutil.rmtree(directory)
+    return {'benchmark': 'save', 'size_kb': args.size_kb, 'saves': args.saves, 'results': results}
+
+
+def make_project(directory, count, seed=0):
+    # count Python-looking files, 100 to a directory, built from a shared
+    # vocabulary so common words hit many files and rare ones a few
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10))) for _ in range(20000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    for i in range(count):
+        sub = os.path.join(directory, f'pkg{i // 100}')
+        os.makedirs(sub, exist_ok=True)
+        lines = []
+        for _ in range(rng.randint(40, 120)):
+            a, b, c = rng.choices(words, cum_weights=cum_weights, k=3)
+            lines.append(f'    {a} = {b}({c}, {rng.randint(0, 999)})')
+        with open(os.path.join(sub, f'module{i}.py'), 'w') as f:
+            f.write(f'def function_{i}():\n' + '\n'.join(lines) + '\n')
+    return words
+
+
+def bench_search(args):
+    from PyQt5.QtCore import QCoreApplication, Qt
+    from search_index import MAX_RESULTS, SearchIndex
+    app = QCoreApplication.instance() or QCoreApplication([])
+    directory = tempfile.mkdtemp()
+    try:
+        words = make_project(directory, args.files)
+        start = time.perf_counter()
+        index = SearchIndex(directory)
+        index.ready.wait()
+        build = time.perf_counter() - start
+        stats = {}
+        index.finished.connect(lambda request, result: stats.update(result), Qt.DirectConnection)
+        queries = {
+            'rare_word': words[-1],
+            'common_word': words[0],
+            'exact_name': f'function_{args.files // 2}(',
+            'absent': 'no such text here',
+            'two_chars': 'zq',
+        }
+        results = []
+        for name, text in queries.items():
+            timings = []
+            for _ in range(args.repeat):
+                request = index.latest = {'text': text}
+                t = time.perf_counter()
+                index.run_search(request)
+                timings.append(time.perf_counter() - t)
+            # The same search without the index: every file is read
+            t = time.perf_counter()
+            found, needle = [], text.encode('utf-8').lower()
+            for path in index.files:
+                if len(found) >= MAX_RESULTS:
+                    break
+                index.match_lines(path, needle, found, MAX_RESULTS - len(found))
+            scan = time.perf_counter() - t
+            results.append({'query': name, 'candidates': stats['candidates'], 'matches': stats['matches'], 'p50_ms': round(percentile(timings, 50) * 1e3, 1), 'max_ms': round(max(timings) * 1e3, 1), 'full_scan_ms': round(scan * 1e3, 1)})
+        app.processEvents()
+    finally:
+        shutil.rmtree(directory)
+    return {'benchmark': 'search', 'files': args.files, 'indexed': len(index.files), 'trigrams': len(index.postings), 'build_s': round(build, 2), 'results': results}
+
+
+def bench_symbols(args):
+    import symbol_index
+    from symbol_index import SymbolIndex
+    project_dir = os.path.abspath(args.project)
+    symbol_index.CACHE_DIR = tempfile.mkdtemp()  # start cold, and leave the real cache alone
+    result = {'benchmark': 'symbols', 'project': project_dir}
+    try:
+        for run in ('cold', 'cached'):
+            start = time.perf_counter()
+            index = SymbolIndex(project_dir)
+            index.ready.wait()
+            result[f'{run}_build_s'] = round(time.perf_counter() - start, 2)
+        result['files'] = len(index.files)
+        result['names'] = len(index.locations)
+        names = sorted(index.locations, key=len)
+        timings = {'definitions': [], 'fuzzy': []}
+        rng = random.Random(0)
+        for name in rng.sample(names, min(args.queries, len(names))):
+            t = time.perf_counter()
+            index.definitions(name)
+            timings['definitions'].append(time.perf_counter() - t)
+            # A few characters of the name, in order, like someone typing
+            query = ''.join(c for i, c in enumerate(name) if i % 2 == 0)[:4]
+            t = time.perf_counter()
+            index.fuzzy(query)
+            timings['fuzzy'].append(time.perf_counter() - t)
+        for kind, values in timings.items():
+            result[f'{kind}_p50_ms'] = round(percentile(values, 50) * 1e3, 3)
+            result[f'{kind}_max_ms'] = round(max(values) * 1e3, 3)
+    finally:
+        shutil.rmtree(symbol_index.CACHE_DIR)
+    return result
+
+
+FIRST_PAINT_CHILD = '''
+import os, sys
+from PyQt5.QtCore import QObject, QEvent
+from PyQt5.QtWidgets import QApplication
+import code_editor
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            print('painted', flush=True)
+            os._exit(0)
+        return False
+
+app = QApplication(sys.argv)
+window = code_editor.MainWindow()
+first_paint = FirstPaint()
+window.installEventFilter(first_paint)
+window.show()
+app.exec_()
+'''
+
+
+def import_times(module):
+    # {module: cumulative microseconds} from python -X importtime
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench_startup(args):
+    env = {**os.environ, 'QT_QPA_PLATFORM': os.environ.get('QT_QPA_PLATFORM', 'offscreen')}
+    root = os.path.dirname(os.path.abspath(__file__))
+    imports, paints = [], []
+    for _ in range(args.runs):
+        imports.append(import_times('code_editor'))
+        # Process start to the first paint of the main window
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', FIRST_PAINT_CHILD], capture_output=True, check=True, env=env, cwd=root)
+        paints.append(time.perf_counter() - start)
+    import_ms = [times['code_editor'] / 1e3 for times in imports]
+    slowest = sorted(imports[-1].items(), key=lambda item: -item[1])[1:args.top + 1]
+    result = {
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'import_p50_ms': round(percentile(import_ms, 50), 1),
+        'first_paint_p50_ms': round(percentile(paints, 50) * 1e3, 1),
+        'first_paint_max_ms': round(max(paints) * 1e3, 1),
+        'slowest_imports_ms': {name: round(us / 1e3, 1) for name, us in slowest},
+    }
+    if args.budget_ms and result['first_paint_p50_ms'] > args.budget_ms:
+        result['over_budget'] = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for editor-side features')
+    sub = parser.add_subparsers(dest='command', required=True)
+    completion = sub.add_parser('completion', help='Jedi completion latency, per-request Script vs. AnalysisService')
+    completion.add_argument('--project', required=True, help='project directory')
+    completion.add_argument('--file', required=True, help='file in the project to complete in')
+    completion.add_argument('--requests', type=int, default=30)
+    completion.set_defaults(func=bench_completion)
+    save = sub.add_parser('save', help='UI-thread stall per save, synchronous write vs. SaveService')
+    save.add_argument('--size-kb', type=int, default=4096)
+    save.add_argument('--saves', type=int, default=20)
+    save.set_defaults(func=bench_save)
+    search = sub.add_parser('search', help='find-in-files index build time and query latency on a generated project')
+    search.add_argument('--files', type=int, default=20000)
+    search.add_argument('--repeat', type=int, default=5)
+    search.set_defaults(func=bench_search)
+    symbols = sub.add_parser('symbols', help='symbol index build time (cold and from cache) and lookup latency')
+    symbols.add_argument('--project', default=os.path.dirname(os.__file__), help='project directory (default: the standard library)')
+    symbols.add_argument('--queries', type=int, default=200)
+    symbols.set_defaults(func=bench_symbols)
+    startup = sub.add_parser('startup', help='import time of code_editor and time to first paint of the main window')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    startup.add_argument('--budget-ms', type=float, help='exit with status 1 if the first-paint p50 is above this')
+    startup.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    result = args.func(args)
+    print(json.dumps(result, indent=2))
+    if result.get('over_budget'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
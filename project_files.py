@@ -0,0 +1,28 @@
+import os
+
+SKIP_DIRS = {'.git', '.hg', '.svn', '__pycache__', 'node_modules', 'venv', '.venv', 'env', 'build', 'dist'}
+
+
+def skip_dir(name):
+    return name in SKIP_DIRS or name.startswith('.')
+
+
+def containing_project(project_dirs, file_path):
+    # The innermost of project_dirs containing file_path, or None
+    best = None
+    if file_path:
+        file_path = os.path.abspath(file_path)
+        for project_dir in project_dirs:
+            if project_dir and (best is None or len(project_dir) > len(best)) and file_path.startswith(os.path.join(project_dir, '')):
+                best = project_dir
+    return best
+
+
+def project_files(project_dir, suffix=''):
+    # Paths of the files under project_dir worth looking at, skipping VCS,
+    # virtualenv, build and hidden directories
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = [d for d in dirs if not skip_dir(d)]
+        for name in files:
+            if name.endswith(suffix):
+                yield os.path.join(root, name)
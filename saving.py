@@ -0,0 +1,91 @@
+import os
+import stat
+import tempfile
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# New files get the usual permissions rather than mkstemp's 0600
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def write_atomic(path, data):
+    # Write beside the target, fsync, then rename over it, so a crash leaves
+    # either the old file or the new one, never a truncated mix. A symlink is
+    # followed so the link itself survives.
+    path = os.path.realpath(path)
+    directory, name = os.path.split(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Make the rename itself durable; not possible on every platform
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class SaveService(QObject):
+    # Writes files on one background thread. A save request carries a
+    # snapshot of the buffer taken on the UI thread; repeated saves of a path
+    # that has not been written yet collapse into the newest one, and only
+    # that one reports back.
+    finished = pyqtSignal(object, object)  # request, error (None on success)
+
+    def __init__(self):
+        super().__init__()
+        self.pending = {}  # path: newest request not yet started
+        self.failed = {}  # path: error of its latest write, if that write failed
+        self.idle = threading.Event()  # set whenever nothing is pending or being written
+        self.idle.set()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, request):
+        # request: {'path', 'data'} plus whatever the caller wants back in
+        # finished; data is the file content as bytes
+        with self.condition:
+            self.idle.clear()
+            self.pending[request['path']] = request
+            self.condition.notify()
+
+    def wait(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.idle.set()
+                    self.condition.wait()
+                request = self.pending.pop(next(iter(self.pending)))
+            try:
+                write_atomic(request['path'], request['data'])
+                error = None
+                self.failed.pop(request['path'], None)
+            except OSError as e:
+                error = e
+                self.failed[request['path']] = e
+            self.finished.emit(request, error)
@@ -0,0 +1,313 @@
+import os
+import threading
+import time
+from array import array
+from collections import deque
+from PyQt5.QtCore import QObject, QFileSystemWatcher, pyqtSignal
+from project_files import containing_project, skip_dir
+
+MAX_FILE_BYTES = 1024 * 1024  # larger files are left out of the index
+BUILD_CHUNK_FILES = 500  # files per process-pool task during the first build
+MAX_RESULTS = 1000  # matching lines reported per search
+RESULT_BATCH_SECONDS = 0.05  # how often a running search hands results to the UI
+
+indexes = {}  # project_dir: SearchIndex
+
+
+def file_trigrams(path):
+    # (mtime_ns, trigrams) for a text file, trigrams being every distinct
+    # lowercased 3-byte sequence concatenated into one bytes object; None for
+    # binary, oversized or unreadable files
+    try:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size > MAX_FILE_BYTES:
+                return None
+            data = f.read()
+    except OSError:
+        return None
+    if b'\0' in data[:8192]:
+        return None
+    data = data.lower()
+    return stat.st_mtime_ns, b''.join({data[i:i + 3] for i in range(len(data) - 2)})
+
+
+def index_chunk(paths):
+    # Runs in a pool process during the first build
+    results = []
+    for path in paths:
+        indexed = file_trigrams(path)
+        if indexed is not None:
+            results.append((path, *indexed))
+    return results
+
+
+class SearchIndex(QObject):
+    # Case-insensitive find-in-files for one project directory. Every indexed
+    # file gets an id, and each trigram maps to the ascending ids of the files
+    # containing it; a search intersects the postings of the query's
+    # trigrams and reads only the surviving candidates to find the matching
+    # lines. Re-indexing a file gives it a new id and orphans the old one,
+    # so postings are only ever appended to; they are compacted once orphans
+    # outnumber live files.
+    #
+    # The first build fans out over a process pool. After that a
+    # QFileSystemWatcher on the project's directories and explicit update()
+    # calls (after a save) keep it current. All index state belongs to one
+    # background thread, which serves the newest search before anything else.
+    results = pyqtSignal(object, object)  # request, [(path, 0-based line, text)]
+    finished = pyqtSignal(object, object)  # request, {'files', 'candidates', 'matches', 'seconds'}
+    directories_found = pyqtSignal(object)  # directories to watch
+
+    def __init__(self, project_dir):
+        super().__init__()
+        self.project_dir = project_dir
+        self.files = {}  # path: (file id, mtime_ns)
+        self.paths = []  # file id: path, None once orphaned
+        self.postings = {}  # trigram: array of file ids
+        self.orphans = 0
+        self.directories = set()  # indexed directories, all watched
+        self.building = 0  # first-build chunks not merged yet
+        self.ready = threading.Event()  # set once the first build is merged
+        self.pending = None  # newest search not yet started
+        self.latest = None  # newest search
+        self.jobs = deque()
+        self.condition = threading.Condition()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(lambda directory: self.submit(lambda: self.rescan(directory)))
+        self.directories_found.connect(self.watch)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.submit(self.build)
+
+    def search(self, request):
+        # request: {'text'} plus whatever the caller wants back
+        with self.condition:
+            self.pending = self.latest = request
+            self.condition.notify()
+
+    def update(self, path):
+        self.submit(lambda: self.update_file(path))
+
+    def submit(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def watch(self, directories):
+        self.watcher.addPaths(directories)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.jobs:
+                    self.condition.wait()
+                request, self.pending = self.pending, None
+                job = self.jobs.popleft() if request is None else None
+            try:
+                if job is not None:
+                    job()
+                else:
+                    self.run_search(request)
+            except Exception:
+                pass
+
+    def build(self):
+        paths = []
+        for root, dirs, files in os.walk(self.project_dir):
+            dirs[:] = [d for d in dirs if not skip_dir(d)]
+            self.directories.add(root)
+            paths.extend(os.path.join(root, name) for name in files)
+        self.directories_found.emit(list(self.directories))
+        chunks = [paths[i:i + BUILD_CHUNK_FILES] for i in range(0, len(paths), BUILD_CHUNK_FILES)]
+        self.building = len(chunks)
+        if len(chunks) > 1:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Each finished chunk is merged as a separate job, so searches
+            # (over what is indexed so far) get in between
+            pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+            for chunk in chunks:
+                future = pool.submit(index_chunk, chunk)
+                future.add_done_callback(lambda future, chunk=chunk: self.submit(lambda: self.merge(future, chunk)))
+            pool.shutdown(wait=False)
+        else:
+            self.merge_files(index_chunk(chunks[0]) if chunks else [])
+            self.building = 0
+            self.ready.set()
+
+    def merge(self, future, chunk):
+        try:
+            try:
+                indexed = future.result()
+            except Exception:
+                indexed = index_chunk(chunk)  # the pool could not run it
+            self.merge_files(indexed)
+        finally:
+            self.building -= 1
+            if not self.building:
+                self.ready.set()
+
+    def merge_files(self, indexed):
+        for path, mtime_ns, trigrams in indexed:
+            if path not in self.files:  # else already re-read after a change
+                self.add(path, mtime_ns, trigrams)
+
+    def add(self, path, mtime_ns, trigrams):
+        self.remove(path)
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.files[path] = (file_id, mtime_ns)
+        postings = self.postings
+        for i in range(0, len(trigrams), 3):
+            trigram = trigrams[i:i + 3]
+            ids = postings.get(trigram)
+            if ids is None:
+                postings[trigram] = array('I', (file_id,))
+            else:
+                ids.append(file_id)
+
+    def remove(self, path):
+        indexed = self.files.pop(path, None)
+        if indexed is None:
+            return
+        self.paths[indexed[0]] = None
+        self.orphans += 1
+        if self.orphans > max(1000, len(self.files)):
+            self.compact()
+
+    def compact(self):
+        paths = self.paths
+        for trigram, ids in list(self.postings.items()):
+            live = array('I', (file_id for file_id in ids if paths[file_id] is not None))
+            if live:
+                self.postings[trigram] = live
+            else:
+                del self.postings[trigram]
+        self.orphans = 0
+
+    def update_file(self, path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self.remove(path)
+            return
+        indexed = self.files.get(path)
+        if indexed is not None and indexed[1] == mtime_ns:
+            return
+        indexed = file_trigrams(path)
+        if indexed is None:
+            self.remove(path)
+        else:
+            self.add(path, *indexed)
+
+    def rescan(self, directory):
+        # Something directly inside directory was added, removed or renamed
+        if directory not in self.directories:
+            return
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            self.forget(directory)
+            return
+        present = set()
+        for entry in entries:
+            present.add(entry.path)
+            if not entry.is_dir(follow_symlinks=False):
+                self.update_file(entry.path)
+            elif not skip_dir(entry.name) and entry.path not in self.directories:
+                # A new directory: index and watch everything in it
+                self.directories.add(entry.path)
+                for root, dirs, files in os.walk(entry.path):
+                    dirs[:] = [d for d in dirs if not skip_dir(d)]
+                    self.directories.add(root)
+                    for name in files:
+                        self.update_file(os.path.join(root, name))
+                prefix = os.path.join(entry.path, '')
+                self.directories_found.emit([d for d in self.directories if d == entry.path or d.startswith(prefix)])
+        for path in [path for path in self.files if os.path.dirname(path) == directory and path not in present]:
+            self.remove(path)
+        for child in [d for d in self.directories if os.path.dirname(d) == directory and d not in present]:
+            self.forget(child)
+
+    def forget(self, directory):
+        # directory is gone along with everything indexed under it
+        prefix = os.path.join(directory, '')
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            self.remove(path)
+        self.directories = {d for d in self.directories if d != directory and not d.startswith(prefix)}
+
+    def candidates(self, needle):
+        if len(needle) < 3:
+            return sorted(file_id for file_id, _ in self.files.values())
+        postings = []
+        for i in range(len(needle) - 2):
+            ids = self.postings.get(needle[i:i + 3])
+            if ids is None:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        found = set(postings[0])
+        for ids in postings[1:]:
+            found.intersection_update(ids)
+            if not found:
+                return []
+        return sorted(file_id for file_id in found if self.paths[file_id] is not None)
+
+    def run_search(self, request):
+        start = time.perf_counter()
+        needle = request['text'].encode('utf-8').lower()
+        candidates = self.candidates(needle) if needle else []
+        batch = []
+        matches = 0
+        last_batch = start
+        for file_id in candidates:
+            if request is not self.latest or matches >= MAX_RESULTS:
+                break
+            path = self.paths[file_id]
+            matches += self.match_lines(path, needle, batch, MAX_RESULTS - matches)
+            now = time.perf_counter()
+            if batch and now - last_batch >= RESULT_BATCH_SECONDS:
+                self.results.emit(request, batch)
+                batch = []
+                last_batch = now
+        if batch:
+            self.results.emit(request, batch)
+        self.finished.emit(request, {'files': len(self.files), 'candidates': len(candidates), 'matches': matches, 'seconds': time.perf_counter() - start})
+
+    def match_lines(self, path, needle, out, limit):
+        # Appends up to limit (path, line, text) tuples, one per matching line
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return 0
+        lowered = data.lower()
+        pos = lowered.find(needle)
+        line = 0
+        counted_to = 0
+        found = 0
+        while pos != -1 and found < limit:
+            line_start = lowered.rfind(b'\n', 0, pos) + 1
+            line_end = lowered.find(b'\n', pos)
+            if line_end == -1:
+                line_end = len(lowered)
+            line += data.count(b'\n', counted_to, line_start)
+            counted_to = line_start
+            out.append((path, line, data[line_start:line_end].decode('utf-8', 'replace').strip()))
+            found += 1
+            pos = lowered.find(needle, line_end)
+        return found
+
+
+def open_index(project_dir):
+    project_dir = os.path.abspath(project_dir)
+    index = indexes.get(project_dir)
+    if index is None:
+        index = indexes[project_dir] = SearchIndex(project_dir)
+    return index
+
+
+def index_for(file_path):
+    # The innermost indexed project containing file_path, or None
+    return indexes.get(containing_project(indexes, file_path))
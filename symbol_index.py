@@ -0,0 +1,265 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import deque
+from project_files import containing_project, project_files
+from saving import write_atomic
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'devhub', 'symbols')
+CACHE_FORMAT = 1  # bump when the stored symbol tuples change
+PARSE_CHUNK_FILES = 200  # files per process-pool task
+MAX_MATCHES = 500  # locations returned per fuzzy query
+
+indexes = {}  # project_dir: SymbolIndex
+
+
+def file_symbols(path):
+    # [(name, kind, 1-based line, column, container)] for the classes,
+    # functions and module or class level assignments in a Python file
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    symbols = []
+
+    def visit(body, container, in_function):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                symbols.append((node.name, 'class', node.lineno, node.col_offset, container))
+                visit(node.body, f'{container}.{node.name}' if container else node.name, False)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                symbols.append((node.name, 'def', node.lineno, node.col_offset, container))
+                visit(node.body, f'{container}.{node.name}' if container else node.name, True)
+            elif in_function:
+                continue
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                for target in node.targets if isinstance(node, ast.Assign) else [node.target]:
+                    for name in ast.walk(target):
+                        if isinstance(name, ast.Name):
+                            symbols.append((name.id, 'variable', name.lineno, name.col_offset, container))
+            elif isinstance(node, (ast.If, ast.Try, ast.With, ast.For, ast.While)):
+                # Definitions under `if TYPE_CHECKING:`, `try: import ...` and the like
+                for field in ('body', 'orelse', 'finalbody'):
+                    visit(getattr(node, field, []), container, False)
+                for handler in getattr(node, 'handlers', []):
+                    visit(handler.body, container, False)
+    visit(tree.body, '', False)
+    return symbols
+
+
+def parse_chunk(paths):
+    # Runs in a pool process: (path, mtime_ns, size, symbols) per file, with
+    # no symbols for files that do not parse
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            symbols = file_symbols(path)
+        except OSError:
+            continue
+        except (SyntaxError, ValueError, RecursionError):
+            symbols = []
+        results.append((path, stat.st_mtime_ns, stat.st_size, symbols))
+    return results
+
+
+class SymbolIndex:
+    # Classes, functions and assignments of every Python file in a project,
+    # for go-to-definition and the Go to Symbol dialog. Built on a background
+    # thread: files whose mtime and size match the on-disk cache from the
+    # last run are reused, the rest are parsed with ast in a process pool,
+    # and the cache is rewritten. update() re-parses a single file, e.g.
+    # after a save.
+    #
+    # Lookups run on the calling thread. definitions() is a dict lookup;
+    # fuzzy() runs one regex over all distinct names joined into a single
+    # string, which the background thread rebuilds and swaps in whenever
+    # the set of names changes.
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.cache_path = os.path.join(CACHE_DIR, hashlib.sha1(project_dir.encode('utf-8')).hexdigest()[:16] + '.json.z')
+        self.files = {}  # path: (mtime_ns, size, symbols)
+        self.locations = {}  # name: [(path, line, column, kind, container)]
+        self.names = ({}, '')  # (offset: name, all names lowercased and joined by newlines)
+        self.names_changed = False
+        self.ready = threading.Event()
+        self.jobs = deque()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.submit(self.build)
+
+    def submit(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def update(self, path):
+        if path.endswith('.py'):
+            self.submit(lambda: self.update_file(path))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                job = self.jobs.popleft()
+            try:
+                job()
+            except Exception:
+                pass
+            if self.names_changed and not self.jobs:
+                self.publish_names()
+
+    def build(self):
+        cached = self.load_cache()
+        stale = []
+        for path in project_files(self.project_dir, '.py'):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = cached.get(path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self.add(path, *entry)
+            else:
+                stale.append(path)
+        chunks = [stale[i:i + PARSE_CHUNK_FILES] for i in range(0, len(stale), PARSE_CHUNK_FILES)]
+        if len(chunks) > 1:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [(pool.submit(parse_chunk, chunk), chunk) for chunk in chunks]
+                for future, chunk in futures:
+                    try:
+                        parsed = future.result()
+                    except Exception:
+                        parsed = parse_chunk(chunk)  # the pool could not run it
+                    for entry in parsed:
+                        self.add(*entry)
+        elif chunks:
+            for entry in parse_chunk(chunks[0]):
+                self.add(*entry)
+        if stale or len(cached) != len(self.files):
+            self.save_cache()
+        self.publish_names()
+        self.ready.set()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()))
+        except (OSError, ValueError, zlib.error):
+            return {}
+        if data.get('format') != CACHE_FORMAT or data.get('project_dir') != self.project_dir:
+            return {}
+        return {os.path.join(self.project_dir, path): (mtime_ns, size, [tuple(symbol) for symbol in symbols]) for path, (mtime_ns, size, symbols) in data['files'].items()}
+
+    def save_cache(self):
+        files = {os.path.relpath(path, self.project_dir): entry for path, entry in self.files.items()}
+        data = json.dumps({'format': CACHE_FORMAT, 'project_dir': self.project_dir, 'files': files}, separators=(',', ':'))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_atomic(self.cache_path, zlib.compress(data.encode('utf-8'), 1))
+
+    def add(self, path, mtime_ns, size, symbols):
+        self.remove(path)
+        self.files[path] = (mtime_ns, size, symbols)
+        for name, kind, line, column, container in symbols:
+            found = self.locations.get(name)
+            if found is None:
+                self.locations[name] = [(path, line, column, kind, container)]
+                self.names_changed = True
+            else:
+                found.append((path, line, column, kind, container))
+
+    def remove(self, path):
+        entry = self.files.pop(path, None)
+        if entry is None:
+            return
+        for name in {symbol[0] for symbol in entry[2]}:
+            found = [location for location in self.locations[name] if location[0] != path]
+            if found:
+                self.locations[name] = found
+            else:
+                del self.locations[name]
+                self.names_changed = True
+
+    def update_file(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+        entry = self.files.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            symbols = file_symbols(path)
+        except OSError:
+            self.remove(path)
+            return
+        except (SyntaxError, ValueError, RecursionError):
+            # Keep what the file had until it parses again
+            return
+        self.add(path, stat.st_mtime_ns, stat.st_size, symbols)
+
+    def publish_names(self):
+        names = sorted(self.locations)
+        starts = {}
+        offset = 0
+        for name in names:
+            starts[offset] = name
+            offset += len(name) + 1
+        self.names = (starts, '\n'.join(names).lower())
+        self.names_changed = False
+
+    def definitions(self, name, near=None):
+        # Locations of name, those in the file near first
+        found = self.locations.get(name, [])
+        return sorted(found, key=lambda location: (location[0] != near, location[0], location[1]))
+
+    def fuzzy(self, query, limit=MAX_MATCHES):
+        # Locations of the names containing query's characters in order,
+        # ignoring case. Tighter matches rank first, then matches nearer the
+        # start of the name, then shorter names, so an exact name comes
+        # before a prefix, a substring and a scattered match.
+        query = query.lower()
+        if not query:
+            return []
+        starts, text = self.names
+        pattern = re.compile('[^\n]*?'.join(re.escape(c) for c in query))
+        seen = set()
+        ranked = []
+        for match in pattern.finditer(text):
+            start = text.rfind('\n', 0, match.start()) + 1
+            if start in seen:
+                continue
+            seen.add(start)
+            end = text.find('\n', match.end())
+            if end == -1:
+                end = len(text)
+            ranked.append((match.end() - match.start(), match.start() - start, end - start, start))
+        ranked.sort()
+        results = []
+        for *_, start in ranked:
+            name = starts[start]
+            for location in self.locations.get(name, []):
+                results.append((name, *location))
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+def open_symbols(project_dir):
+    project_dir = os.path.abspath(project_dir)
+    index = indexes.get(project_dir)
+    if index is None:
+        index = indexes[project_dir] = SymbolIndex(project_dir)
+    return index
+
+
+def symbols_for(file_path):
+    # The innermost indexed project containing file_path, or None
+    return indexes.get(containing_project(indexes, file_path))